@@ -9,15 +9,134 @@ import subprocess
 import tempfile
 import json
 import shutil
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 
+from task_log import TaskOutputLog
+from claude_stream import StreamJsonUsage
+
+CLAUDE_TIMEOUT = 1800  # 秒，30分钟超时，支持复杂项目
+USAGE_REPORT_INTERVAL = 1.0  # 秒，执行中向调用方上报用量的最小间隔
+
+# --help 中可识别的参数；无法获取帮助文本时沿用一直以来使用的 --print / --dangerously-skip-permissions
+CLI_FLAGS = {
+    'print': '--print',
+    'skipPermissions': '--dangerously-skip-permissions',
+    'outputFormat': '--output-format',
+    'streamJson': 'stream-json',
+    'verbose': '--verbose',
+}
+LEGACY_FLAGS = ('print', 'skipPermissions')
+STOP_GRACE_SECONDS = 5  # 停止时先 terminate，超过该时间仍未退出的进程直接 kill
+
+
+class ExecutionInterrupted(Exception):
+    """执行器停止（服务退出）时正在运行的Claude进程被终止"""
+
+
+def detect_template(description):
+    """内置生成器对应的项目模板：snake / flappy / web / general（也用作Token估算的特征）"""
+    text = description.lower()
+    if "贪吃蛇" in description or "snake" in text:
+        return 'snake'
+    if "fly bird" in text or "flappy" in text or "小鸟" in description:
+        return 'flappy'
+    if "html" in text or "网页" in description:
+        return 'web'
+    return 'general'
+
+
+class ClaudeCLIProbe:
+    """
+    Claude CLI 能力探测 - 可执行文件路径、版本、支持的参数只探测一次并缓存，
+    之后每次只 stat 可执行文件，修改时间变化（升级/重装）或显式 refresh() 时重新探测
+    """
+
+    def __init__(self, command='claude'):
+        self.command = command
+        self.lock = threading.Lock()
+        self.info = None
+
+    def get(self):
+        """返回缓存的探测结果（可执行文件变化时重新探测）"""
+        info = self.info
+        if info is not None and self._signature(info.get('path')) == info.get('mtimeNs'):
+            return info
+        with self.lock:
+            if self.info is not None and self._signature(self.info.get('path')) == self.info.get('mtimeNs'):
+                return self.info
+            self.info = self._probe()
+            return self.info
+
+    def refresh(self):
+        """强制重新探测"""
+        with self.lock:
+            self.info = self._probe()
+            return self.info
+
+    def _signature(self, path):
+        # 未找到可执行文件时每次重新查找 PATH（不启动进程），安装后即可被发现
+        if not path:
+            return None if shutil.which(self.command) is None else -1
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return -1
+
+    def _probe(self):
+        path = shutil.which(self.command)
+        info = {
+            'available': False,
+            'path': path,
+            'mtimeNs': None,
+            'version': None,
+            'flags': {},
+            'probedAt': datetime.now().isoformat(),
+            'error': None
+        }
+        if not path:
+            info['error'] = f'找不到{self.command}命令'
+            print(f"[ClaudeCLIProbe] {info['error']}")
+            return info
+        info['mtimeNs'] = self._signature(path)
+        try:
+            version = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=5)
+            if version.returncode != 0:
+                info['error'] = (version.stderr or version.stdout).strip() or f'退出码 {version.returncode}'
+                print(f"[ClaudeCLIProbe] Claude CLI不可用: {info['error']}")
+                return info
+            info['version'] = version.stdout.strip()
+            help_text = subprocess.run([path, '--help'], capture_output=True, text=True, timeout=10).stdout
+        except (subprocess.TimeoutExpired, OSError) as e:
+            info['error'] = str(e)
+            print(f"[ClaudeCLIProbe] 探测失败: {e}")
+            return info
+
+        info['available'] = True
+        if help_text.strip():
+            info['flags'] = {name: flag in help_text for name, flag in CLI_FLAGS.items()}
+        else:
+            info['flags'] = {name: name in LEGACY_FLAGS for name in CLI_FLAGS}
+        supported = ', '.join(name for name, ok in info['flags'].items() if ok)
+        print(f"[ClaudeCLIProbe] {path} ({info['version']}) 支持: {supported}")
+        return info
+
 class ClaudeExecutor:
     """Claude Code执行器"""
     
-    def __init__(self, workspace_dir="~/vibecodetask-workspace"):
-        """初始化执行器"""
+    def __init__(self, workspace_dir="~/vibecodetask-workspace", output_format=None):
+        """
+        初始化执行器
+        output_format: auto（CLI支持时使用 stream-json 并统计用量）| text，默认读取 VIBE_CLAUDE_OUTPUT_FORMAT
+        """
         self.workspace_dir = Path(workspace_dir).expanduser().absolute()
+        self.output_format = (output_format or os.environ.get('VIBE_CLAUDE_OUTPUT_FORMAT', 'auto')).lower()
+        self.cli_probe = ClaudeCLIProbe()
+        self.processes = set()  # 正在运行的claude子进程，stop() 时统一终止
+        self.process_lock = threading.Lock()
+        self.stopping = threading.Event()
         self.ensure_workspace()
     
     def ensure_workspace(self):
@@ -25,25 +144,39 @@ class ClaudeExecutor:
         self.workspace_dir.mkdir(parents=True, exist_ok=True)
         print(f"[ClaudeExecutor] 工作目录: {self.workspace_dir}")
     
-    def execute_task(self, task_id, description):
-        """执行任务并返回结果"""
+    def execute_task(self, task_id, description, on_start=None, on_usage=None):
+        """
+        执行任务并返回结果
+        on_start(log_path) 在Claude开始运行前调用，调用方可据此记录输出日志位置；
+        on_usage(usage) 在 stream-json 模式下随输出上报累计用量（节流，结束时再报一次最终值）
+        """
         task_dir = self.workspace_dir / f"task_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         task_dir.mkdir(exist_ok=True)
+        # 日志放在任务目录之外，不计入生成文件
+        log_path = self.workspace_dir / 'logs' / f"{task_dir.name}.log"
         
         print(f"[ClaudeExecutor] 开始执行任务 {task_id}")
         print(f"[ClaudeExecutor] 任务目录: {task_dir}")
         print(f"[ClaudeExecutor] 任务描述: {description}")
         
         try:
-            # 切换到任务目录
-            original_cwd = os.getcwd()
-            os.chdir(task_dir)
-            
-            # 调用Claude Code CLI
-            result = self._call_claude_code(description, task_dir)
-            
-            # 回到原目录
-            os.chdir(original_cwd)
+            with TaskOutputLog(log_path) as output_log:
+                if on_start:
+                    on_start(str(log_path))
+
+                # 调用Claude Code CLI（子进程通过 cwd= 在任务目录中运行，不修改本进程的工作目录，
+                # 多个任务可在不同线程中同时执行）
+                result = self._call_claude_code(description, task_dir, output_log, on_usage)
+
+            if not result.get('success'):
+                return {
+                    'success': False,
+                    'error': result.get('error') or '未知错误',
+                    'task_dir': str(task_dir),
+                    'usage': result.get('usage'),
+                    'log_path': str(log_path),
+                    'execution_time': datetime.now().isoformat()
+                }
             
             # 生成执行报告
             report = self._generate_execution_report(task_id, description, task_dir, result)
@@ -54,6 +187,8 @@ class ClaudeExecutor:
                 'files_created': self._list_generated_files(task_dir),
                 'report': report,
                 'claude_output': result.get('output', ''),
+                'usage': result.get('usage'),
+                'log_path': str(log_path),
                 'execution_time': datetime.now().isoformat()
             }
             
@@ -65,21 +200,20 @@ class ClaudeExecutor:
                 'success': False,
                 'error': error_msg,
                 'task_dir': str(task_dir) if 'task_dir' in locals() else None,
+                'log_path': str(log_path),
                 'execution_time': datetime.now().isoformat()
             }
     
-    def _call_claude_code(self, description, task_dir):
-        """调用Claude Code CLI"""
+    def _call_claude_code(self, description, task_dir, output_log, on_usage=None):
+        """调用Claude Code CLI（输出逐行写入 output_log，不在内存中整体缓存）"""
         try:
-            # 首先尝试检查claude命令是否可用
-            check_result = subprocess.run(['claude', '--version'], 
-                                        capture_output=True, text=True, timeout=5)
-            
-            if check_result.returncode != 0:
+            # 使用缓存的探测结果，不再每个任务都启动一次 claude --version
+            cli = self.cli_probe.get()
+            if not cli['available']:
                 print(f"[ClaudeExecutor] Claude CLI不可用，使用内置文件生成器")
                 return self._generate_files_directly(description, task_dir)
             
-            print(f"[ClaudeExecutor] Claude版本: {check_result.stdout.strip()}")
+            print(f"[ClaudeExecutor] Claude版本: {cli['version']}")
             
             # 构建提示，明确要求生成文件
             enhanced_prompt = f"""
@@ -101,12 +235,30 @@ class ClaudeExecutor:
 """
             
             # 调用Claude Code使用正确的参数（跳过权限确认）
-            print(f"[ClaudeExecutor] 调用Claude Code（跳过权限确认）...")
-            claude_result = subprocess.run([
-                'claude', '--dangerously-skip-permissions', '--print', enhanced_prompt
-            ], capture_output=True, text=True, timeout=1800, cwd=str(task_dir))  # 30分钟超时，支持复杂项目
+            print(f"[ClaudeExecutor] 调用Claude Code（跳过权限确认），输出写入 {output_log.path}")
+            stream_json = self._use_stream_json(cli)
+            tracker = StreamJsonUsage() if stream_json else None
+            line_handler = self._usage_reporter(tracker, on_usage) if stream_json else None
+            try:
+                returncode = self._stream_process(self._build_command(cli, enhanced_prompt, stream_json),
+                                                  task_dir, output_log, timeout=CLAUDE_TIMEOUT,
+                                                  line_handler=line_handler)
+            finally:
+                # 无论成败，已经消耗的用量都要记下
+                if tracker is not None and tracker.has_usage:
+                    usage = tracker.usage()
+                    print(f"[ClaudeExecutor] 用量: {usage['totalTokens']:,} tokens, "
+                          f"{usage['turns']} 轮, {usage['toolCalls']} 次工具调用, 费用 {usage['costUsd']}")
+                    self._report_usage(on_usage, usage)
+            usage = tracker.usage() if tracker is not None and tracker.has_usage else None
+
+            if tracker is not None and tracker.is_error:
+                # stream-json 的 result 事件报告失败（如达到最大轮数）：按失败记录，不用内置生成器掩盖
+                error = tracker.error_message()
+                print(f"[ClaudeExecutor] {error}")
+                return {'success': False, 'output': output_log.summary(), 'error': error, 'usage': usage}
             
-            if claude_result.returncode == 0:
+            if returncode == 0:
                 print(f"[ClaudeExecutor] Claude执行成功")
                 # 检查是否实际生成了文件
                 files_created = self._list_generated_files(task_dir)
@@ -122,63 +274,18 @@ class ClaudeExecutor:
                 
                 return {
                     'success': True,
-                    'output': claude_result.stdout,
-                    'error': claude_result.stderr
+                    # stream-json 模式下原始事件只写入日志，报告中使用最终回复
+                    'output': tracker.result_text if tracker is not None and tracker.result_text else output_log.summary(),
+                    'error': None,
+                    'usage': usage
                 }
             else:
-                print(f"[ClaudeExecutor] Claude执行失败，使用内置生成器")
-                return self._generate_files_directly(description, task_dir)
-            
-            print(f"[ClaudeExecutor] Claude版本: {check_result.stdout.strip()}")
-            
-            # 构建提示，明确要求生成文件
-            enhanced_prompt = f"""
-{description}
-
-请直接执行这个任务，生成所有必要的文件。
-
-要求：
-1. 创建完整的项目文件结构
-2. 生成所有相关的代码文件
-3. 包含必要的配置文件
-4. 添加README.md说明文件
-5. 确保代码可以直接运行
-
-工作目录: {task_dir}
-请在当前目录下创建所有文件。
-
-重要：请直接使用Write工具创建文件，不要询问权限。
-"""
-            
-            # 调用Claude Code使用打印模式
-            print(f"[ClaudeExecutor] 调用Claude Code...")
-            claude_result = subprocess.run([
-                'claude', '--print', enhanced_prompt
-            ], capture_output=True, text=True, timeout=1800, cwd=str(task_dir))  # 30分钟超时，支持复杂项目
-            
-            if claude_result.returncode == 0:
-                print(f"[ClaudeExecutor] Claude执行成功")
-                # 检查是否实际生成了文件
-                files_created = self._list_generated_files(task_dir)
-                print(f"[ClaudeExecutor] 检查生成的文件数量: {len(files_created)}")
-                for f in files_created:
-                    print(f"[ClaudeExecutor]   - {f['name']} ({f['size']} bytes)")
-                
-                # 修复：如果没有生成任何文件（除了可能的日志文件），才使用内置生成器
-                actual_content_files = [f for f in files_created if not f['name'].endswith('.log') and f['size'] > 0]
-                if len(actual_content_files) == 0:
-                    print(f"[ClaudeExecutor] Claude未创建实际内容文件，使用内置生成器")
-                    return self._generate_files_directly(description, task_dir)
-                
-                return {
-                    'success': True,
-                    'output': claude_result.stdout,
-                    'error': claude_result.stderr
-                }
-            else:
-                print(f"[ClaudeExecutor] Claude执行失败，使用内置生成器")
+                print(f"[ClaudeExecutor] Claude执行失败（退出码 {returncode}），使用内置生成器")
                 return self._generate_files_directly(description, task_dir)
                 
+        except ExecutionInterrupted:
+            # 服务正在停止：不再用内置生成器兜底，任务按失败记录
+            raise
         except subprocess.TimeoutExpired:
             print(f"[ClaudeExecutor] Claude超时，使用内置生成器")
             return self._generate_files_directly(description, task_dir)
@@ -188,18 +295,125 @@ class ClaudeExecutor:
         except Exception as e:
             print(f"[ClaudeExecutor] Claude调用异常: {e}，使用内置生成器")
             return self._generate_files_directly(description, task_dir)
+
+    def _use_stream_json(self, cli):
+        """auto 模式下CLI支持 --output-format stream-json 时使用"""
+        flags = cli['flags']
+        return self.output_format != 'text' and bool(flags.get('outputFormat') and flags.get('streamJson'))
+
+    @staticmethod
+    def _build_command(cli, prompt, stream_json=False):
+        """按探测到的参数组装命令行"""
+        flags = cli['flags']
+        cmd = [cli['path']]
+        if flags.get('skipPermissions'):
+            cmd.append(CLI_FLAGS['skipPermissions'])
+        if stream_json:
+            # --print 模式下 stream-json 需要同时指定 --verbose
+            cmd += [CLI_FLAGS['outputFormat'], 'stream-json', CLI_FLAGS['verbose']]
+        cmd += [CLI_FLAGS['print'], prompt]
+        return cmd
+
+    @staticmethod
+    def _report_usage(on_usage, usage):
+        # 上报失败不能中断正在读取的子进程输出
+        if not on_usage:
+            return
+        try:
+            on_usage(usage)
+        except Exception as e:
+            print(f"[ClaudeExecutor] 用量上报失败: {e}")
+
+    def _usage_reporter(self, tracker, on_usage):
+        """逐行解析 stream-json 事件，用量变化时按 USAGE_REPORT_INTERVAL 节流上报"""
+        last_report = [0.0]
+
+        def handle(line):
+            if tracker.feed(line) and on_usage and tracker.has_usage:
+                now = time.monotonic()
+                if now - last_report[0] >= USAGE_REPORT_INTERVAL:
+                    last_report[0] = now
+                    self._report_usage(on_usage, tracker.usage())
+
+        return handle
+
+    def _stream_process(self, cmd, task_dir, output_log, timeout, line_handler=None):
+        """
+        运行子进程并把 stdout/stderr 合并后逐行写入日志，返回退出码
+        line_handler(line) 对每行输出调用一次；超过 timeout 秒时结束进程并抛出 subprocess.TimeoutExpired，
+        执行器被 stop() 时抛出 ExecutionInterrupted
+        """
+        with self.process_lock:
+            if self.stopping.is_set():
+                raise ExecutionInterrupted('执行器已停止')
+            process = subprocess.Popen(
+                cmd, cwd=str(task_dir), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                text=True, encoding='utf-8', errors='replace', bufsize=1
+            )
+            self.processes.add(process)
+        timed_out = threading.Event()
+
+        def kill_on_timeout():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill_on_timeout)
+        timer.daemon = True
+        timer.start()
+        try:
+            for line in process.stdout:
+                output_log.write_line(line)
+                if line_handler:
+                    line_handler(line)
+            returncode = process.wait()
+        finally:
+            timer.cancel()
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            with self.process_lock:
+                self.processes.discard(process)
+        if self.stopping.is_set() and process.returncode != 0:
+            output_log.write_line("[ClaudeExecutor] 服务停止，进程已终止")
+            raise ExecutionInterrupted('服务停止，Claude进程已终止')
+        if timed_out.is_set():
+            output_log.write_line(f"[ClaudeExecutor] 超过 {timeout} 秒未结束，进程已终止")
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return returncode
     
+    def stop(self, grace=STOP_GRACE_SECONDS):
+        """终止所有正在运行的claude进程（先 terminate，grace 秒后仍未退出则 kill），之后不再启动新进程"""
+        with self.process_lock:
+            self.stopping.set()
+            processes = list(self.processes)
+        if not processes:
+            return 0
+        print(f"[ClaudeExecutor] 终止 {len(processes)} 个正在运行的Claude进程")
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.time() + grace
+        for process in processes:
+            try:
+                process.wait(timeout=max(deadline - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        return len(processes)
+
     def _generate_files_directly(self, description, task_dir):
         """直接生成文件（当Claude CLI不可用时）"""
         try:
             print(f"[ClaudeExecutor] 使用内置文件生成器创建项目文件...")
             
             # 内置生成游戏
-            if "贪吃蛇" in description or "snake" in description.lower():
+            template = detect_template(description)
+            if template == 'snake':
                 self._create_snake_game(task_dir, description)
-            elif "fly bird" in description.lower() or "flappy" in description.lower() or "小鸟" in description:
+            elif template == 'flappy':
                 self._create_fly_bird_game(task_dir, description)
-            elif "html" in description.lower() or "网页" in description:
+            elif template == 'web':
                 self._create_web_project(task_dir, description)
             else:
                 self._create_general_project(task_dir, description)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Claude CLI stream-json 输出解析
+`claude --print --output-format stream-json --verbose` 每行输出一个JSON事件，
+逐行解析并累计该任务的 Token、费用、轮数与工具调用。
+"""
+
+import json
+
+USAGE_FIELDS = {
+    'input_tokens': 'inputTokens',
+    'output_tokens': 'outputTokens',
+    'cache_creation_input_tokens': 'cacheCreationTokens',
+    'cache_read_input_tokens': 'cacheReadTokens',
+}
+
+
+class StreamJsonUsage:
+    """
+    增量累计一次执行的用量
+    同一条assistant消息的多个内容块会以多条事件输出且携带相同的usage，按消息id去重；
+    最终的 result 事件给出权威的总用量与费用，收到后以它为准
+    """
+
+    def __init__(self):
+        self.message_usage = {}  # 消息id -> usage
+        self.final_usage = None
+        self.cost_usd = None
+        self.turns = None
+        self.tool_calls = 0
+        self.model = None
+        self.session_id = None
+        self.result_text = None
+        self.subtype = None
+        self.is_error = None
+        self.events = 0
+
+    def feed(self, line):
+        """解析一行输出，用量或统计发生变化时返回True；非JSON行（如stderr）忽略"""
+        line = line.strip()
+        if not line.startswith('{'):
+            return False
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return False
+        if not isinstance(event, dict):
+            return False
+        self.events += 1
+        self.session_id = event.get('session_id') or self.session_id
+
+        event_type = event.get('type')
+        if event_type == 'system':
+            self.model = event.get('model') or self.model
+            return False
+        if event_type == 'assistant':
+            message = event.get('message')
+            return self._on_assistant(message) if isinstance(message, dict) else False
+        if event_type == 'result':
+            return self._on_result(event)
+        return False
+
+    def _on_assistant(self, message):
+        self.model = message.get('model') or self.model
+        changed = False
+        for block in message.get('content') or ():
+            if isinstance(block, dict) and block.get('type') == 'tool_use':
+                self.tool_calls += 1
+                changed = True
+        usage = message.get('usage')
+        if isinstance(usage, dict):
+            key = message.get('id') or len(self.message_usage)
+            if self.message_usage.get(key) != usage:
+                self.message_usage[key] = usage
+                changed = True
+        return changed
+
+    def _on_result(self, event):
+        if isinstance(event.get('usage'), dict):
+            self.final_usage = event['usage']
+        cost = event.get('total_cost_usd', event.get('cost_usd'))
+        if cost is not None:
+            self.cost_usd = float(cost)
+        if event.get('num_turns') is not None:
+            self.turns = int(event['num_turns'])
+        self.result_text = event.get('result')
+        self.subtype = event.get('subtype')
+        self.is_error = bool(event.get('is_error')) or self.subtype not in (None, 'success')
+        return True
+
+    def usage(self):
+        """当前累计用量（camelCase，可直接写入任务行）"""
+        if self.final_usage is not None:
+            sources = [self.final_usage]
+        else:
+            sources = list(self.message_usage.values())
+        totals = {name: 0 for name in USAGE_FIELDS.values()}
+        for usage in sources:
+            for raw_name, name in USAGE_FIELDS.items():
+                totals[name] += int(usage.get(raw_name) or 0)
+        totals['totalTokens'] = sum(totals.values())
+        totals.update({
+            'costUsd': self.cost_usd,
+            'turns': self.turns if self.turns is not None else len(self.message_usage),
+            'toolCalls': self.tool_calls,
+            'model': self.model,
+        })
+        return totals
+
+    def error_message(self):
+        """result 事件报告失败时的说明（如 error_max_turns），未失败时返回None"""
+        if not self.is_error:
+            return None
+        detail = self.result_text.strip() if isinstance(self.result_text, str) and self.result_text.strip() else ''
+        return f"Claude执行出错（{self.subtype or 'error'}）" + (f": {detail[:500]}" if detail else '')
+
+    @property
+    def has_usage(self):
+        return self.final_usage is not None or bool(self.message_usage)
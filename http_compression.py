@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+HTTP 响应压缩
+按 Accept-Encoding 协商 br / gzip（未安装 brotli 时只用 gzip），小于阈值的响应不压缩；
+静态文件在启动或文件变更时预先压缩好所有编码版本，动态JSON按请求即时压缩。
+"""
+
+import os
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024  # 字节，更小的响应压缩收益不抵开销
+
+# 动态响应追求速度，静态文件只压缩一次，用最高压缩率
+GZIP_LEVEL_DYNAMIC = 6
+GZIP_LEVEL_STATIC = 9
+BROTLI_QUALITY_DYNAMIC = 5
+BROTLI_QUALITY_STATIC = 11
+
+
+def supported_encodings():
+    """服务端支持的编码，按优先级排列"""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def negotiate(accept_encoding):
+    """根据 Accept-Encoding 选择编码，不接受压缩时返回None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding, static=False):
+    """按指定编码压缩字节串"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY_STATIC if static else BROTLI_QUALITY_DYNAMIC)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL_STATIC if static else GZIP_LEVEL_DYNAMIC, mtime=0)
+    raise ValueError(f"不支持的编码: {encoding}")
+
+
+def precompress(body):
+    """生成所有支持编码的压缩版本 {encoding: bytes}，小文件返回空字典"""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return {}
+    return {encoding: compress(body, encoding, static=True) for encoding in supported_encodings()}
+
+
+def encode_body(body, accept_encoding, variants=None):
+    """
+    选择响应体与 Content-Encoding
+    返回 (payload, encoding, compressible)；compressible 为 True 时应发送 Vary: Accept-Encoding
+    """
+    if len(body) < MIN_COMPRESS_SIZE:
+        return body, None, False
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return body, None, True
+    if variants and encoding in variants:
+        return variants[encoding], encoding, True
+    return compress(body, encoding), encoding, True
+
+
+class StaticAssetCache:
+    """静态文件缓存 - 文件内容（可选经 transform 处理）及其预压缩版本常驻内存，修改时间变化时重建"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assets = {}  # path -> {'mtime_ns', 'etag', 'body', 'variants'}
+
+    def get(self, path, transform=None):
+        """返回 {'etag', 'body', 'variants'}，文件不存在时返回None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        asset = self.assets.get(path)
+        if asset is None or asset['mtime_ns'] != stat.st_mtime_ns:
+            with self.lock:
+                asset = self.assets.get(path)
+                if asset is None or asset['mtime_ns'] != stat.st_mtime_ns:
+                    asset = self._build(path, stat, transform)
+                    self.assets[path] = asset
+        return asset
+
+    @staticmethod
+    def _build(path, stat, transform):
+        with open(path, 'rb') as f:
+            body = f.read()
+        if transform:
+            body = transform(body.decode('utf-8')).encode('utf-8')
+        variants = precompress(body)
+        sizes = ', '.join(f"{enc} {len(data):,}" for enc, data in variants.items())
+        print(f"[StaticAssetCache] 已缓存 {os.path.basename(path)} ({len(body):,} 字节{'; ' + sizes if sizes else ''})")
+        return {
+            'mtime_ns': stat.st_mtime_ns,
+            'etag': f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            'body': body,
+            'variants': variants
+        }
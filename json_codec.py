@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+API 响应 JSON 序列化
+默认输出紧凑JSON（?pretty=1 时缩进两格），安装了 orjson 时优先使用；
+内容不变的快照（如Token状态）按键缓存编码后的字节，重复请求不再序列化。
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+
+def dumps(data, pretty=False):
+    """序列化为UTF-8字节串"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        try:
+            return orjson.dumps(data, option=option)
+        except TypeError:
+            # orjson 不支持的类型（如超过64位的整数）交给标准库处理
+            pass
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def wants_pretty(query):
+    """?pretty=1 / true / yes 时输出缩进JSON（query 为 parse_qs 的结果）"""
+    return query.get('pretty', [''])[0].lower() in ('1', 'true', 'yes')
+
+
+class EncodedCache:
+    """已编码响应体的LRU缓存 - 键由调用方给出（如快照的ETag），键相同即内容相同"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (key, pretty) -> bytes
+
+    def encode(self, key, data, pretty=False):
+        """返回 data 的编码结果，同一键只序列化一次"""
+        cache_key = (key, pretty)
+        with self.lock:
+            body = self.entries.get(cache_key)
+            if body is not None:
+                self.entries.move_to_end(cache_key)
+                return body
+        body = dumps(data, pretty)
+        with self.lock:
+            self.entries[cache_key] = body
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return body
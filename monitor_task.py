@@ -14,12 +14,34 @@ def monitor_task(task_id=None):
     print("🔍 任务进度监控器")
     print("="*50)
     
+    fields = 'id,description,type,status,createdAt,taskDirectory,result,filesCreated'
+    tasks_by_id = {}
+    revision = None
+    
     while True:
         try:
-            # 获取任务列表
-            response = requests.get('http://localhost:8080/api/tasks')
-            data = response.json()
-            tasks = data.get('tasks', [])
+            # 首次获取任务列表，之后只获取上次版本号之后的变更
+            if revision is None:
+                response = requests.get('http://localhost:8080/api/tasks',
+                                        params={'fields': fields, 'limit': 200})
+                data = response.json()
+                tasks_by_id = {t['id']: t for t in data.get('tasks', [])}
+            else:
+                response = requests.get('http://localhost:8080/api/tasks',
+                                        params={'fields': fields, 'since': revision})
+                data = response.json()
+                if data.get('reset'):
+                    revision = None
+                    continue
+                if data.get('revision') == revision:
+                    time.sleep(3)
+                    continue
+                for deleted_id in data.get('deleted', []):
+                    tasks_by_id.pop(deleted_id, None)
+                for task in data.get('tasks', []):
+                    tasks_by_id[task['id']] = task
+            revision = data.get('revision')
+            tasks = sorted(tasks_by_id.values(), key=lambda t: t['id'], reverse=True)
             
             if not tasks:
                 print("❌ 没有找到任务")
@@ -8,14 +8,16 @@ import subprocess
 import time
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
+from usage_ingester import UsageIngester, default_log_dirs
 
 class RealTokenManager:
-    """真实Token管理器 - 使用ccusage获取实时数据"""
+    """真实Token管理器 - 优先读取本地Claude日志，找不到日志时使用ccusage"""
     
-    def __init__(self):
+    def __init__(self, db_path=None):
         self.cache_expire_time = 60  # 缓存60秒
         self.last_update = 0
         self.cached_data = None
+        self.ingester = UsageIngester(db_path) if default_log_dirs() else None
     
     def get_current_usage(self) -> Dict:
         """获取当前使用情况"""
@@ -28,6 +30,13 @@ class RealTokenManager:
         try:
             # 获取今天的使用数据
             today = datetime.now().strftime('%Y%m%d')
+            if self.ingester:
+                self.ingester.refresh()
+                usage_info = self._parse_usage_data(self.ingester.daily_report(today))
+                self.cached_data = usage_info
+                self.last_update = now
+                return usage_info
+
             result = subprocess.run(
                 ['ccusage', 'daily', '--json', '-s', today],
                 capture_output=True,
@@ -60,6 +69,10 @@ class RealTokenManager:
     def get_active_block_info(self) -> Dict:
         """获取当前活动block信息"""
         try:
+            if self.ingester:
+                self.ingester.refresh()
+                return self._parse_block_data(self.ingester.active_block_report())
+
             result = subprocess.run(
                 ['ccusage', 'blocks', '--json', '--active'],
                 capture_output=True,
@@ -6,46 +6,434 @@ VibeCodeTask 实时监控服务器
 
 import os
 import json
+import base64
+import hashlib
 import time
+import heapq
+import queue
+import socket
 import subprocess
 import threading
+import uuid
 import shutil
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from datetime import datetime, timedelta
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-import sqlite3
 import webbrowser
 from claude_executor import ClaudeExecutor
+from usage_ingester import UsageIngester, default_log_dirs
+from usage_summary import summarize_daily
+from sqlite_pool import get_pool, tasks_db_path
+from http_compression import StaticAssetCache, encode_body, negotiate
+from task_log import parse_byte_range, read_log_range, stat_log
+from token_estimator import TokenEstimator
+import json_codec
+
+# tasks表索引（init_database 中幂等创建），与下方热点查询一一对应
+TASK_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_tasks_status_scheduled ON tasks(status, scheduled_time)',
+    'CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_tasks_status_updated ON tasks(status, updated_at)',
+    'CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_tasks_revision ON tasks(revision)',
+)
+
+# 任务列表可投影字段 -> SQL表达式；默认不返回体积大的 result / filesCreated（见 /api/tasks/<id>）
+TASK_FIELDS = {
+    'id': 'id',
+    'description': 'description',
+    'type': 'type',
+    'status': 'status',
+    'scheduledTime': 'scheduled_time',
+    'createdAt': 'created_at',
+    'updatedAt': 'updated_at',
+    'estimatedTokens': 'estimated_tokens',
+    'estimatedTokensLow': 'estimated_tokens_low',
+    'estimatedTokensHigh': 'estimated_tokens_high',
+    'actualTokens': 'actual_tokens',
+    'taskDirectory': 'task_directory',
+    'hasResult': "(result IS NOT NULL AND result != '')",
+    'filesCount': "CASE WHEN json_valid(files_created) THEN json_array_length(files_created) ELSE 0 END",
+    'result': 'result',
+    'filesCreated': 'files_created',
+    'revision': 'revision',
+    'logPath': 'log_path',
+    'inputTokens': 'input_tokens',
+    'outputTokens': 'output_tokens',
+    'cacheCreationTokens': 'cache_creation_tokens',
+    'cacheReadTokens': 'cache_read_tokens',
+    'costUsd': 'cost_usd',
+    'numTurns': 'num_turns',
+    'toolCalls': 'tool_calls',
+    'model': 'model',
+}
+# 执行用量字段：任务行列名 -> 类型（值来自 ClaudeExecutor 的 on_usage 上报）
+TASK_USAGE_COLUMNS = (
+    ('input_tokens', 'INTEGER'),
+    ('output_tokens', 'INTEGER'),
+    ('cache_creation_tokens', 'INTEGER'),
+    ('cache_read_tokens', 'INTEGER'),
+    ('cost_usd', 'REAL'),
+    ('num_turns', 'INTEGER'),
+    ('tool_calls', 'INTEGER'),
+    ('model', 'TEXT'),
+)
+DEFAULT_TASK_FIELDS = tuple(f for f in TASK_FIELDS if f not in ('result', 'filesCreated'))
+
+# 热点查询（test_query_plans.py 用 EXPLAIN QUERY PLAN 检查它们都走索引）
+SQL_PENDING_TASKS = "SELECT id, type, scheduled_time FROM tasks WHERE status = 'pending' ORDER BY scheduled_time"
+SQL_COUNT_TASKS_BY_STATUS = 'SELECT status, COUNT(*) FROM tasks GROUP BY status'
+SQL_CURRENT_REVISION = 'SELECT value FROM task_revision WHERE id = 1'
+SQL_CHANGED_SINCE = 'SELECT {columns} FROM tasks WHERE revision > ? ORDER BY revision'
+SQL_DELETED_SINCE = 'SELECT task_id FROM task_tombstones WHERE revision > ? ORDER BY revision'
+SQL_RECOVER_STUCK_TASKS = '''
+    UPDATE tasks
+    SET status = 'failed', result = COALESCE(result, '') || '[自动恢复] 运行超时，已标记失败', updated_at = ?,
+        lease_owner = NULL, lease_expires = NULL, revision = (SELECT value + 1 FROM task_revision WHERE id = 1)
+    WHERE status = 'running'
+      AND (lease_expires < ? OR (lease_expires IS NULL AND updated_at < ?))
+'''
+
+SERVER_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.log')
 
 # 简单日志追加到文件（不替换现有print）
 def append_log(message: str):
     try:
-        log_path = os.path.join(os.path.dirname(__file__), 'server.log')
         ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with open(log_path, 'a', encoding='utf-8') as f:
+        with open(SERVER_LOG_PATH, 'a', encoding='utf-8') as f:
             f.write(f"[{ts}] {message}\n")
     except Exception:
         pass
 
+class HistoryCache:
+    """历史数据TTL缓存 - 按天数范围独立计时，容量受限（最久未使用的先淘汰）"""
+
+    def __init__(self, ttl=60, max_entries=8):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # days -> (stored_at, processed_data)
+        self.lock = threading.Lock()
+
+    def get(self, days):
+        """返回未过期的处理结果，没有则返回None"""
+        with self.lock:
+            entry = self._get_fresh(days)
+            return entry[1] if entry else None
+
+    def put(self, days, processed_data, stored_at=None):
+        """写入缓存并按容量淘汰"""
+        with self.lock:
+            self.entries[days] = (stored_at or time.time(), processed_data)
+            self.entries.move_to_end(days)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def find_covering(self, days):
+        """返回覆盖该范围的未过期缓存的写入时间，没有则返回None"""
+        with self.lock:
+            for cached_days in sorted(d for d in self.entries if d > days):
+                entry = self._get_fresh(cached_days)
+                if entry:
+                    return entry[0]
+        return None
+
+    def _get_fresh(self, days):
+        entry = self.entries.get(days)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= self.ttl:
+            del self.entries[days]
+            return None
+        self.entries.move_to_end(days)
+        return entry
+
+
+class UsageDailyStore:
+    """每日用量汇总表 usage_daily - 已结束的日期写入后不再变化，只刷新今天"""
+
+    def __init__(self, db_path=None, backfill_days=365, today_max_age=300):
+        self.db_path = os.path.abspath(db_path or tasks_db_path())
+        self.db = get_pool(self.db_path)
+        self.backfill_days = backfill_days  # 首次同步回溯的天数
+        self.today_max_age = today_max_age  # 今天的数据超过该秒数未更新时重新获取
+        self.init_database()
+
+    def init_database(self):
+        """初始化汇总表"""
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS usage_daily (
+                    date TEXT PRIMARY KEY,
+                    input_tokens INTEGER DEFAULT 0,
+                    output_tokens INTEGER DEFAULT 0,
+                    cache_creation_tokens INTEGER DEFAULT 0,
+                    cache_read_tokens INTEGER DEFAULT 0,
+                    total_tokens INTEGER DEFAULT 0,
+                    total_cost REAL DEFAULT 0,
+                    models_used TEXT,
+                    model_breakdowns TEXT,
+                    closed INTEGER DEFAULT 0,
+                    updated_at TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS usage_daily_sync (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    closed_through TEXT,
+                    synced_at TEXT
+                )
+            ''')
+            cursor.execute('PRAGMA table_info(usage_daily_sync)')
+            if 'synced_at' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute('ALTER TABLE usage_daily_sync ADD COLUMN synced_at TEXT')
+
+    @staticmethod
+    def _normalize_date(value):
+        """YYYYMMDD / YYYY-MM-DD -> YYYY-MM-DD"""
+        value = value.replace('-', '')
+        return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+
+    def record_days(self, days):
+        """写入每日数据（ccusage daily格式）；今天之前的日期标记为已结束，之后不再覆盖"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        now = datetime.now().isoformat()
+        rows = []
+        for day in days:
+            if not day.get('date'):
+                continue
+            date = self._normalize_date(day['date'])
+            rows.append((
+                date,
+                day.get('inputTokens', 0),
+                day.get('outputTokens', 0),
+                day.get('cacheCreationTokens', 0),
+                day.get('cacheReadTokens', 0),
+                day.get('totalTokens', 0),
+                day.get('totalCost', 0.0),
+                json.dumps(day.get('modelsUsed', [])),
+                json.dumps(day.get('modelBreakdowns', [])),
+                1 if date < today else 0,
+                now
+            ))
+        if not rows:
+            return
+
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO usage_daily (date, input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens,
+                                         total_tokens, total_cost, models_used, model_breakdowns, closed, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(date) DO UPDATE SET
+                    input_tokens = excluded.input_tokens,
+                    output_tokens = excluded.output_tokens,
+                    cache_creation_tokens = excluded.cache_creation_tokens,
+                    cache_read_tokens = excluded.cache_read_tokens,
+                    total_tokens = excluded.total_tokens,
+                    total_cost = excluded.total_cost,
+                    models_used = excluded.models_used,
+                    model_breakdowns = excluded.model_breakdowns,
+                    closed = excluded.closed,
+                    updated_at = excluded.updated_at
+                WHERE usage_daily.closed = 0
+            ''', rows)
+
+    def sync(self, fetch_daily):
+        """补齐尚未结束写入的日期；今天的数据过旧时一并刷新。fetch_daily(YYYYMMDD) 返回daily列表"""
+        today = datetime.now().date()
+        yesterday = today - timedelta(days=1)
+
+        conn = self.db.connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT closed_through, synced_at FROM usage_daily_sync WHERE id = 1')
+        row = cursor.fetchone()
+
+        if row and row[0]:
+            start = datetime.fromisoformat(row[0]).date() + timedelta(days=1)
+        else:
+            start = today - timedelta(days=self.backfill_days)
+
+        if start > yesterday:
+            # 按上次同步时间判断（今天没有用量时不存在今天的行，不能以行的更新时间为准）
+            synced_age = (datetime.now() - datetime.fromisoformat(row[1])).total_seconds() if row and row[1] else None
+            if synced_age is not None and synced_age < self.today_max_age:
+                return
+            start = today
+
+        self.record_days(fetch_daily(start.strftime('%Y%m%d')))
+
+        closed_through = yesterday.isoformat() if start <= yesterday else (row[0] if row else None)
+        with self.db.transaction() as conn:
+            conn.execute('''
+                INSERT INTO usage_daily_sync (id, closed_through, synced_at) VALUES (1, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET closed_through = excluded.closed_through, synced_at = excluded.synced_at
+            ''', (closed_through, datetime.now().isoformat()))
+
+    def history(self, start_date):
+        """按日期范围查询每日数据（主键范围查询），合计与概览由 summarize_daily 计算"""
+        start = self._normalize_date(start_date)
+        conn = self.db.connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT date, input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens,
+                   total_tokens, total_cost, models_used, model_breakdowns
+            FROM usage_daily WHERE date >= ? ORDER BY date
+        ''', (start,))
+        daily = [{
+            'date': row[0],
+            'inputTokens': row[1],
+            'outputTokens': row[2],
+            'cacheCreationTokens': row[3],
+            'cacheReadTokens': row[4],
+            'totalTokens': row[5],
+            'totalCost': row[6],
+            'modelsUsed': json.loads(row[7] or '[]'),
+            'modelBreakdowns': json.loads(row[8] or '[]')
+        } for row in cursor.fetchall()]
+
+        totals, summary = summarize_daily(daily)
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'error': None,
+            'daily': daily,
+            'totals': totals,
+            'summary': summary
+        }
+
+
 class TokenMonitor:
     """实时Token监控器"""
     
-    def __init__(self):
+    def __init__(self, refresh_interval=None, usage_backend=None, db_path=None):
         self.cache = {}
-        self.history_cache = {}
+        self.history_cache = HistoryCache(ttl=60, max_entries=8)  # 历史数据按范围缓存1分钟
+        self.usage_store = UsageDailyStore(db_path)
         self.last_update = 0
-        self.last_history_update = 0
         self.cache_duration = 30  # 30秒缓存
-        self.history_cache_duration = 300  # 历史数据5分钟缓存
-    
+        self.refresh_interval = refresh_interval or self.cache_duration  # 后台刷新周期
+        self.ccusage_timeout = 10  # daily与blocks查询共享的超时预算（秒）
+        self.ccusage_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ccusage')
+
+        # 数据来源：native 直接增量读取Claude日志，ccusage 调用子进程；auto 在找到日志目录时使用native
+        backend = usage_backend or os.environ.get('VIBE_USAGE_BACKEND', 'auto')
+        self.ingester = None
+        if backend == 'native' or (backend == 'auto' and default_log_dirs()):
+            self.ingester = UsageIngester(db_path)
+        self.usage_backend = 'native' if self.ingester else 'ccusage'
+        print(f"[TokenMonitor] 使用数据来源: {self.usage_backend}")
+        self.refresh_lock = threading.Lock()  # 同一时间只允许一个刷新
+        self.last_error_data = None
+        self.last_attempt = 0
+        self.refresher_thread = None
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """注册快照更新监听器 callback(token_data)"""
+        self.listeners.append(callback)
+
     def get_real_time_data(self):
-        """获取实时Token数据"""
+        """获取实时Token数据（过期时返回旧快照并在后台刷新）"""
         now = time.time()
         
         # 检查缓存
         if self.cache and (now - self.last_update) < self.cache_duration:
             return self.cache
-        
+
+        # 缓存过期：一个调用方触发后台刷新，所有调用方立即拿到上一份有效快照
+        # 刷新失败时不更新 last_update，按 last_attempt 限制每个缓存周期最多重试一次
+        if self.cache:
+            if (now - self.last_attempt) >= self.cache_duration:
+                self._refresh_in_background()
+            return dict(self.cache, stale=True)
+
+        # 冷启动：只有一个调用方执行刷新，其余调用方等待并复用其结果
+        with self.refresh_lock:
+            if self.cache:
+                return self.cache
+            if self.last_error_data and (time.time() - self.last_attempt) < self.cache_duration:
+                return self.last_error_data
+            return self._refresh()
+
+    def start_background_refresh(self):
+        """启动后台刷新线程，按 refresh_interval 保持快照温热"""
+        if self.refresher_thread and self.refresher_thread.is_alive():
+            return
+
+        def refresh_loop():
+            print(f"[TokenMonitor] 后台刷新已启动，每{self.refresh_interval}秒刷新一次")
+            while True:
+                if self.refresh_lock.acquire(blocking=False):
+                    try:
+                        self._refresh()
+                    finally:
+                        self.refresh_lock.release()
+                time.sleep(self.refresh_interval)
+
+        self.refresher_thread = threading.Thread(target=refresh_loop, daemon=True)
+        self.refresher_thread.start()
+
+    def _refresh_in_background(self):
+        """如果当前没有刷新在进行，则启动一次后台刷新"""
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._refresh()
+            finally:
+                self.refresh_lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _refresh(self):
+        """执行一次刷新（调用方需持有 refresh_lock），成功时更新快照并通知监听器"""
+        self.last_attempt = time.time()
+        data = self._fetch_real_time_data()
+        if data.get('status') == 'unknown':
+            self.last_error_data = data
+            return dict(self.cache, stale=True, error=data['error']) if self.cache else data
+
+        data['stale'] = False
+        self.cache = data
+        self.last_update = time.time()
+        self.last_error_data = None
+        for callback in list(self.listeners):
+            try:
+                callback(data)
+            except Exception as e:
+                print(f"[TokenMonitor] 快照更新通知失败: {e}")
+        return data
+
+    def _fetch_real_time_data(self):
+        """获取实时Token数据（原生采集或ccusage）"""
+        if self.ingester:
+            return self._fetch_native_data()
+        return self._fetch_ccusage_data()
+
+    def _fetch_native_data(self):
+        """从原生日志采集器获取实时Token数据，不启动任何子进程"""
+        try:
+            self.ingester.refresh()
+            daily_data = self.ingester.daily_report(datetime.now().strftime('%Y%m%d'))
+            self._record_today(daily_data)
+            processed_data = self._process_data({
+                'error': None,
+                'daily': daily_data,
+                'blocks': self.ingester.active_block_report()
+            })
+            processed_data['partial'] = False
+            processed_data['backend'] = 'native'
+            return processed_data
+        except Exception as e:
+            print(f"[TokenMonitor] 原生采集错误: {e}")
+            return self._get_error_data(f"读取使用日志失败: {str(e)}")
+
+    def _fetch_ccusage_data(self):
+        """调用ccusage获取实时Token数据"""
         try:
             print("[TokenMonitor] 获取实时Token数据...")
             
@@ -53,37 +441,36 @@ class TokenMonitor:
             ccusage_bin = self._resolve_ccusage()
             env = self._build_env()
 
-            # 获取今日使用数据
-            daily_result = subprocess.run([
-                ccusage_bin, 'daily', '--json', '-s', datetime.now().strftime('%Y%m%d')
-            ], capture_output=True, text=True, timeout=10, env=env)
-            
-            # 获取活跃Block数据
-            block_result = subprocess.run([
-                ccusage_bin, 'blocks', '--json', '--active'
-            ], capture_output=True, text=True, timeout=10, env=env)
+            # 并行获取今日使用数据与活跃Block数据，两者共享同一个超时预算
+            results = self._run_ccusage_parallel({
+                'daily': [ccusage_bin, 'daily', '--json', '-s', datetime.now().strftime('%Y%m%d')],
+                'blocks': [ccusage_bin, 'blocks', '--json', '--active']
+            }, env, self.ccusage_timeout)
+
+            if results['daily'] is None and results['blocks'] is None:
+                raise subprocess.TimeoutExpired('ccusage', self.ccusage_timeout)
             
             data = {'error': None}
             
-            if daily_result.returncode == 0:
-                daily_data = json.loads(daily_result.stdout)
-                data['daily'] = daily_data
-            else:
-                data['daily'] = None
-                data['error'] = f"Daily data error: {daily_result.stderr}"
-            
-            if block_result.returncode == 0:
-                block_data = json.loads(block_result.stdout)
-                data['blocks'] = block_data
-            else:
-                data['blocks'] = None
+            for key, label in (('daily', 'Daily'), ('blocks', 'Block')):
+                result = results[key]
+                data[key] = None
+                if result is None:
+                    error = f"{label} data timeout"
+                elif result.returncode == 0:
+                    data[key] = json.loads(result.stdout)
+                    continue
+                else:
+                    error = f"{label} data error: {result.stderr}"
                 if not data['error']:
-                    data['error'] = f"Block data error: {block_result.stderr}"
+                    data['error'] = error
             
-            # 处理和缓存数据
+            self._record_today(data['daily'])
+
+            # 处理数据（只有一个查询成功时返回部分结果）
             processed_data = self._process_data(data)
-            self.cache = processed_data
-            self.last_update = now
+            processed_data['partial'] = (data['daily'] is None) != (data['blocks'] is None)
+            processed_data['backend'] = 'ccusage'
             
             print(f"[TokenMonitor] 数据更新完成，Token使用: {processed_data.get('totalTokens', 0)}")
             return processed_data
@@ -97,6 +484,22 @@ class TokenMonitor:
             print(f"[TokenMonitor] 错误: {e}")
             return error_data
 
+    def _run_ccusage_parallel(self, commands, env, timeout):
+        """同时启动多个ccusage命令，返回 {名称: CompletedProcess}，超时的命令结果为None"""
+        deadline = time.monotonic() + timeout
+
+        def run(args):
+            remaining = max(0.1, deadline - time.monotonic())
+            try:
+                return subprocess.run(args, capture_output=True, text=True, timeout=remaining, env=env)
+            except subprocess.TimeoutExpired:
+                print(f"[TokenMonitor] ccusage {args[1]} 超时")
+                return None
+
+        futures = {name: self.ccusage_pool.submit(run, args) for name, args in commands.items()}
+        wait_futures(futures.values())
+        return {name: future.result() for name, future in futures.items()}
+
     def _resolve_ccusage(self) -> str:
         """优先使用系统 ccusage，找不到则回退到本地 node_modules/.bin"""
         # 1) PATH 中查找
@@ -212,206 +615,349 @@ class TokenMonitor:
         }
     
     def get_historical_data(self, days=30):
-        """获取历史数据 (最近N天)"""
-        now = time.time()
-        
-        # 检查历史数据缓存 - 减少缓存时间以确保数据新鲜度
-        cache_key = f"history_{days}"
-        cache_duration = 60  # 减少到1分钟缓存
-        if (cache_key in self.history_cache and 
-            (now - self.last_history_update) < cache_duration):
-            print(f"[TokenMonitor] 使用缓存的历史数据 ({cache_key})")
-            return self.history_cache[cache_key]
-        
-        try:
-            print(f"[TokenMonitor] 获取最近{days}天历史数据...")
-            
-            # 计算起始日期
-            from datetime import timedelta
-            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
-            
-            # 执行ccusage历史查询（带路径解析与环境）
-            ccusage_bin = self._resolve_ccusage()
-            env = self._build_env()
-            result = subprocess.run([
-                ccusage_bin, '-s', start_date, '--json'
-            ], capture_output=True, text=True, timeout=30, env=env)
-            
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                processed_data = self._process_historical_data(data)
-                
-                # 调试信息：打印最近几天的数据
-                daily_data = data.get('daily', [])
-                if daily_data:
-                    print(f"[TokenMonitor] 历史数据获取完成，共{len(daily_data)}天")
-                    # 显示最近3天的数据用于对比
-                    recent_days = daily_data[-3:] if len(daily_data) >= 3 else daily_data
-                    for day in recent_days:
-                        date = day.get('date', 'Unknown')
-                        tokens = day.get('totalTokens', 0)
-                        cost = day.get('totalCost', 0)
-                        print(f"[TokenMonitor] {date}: {tokens:,} tokens, ${cost:.2f}")
-                
-                # 缓存结果
-                self.history_cache[cache_key] = processed_data
-                self.last_history_update = now
-                
-                return processed_data
-            else:
-                error_msg = f"获取历史数据失败: {result.stderr}"
+        """获取历史数据 (最近N天)；超出汇总表回溯范围的天数截断为 backfill_days，响应中带 requestedDays"""
+        requested_days = days
+        days = max(1, min(days, self.usage_store.backfill_days))
+        if days != requested_days:
+            print(f"[TokenMonitor] 历史范围 {requested_days} 天超出可用范围，按 {days} 天返回")
+
+        # 检查该范围的缓存
+        cached = self.history_cache.get(days)
+        if cached is not None:
+            print(f"[TokenMonitor] 使用缓存的历史数据 (history_{days})")
+            return cached if days == requested_days else dict(cached, requestedDays=requested_days)
+
+        # 计算起始日期
+        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
+
+        # 已有覆盖该范围的新鲜缓存时，汇总表同样是新鲜的，直接查询即可
+        error_msg = None
+        covering_stored_at = self.history_cache.find_covering(days)
+        if covering_stored_at is None:
+            try:
+                print(f"[TokenMonitor] 同步最近{days}天历史数据...")
+                self.usage_store.sync(self._fetch_daily_raw)
+            except subprocess.TimeoutExpired:
+                error_msg = "获取历史数据超时"
+            except RuntimeError as e:
+                error_msg = str(e)
+            except Exception as e:
+                error_msg = f"获取历史数据异常: {str(e)}"
+            if error_msg:
                 print(f"[TokenMonitor] {error_msg}")
-                return {'error': error_msg, 'daily': [], 'totals': {}}
-                
-        except subprocess.TimeoutExpired:
-            error_msg = "获取历史数据超时"
-            print(f"[TokenMonitor] {error_msg}")
-            return {'error': error_msg, 'daily': [], 'totals': {}}
+
+        try:
+            processed_data = self.usage_store.history(start_date)
         except Exception as e:
             error_msg = f"获取历史数据异常: {str(e)}"
             print(f"[TokenMonitor] {error_msg}")
             return {'error': error_msg, 'daily': [], 'totals': {}}
-    
-    def _process_historical_data(self, raw_data):
-        """处理历史数据"""
-        result = {
-            'timestamp': datetime.now().isoformat(),
-            'error': None,
-            'daily': raw_data.get('daily', []),
-            'totals': raw_data.get('totals', {}),
-            'summary': {}
-        }
-        
-        # 计算汇总信息
-        daily_data = raw_data.get('daily', [])
+        processed_data['error'] = error_msg
+        processed_data['days'] = days
+
+        # 调试信息：打印最近几天的数据
+        daily_data = processed_data['daily']
         if daily_data:
-            total_days = len(daily_data)
-            avg_tokens = sum(day.get('totalTokens', 0) for day in daily_data) / total_days if total_days > 0 else 0
-            avg_cost = sum(day.get('totalCost', 0) for day in daily_data) / total_days if total_days > 0 else 0
-            
-            # 找出使用量最高和最低的天
-            max_day = max(daily_data, key=lambda x: x.get('totalTokens', 0), default={})
-            min_day = min(daily_data, key=lambda x: x.get('totalTokens', 0), default={})
-            
-            # 计算趋势（最近7天 vs 前面7天的平均值）
-            recent_7_days = daily_data[-7:] if len(daily_data) >= 7 else daily_data
-            previous_7_days = daily_data[-14:-7] if len(daily_data) >= 14 else []
-            
-            recent_avg = sum(day.get('totalTokens', 0) for day in recent_7_days) / len(recent_7_days) if recent_7_days else 0
-            previous_avg = sum(day.get('totalTokens', 0) for day in previous_7_days) / len(previous_7_days) if previous_7_days else recent_avg
-            
-            trend = 'increasing' if recent_avg > previous_avg * 1.1 else ('decreasing' if recent_avg < previous_avg * 0.9 else 'stable')
-            
-            result['summary'] = {
-                'totalDays': total_days,
-                'averageTokensPerDay': round(avg_tokens),
-                'averageCostPerDay': round(avg_cost, 2),
-                'maxUsageDay': {
-                    'date': max_day.get('date', ''),
-                    'tokens': max_day.get('totalTokens', 0),
-                    'cost': max_day.get('totalCost', 0)
-                },
-                'minUsageDay': {
-                    'date': min_day.get('date', ''),
-                    'tokens': min_day.get('totalTokens', 0),
-                    'cost': min_day.get('totalCost', 0)
-                },
-                'recentTrend': trend,
-                'recentAverage': round(recent_avg),
-                'previousAverage': round(previous_avg)
-            }
-        
-        return result
+            print(f"[TokenMonitor] 历史数据获取完成，共{len(daily_data)}天")
+            # 显示最近3天的数据用于对比
+            for day in daily_data[-3:]:
+                print(f"[TokenMonitor] {day['date']}: {day['totalTokens']:,} tokens, ${day['totalCost']:.2f}")
+
+        # 同步失败时不缓存，下次请求重试
+        if not error_msg:
+            self.history_cache.put(days, processed_data, stored_at=covering_stored_at)
+
+        if days != requested_days:
+            return dict(processed_data, requestedDays=requested_days)
+        return processed_data
+
+    def _fetch_daily_raw(self, start_date):
+        """获取 start_date(YYYYMMDD) 至今的每日数据（ccusage daily格式的列表）"""
+        if self.ingester:
+            # 原生采集：增量读取日志后直接汇总
+            self.ingester.refresh()
+            return self.ingester.daily_report(start_date)['daily']
+
+        # 执行ccusage历史查询（带路径解析与环境）
+        ccusage_bin = self._resolve_ccusage()
+        env = self._build_env()
+        result = subprocess.run([
+            ccusage_bin, '-s', start_date, '--json'
+        ], capture_output=True, text=True, timeout=30, env=env)
+
+        if result.returncode != 0:
+            raise RuntimeError(f"获取历史数据失败: {result.stderr}")
+        return json.loads(result.stdout).get('daily', [])
+
+    def _record_today(self, daily_data):
+        """实时快照中的今日数据顺便写入汇总表，历史查询无需再为今天启动子进程"""
+        try:
+            if daily_data and daily_data.get('daily'):
+                self.usage_store.record_days(daily_data['daily'])
+        except Exception as e:
+            print(f"[TokenMonitor] 写入每日汇总失败: {e}")
+
+    def cross_check(self):
+        """用ccusage交叉校验原生采集的今日用量"""
+        if not self.ingester:
+            return {'error': '当前未启用原生采集，无需交叉校验', 'backend': self.usage_backend}
+
+        today = datetime.now().strftime('%Y%m%d')
+        self.ingester.refresh()
+        native_totals = self.ingester.daily_report(today)['totals']
+
+        results = self._run_ccusage_parallel({
+            'daily': [self._resolve_ccusage(), 'daily', '--json', '-s', today]
+        }, self._build_env(), self.ccusage_timeout)
+        result = results['daily']
+        if result is None or result.returncode != 0:
+            error = 'ccusage超时' if result is None else result.stderr
+            return {'error': f'ccusage不可用: {error}', 'native': native_totals}
+
+        ccusage_totals = json.loads(result.stdout).get('totals', {})
+        return {
+            'date': today,
+            'native': native_totals,
+            'ccusage': ccusage_totals,
+            'diff': {key: native_totals[key] - ccusage_totals.get(key, 0) for key in native_totals}
+        }
 
 
 class TaskManager:
     """任务管理器"""
     
-    def __init__(self, db_path='tasks.db'):
-        self.db_path = db_path
-        self.claude_executor = ClaudeExecutor()
+    def __init__(self, db_path=None, workspace_dir="~/vibecodetask-workspace"):
+        self.db_path = os.path.abspath(db_path or tasks_db_path())
+        self.db = get_pool(self.db_path)
+        self.claude_executor = ClaudeExecutor(workspace_dir=workspace_dir)
+        self.listeners = []
         self.init_database()
+        # 从已完成任务的实际用量学习估算模型（只累加上次之后新完成的任务）
+        self.token_estimator = TokenEstimator(self.db_path)
+        self.token_estimator.sync()
+
+    def add_listener(self, callback):
+        """注册任务变更监听器 callback(action, task_id, fields)"""
+        self.listeners.append(callback)
+
+    def _notify(self, action, task_id, **fields):
+        """通知所有监听器任务发生变更"""
+        for callback in list(self.listeners):
+            try:
+                callback(action, task_id, fields)
+            except Exception as e:
+                print(f"[TaskManager] 任务变更通知失败: {e}")
     
     def init_database(self):
         """初始化数据库"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                description TEXT NOT NULL,
-                type TEXT DEFAULT 'immediate',
-                status TEXT DEFAULT 'pending',
-                scheduled_time TEXT,
-                created_at TEXT,
-                updated_at TEXT,
-                estimated_tokens INTEGER,
-                actual_tokens INTEGER,
-                result TEXT,
-                task_directory TEXT,
-                files_created TEXT
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    description TEXT NOT NULL,
+                    type TEXT DEFAULT 'immediate',
+                    status TEXT DEFAULT 'pending',
+                    scheduled_time TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    estimated_tokens INTEGER,
+                    actual_tokens INTEGER,
+                    result TEXT,
+                    task_directory TEXT,
+                    files_created TEXT
+                )
+            ''')
+            # 迁移：任务认领租约字段
+            cursor.execute('PRAGMA table_info(tasks)')
+            columns = {row[1] for row in cursor.fetchall()}
+            if 'lease_owner' not in columns:
+                cursor.execute('ALTER TABLE tasks ADD COLUMN lease_owner TEXT')
+            if 'lease_expires' not in columns:
+                cursor.execute('ALTER TABLE tasks ADD COLUMN lease_expires TEXT')
+            # 迁移：变更版本号（每次增删改递增，供 /api/tasks?since= 增量同步）
+            if 'revision' not in columns:
+                cursor.execute('ALTER TABLE tasks ADD COLUMN revision INTEGER DEFAULT 0')
+            if 'log_path' not in columns:
+                cursor.execute('ALTER TABLE tasks ADD COLUMN log_path TEXT')
+            # 迁移：stream-json 模式统计的实际用量（actual_tokens 为四类Token之和）
+            for column, column_type in TASK_USAGE_COLUMNS:
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE tasks ADD COLUMN {column} {column_type}')
+            # 迁移：估算Token的90%预测区间（见 token_estimator.py）
+            for column in ('estimated_tokens_low', 'estimated_tokens_high'):
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE tasks ADD COLUMN {column} INTEGER')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS task_revision (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    value INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('INSERT OR IGNORE INTO task_revision (id, value) VALUES (1, 0)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS task_tombstones (
+                    task_id INTEGER PRIMARY KEY,
+                    revision INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_tombstones_revision ON task_tombstones(revision)')
+            for statement in TASK_INDEXES:
+                cursor.execute(statement)
     
+    @staticmethod
+    def _next_revision(cursor):
+        """在当前写事务内递增并返回新的版本号（写事务串行，版本号单调递增）"""
+        cursor.execute('UPDATE task_revision SET value = value + 1 WHERE id = 1')
+        cursor.execute(SQL_CURRENT_REVISION)
+        return cursor.fetchone()[0]
+
     def add_task(self, description, task_type='immediate', scheduled_time=None):
         """添加任务"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
         
-        now = datetime.now().isoformat()
-        estimated_tokens = len(description) * 4  # 简单估算
+            now = datetime.now().isoformat()
+            estimate = self.token_estimator.estimate(description, task_type)
+            revision = self._next_revision(cursor)
         
-        cursor.execute('''
-            INSERT INTO tasks (description, type, status, scheduled_time, created_at, updated_at, estimated_tokens, files_created)
-            VALUES (?, ?, 'pending', ?, ?, ?, ?, ?)
-        ''', (description, task_type, scheduled_time, now, now, estimated_tokens, '[]'))
+            cursor.execute('''
+                INSERT INTO tasks (description, type, status, scheduled_time, created_at, updated_at,
+                    estimated_tokens, estimated_tokens_low, estimated_tokens_high, files_created, revision)
+                VALUES (?, ?, 'pending', ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (description, task_type, scheduled_time, now, now,
+                  estimate['tokens'], estimate['low'], estimate['high'], '[]', revision))
         
-        task_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            task_id = cursor.lastrowid
         
         print(f"[TaskManager] 任务已添加 ID:{task_id} - {description[:50]}...")
+        self._notify('added', task_id, status='pending', type=task_type, scheduledTime=scheduled_time)
         return task_id
     
-    def get_all_tasks(self):
-        """获取所有任务"""
+    @staticmethod
+    def build_list_query(fields=DEFAULT_TASK_FIELDS, statuses=None, task_type=None,
+                         created_from=None, created_to=None, cursor=None, limit=50):
+        """构造任务列表查询：按 (created_at, id) 倒序的游标分页，返回 (sql, params)"""
+        unknown = [f for f in fields if f not in TASK_FIELDS]
+        if unknown:
+            raise ValueError(f"未知字段: {', '.join(unknown)}")
+
+        where, params = [], []
+        if statuses:
+            where.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if task_type:
+            where.append('type = ?')
+            params.append(task_type)
+        if created_from:
+            where.append('created_at >= ?')
+            params.append(created_from)
+        if created_to:
+            where.append('created_at < ?')
+            params.append(created_to)
+        if cursor:
+            created_at, last_id = TaskManager.decode_cursor(cursor)
+            where.append('(created_at < ? OR (created_at = ? AND id < ?))')
+            params.extend([created_at, created_at, last_id])
+
+        columns = ', '.join(['id', 'created_at'] + [TASK_FIELDS[f] for f in fields])
+        sql = f"SELECT {columns} FROM tasks"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)  # 多取一行判断是否还有下一页
+        return sql, params
+
+    @staticmethod
+    def build_changes_query(fields=DEFAULT_TASK_FIELDS):
+        """构造增量变更查询（参数为 since 版本号）"""
+        return SQL_CHANGED_SINCE.format(columns=', '.join(TASK_FIELDS[f] for f in fields))
+
+    @staticmethod
+    def project_fields(fields=None):
+        """校验请求的字段，并保证结果中总有 id（否则投影后的任务与增量变更无法对应到任务）"""
+        fields = tuple(fields or DEFAULT_TASK_FIELDS)
+        unknown = [f for f in fields if f not in TASK_FIELDS]
+        if unknown:
+            raise ValueError(f"未知字段: {', '.join(unknown)}")
+        return fields if 'id' in fields else ('id',) + fields
+
+    @staticmethod
+    def encode_cursor(created_at, task_id):
+        return base64.urlsafe_b64encode(json.dumps([created_at, task_id]).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM tasks ORDER BY created_at DESC')
-            rows = cursor.fetchall()
-            conn.close()
-            
-            tasks = []
-            for i, row in enumerate(rows):
-                try:
-                    task = {
-                        'id': row[0] if len(row) > 0 else 0,
-                        'description': row[1] if len(row) > 1 else '',
-                        'type': row[2] if len(row) > 2 else 'immediate',
-                        'status': row[3] if len(row) > 3 else 'pending',
-                        'scheduledTime': row[4] if len(row) > 4 else None,
-                        'createdAt': row[5] if len(row) > 5 else '',
-                        'updatedAt': row[6] if len(row) > 6 else '',
-                        'estimatedTokens': row[7] if len(row) > 7 else 0,
-                        'actualTokens': row[8] if len(row) > 8 else None,
-                        'result': row[9] if len(row) > 9 else None,
-                        'taskDirectory': row[10] if len(row) > 10 else None,
-                        'filesCreated': self._limit_files_created(self._safe_json_parse(row[11])) if len(row) > 11 and row[11] else []
-                    }
-                    tasks.append(task)
-                except Exception as e:
-                    print(f"[TaskManager] 处理任务行{i}时出错: {e}, 行数据: {row}")
-                    continue  # 跳过有问题的行
-            
-            print(f"[TaskManager] 成功获取 {len(tasks)} 个任务")
-            return tasks
-            
-        except Exception as e:
-            print(f"[TaskManager] 获取任务列表失败: {e}")
-            return []  # 返回空列表而不是崩溃
+            created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return created_at, int(task_id)
+        except Exception:
+            raise ValueError('无效的cursor')
+
+    def list_tasks(self, fields=None, statuses=None, task_type=None,
+                   created_from=None, created_to=None, cursor=None, limit=50):
+        """分页获取任务列表（只返回请求的字段与id），附带按状态的计数"""
+        fields = self.project_fields(fields)
+        sql, params = self.build_list_query(fields, statuses, task_type, created_from, created_to, cursor, limit)
+        conn = self.db.connection()
+        # 先读版本号再读数据：之后的变更版本号一定更大，客户端用 since=revision 不会漏掉
+        revision = conn.execute(SQL_CURRENT_REVISION).fetchone()[0]
+        rows = conn.execute(sql, params).fetchall()
+        counts = dict(conn.execute(SQL_COUNT_TASKS_BY_STATUS).fetchall())
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1][1], rows[-1][0])
+
+        tasks = [self._row_to_task(fields, row[2:]) for row in rows]
+        return {
+            'tasks': tasks,
+            'nextCursor': next_cursor,
+            'revision': revision,
+            'counts': dict(counts, total=sum(counts.values()))
+        }
+
+    def current_revision(self):
+        """当前任务表版本号（任何增删改都会使其变大）"""
+        return self.db.connection().execute(SQL_CURRENT_REVISION).fetchone()[0]
+
+    def list_changes(self, since, fields=None):
+        """返回版本号大于 since 的变更任务与已删除的任务ID，以及当前版本号"""
+        fields = self.project_fields(fields)
+        conn = self.db.connection()
+        revision = conn.execute(SQL_CURRENT_REVISION).fetchone()[0]
+        if since >= revision:
+            # since 比当前版本还新（例如数据库被重建），提示客户端重新全量获取
+            return {'tasks': [], 'deleted': [], 'revision': revision, 'counts': None, 'reset': since > revision}
+
+        rows = conn.execute(self.build_changes_query(fields), (since,)).fetchall()
+        deleted = [row[0] for row in conn.execute(SQL_DELETED_SINCE, (since,))]
+        counts = dict(conn.execute(SQL_COUNT_TASKS_BY_STATUS).fetchall())
+        return {
+            'tasks': [self._row_to_task(fields, row) for row in rows],
+            'deleted': deleted,
+            'revision': revision,
+            'counts': dict(counts, total=sum(counts.values())),
+            'reset': False
+        }
+
+    def get_task(self, task_id):
+        """获取单个任务的完整信息（含 result 与 filesCreated），不存在时返回None"""
+        fields = tuple(TASK_FIELDS)
+        conn = self.db.connection()
+        row = conn.execute(
+            f"SELECT {', '.join(TASK_FIELDS[f] for f in fields)} FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+        return self._row_to_task(fields, row) if row else None
+
+    def _row_to_task(self, fields, values):
+        task = dict(zip(fields, values))
+        if 'hasResult' in task:
+            task['hasResult'] = bool(task['hasResult'])
+        if 'filesCreated' in task:
+            task['filesCreated'] = self._limit_files_created(self._safe_json_parse(task['filesCreated']))
+        return task
     
     def _safe_json_parse(self, json_str):
         """安全解析JSON字符串"""
@@ -443,44 +989,135 @@ class TaskManager:
     
     def update_task_status(self, task_id, status, result=None, task_directory=None, files_created=None):
         """更新任务状态"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        now = datetime.now().isoformat()
-        files_json = json.dumps(files_created) if files_created else None
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            UPDATE tasks SET status = ?, result = ?, task_directory = ?, files_created = ?, updated_at = ?
-            WHERE id = ?
-        ''', (status, result, task_directory, files_json, now, task_id))
+            now = datetime.now().isoformat()
+            files_json = json.dumps(files_created) if files_created else None
+            revision = self._next_revision(cursor)
         
-        conn.commit()
-        conn.close()
+            # 离开running状态时释放认领租约
+            cursor.execute('''
+                UPDATE tasks SET status = ?, result = ?, task_directory = ?, files_created = ?, updated_at = ?,
+                    lease_owner = CASE WHEN ? = 'running' THEN lease_owner END,
+                    lease_expires = CASE WHEN ? = 'running' THEN lease_expires END,
+                    revision = ?
+                WHERE id = ?
+            ''', (status, result, task_directory, files_json, now, status, status, revision, task_id))
         
         print(f"[TaskManager] 任务状态更新 ID:{task_id} -> {status}")
         append_log(f"Task {task_id} status -> {status}")
         if task_directory:
             print(f"[TaskManager] 文件生成目录: {task_directory}")
             append_log(f"Task {task_id} dir: {task_directory}")
+        self._notify('updated', task_id, status=status)
 
-    def recover_stuck_tasks(self, max_minutes: int = 10):
-        """将长时间处于running状态的任务自动标记为failed"""
+    def claim_task(self, task_id, owner=None, lease_seconds=2000):
+        """
+        原子认领pending任务：只有把状态从pending改为running的调用方才能执行它
+        返回租约持有者标识，任务已被认领或不存在时返回None
+        """
+        owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        now = datetime.now()
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE tasks SET status = 'running', lease_owner = ?, lease_expires = ?, updated_at = ?,
+                    revision = (SELECT value + 1 FROM task_revision WHERE id = 1)
+                WHERE id = ? AND status = 'pending'
+            ''', (owner, (now + timedelta(seconds=lease_seconds)).isoformat(), now.isoformat(), task_id))
+            claimed = cursor.rowcount == 1
+            if claimed:
+                self._next_revision(cursor)
+
+        if not claimed:
+            print(f"[TaskManager] 任务 {task_id} 已被认领或不是pending状态，跳过")
+            return None
+        print(f"[TaskManager] 任务状态更新 ID:{task_id} -> running (lease: {owner})")
+        append_log(f"Task {task_id} claimed by {owner}")
+        self._notify('updated', task_id, status='running')
+        return owner
+
+    def set_log_path(self, task_id, log_path):
+        """记录任务输出日志的位置（Claude开始运行时调用，执行中即可通过日志接口查看输出）"""
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            revision = self._next_revision(cursor)
+            cursor.execute('UPDATE tasks SET log_path = ?, revision = ? WHERE id = ?', (log_path, revision, task_id))
+        self._notify('updated', task_id, status='running')
+
+    def record_usage(self, task_id, usage):
+        """写入执行中累计的实际用量（ClaudeExecutor 的 on_usage 回调，执行期间会多次调用）"""
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            revision = self._next_revision(cursor)
+            cursor.execute('''
+                UPDATE tasks SET actual_tokens = ?, input_tokens = ?, output_tokens = ?, cache_creation_tokens = ?,
+                    cache_read_tokens = ?, cost_usd = ?, num_turns = ?, tool_calls = ?, model = COALESCE(?, model),
+                    revision = ?
+                WHERE id = ?
+            ''', (usage['totalTokens'], usage['inputTokens'], usage['outputTokens'], usage['cacheCreationTokens'],
+                  usage['cacheReadTokens'], usage.get('costUsd'), usage.get('turns'), usage.get('toolCalls'),
+                  usage.get('model'), revision, task_id))
+        self._notify('updated', task_id, status='running', actualTokens=usage['totalTokens'])
+
+    def _learn_token_usage(self):
+        """把新完成任务的实际用量累加进估算模型（失败不影响任务结果）"""
         try:
-            threshold = (datetime.now() - timedelta(minutes=max_minutes)).isoformat()
-            conn = sqlite3.connect(self.db_path)
+            self.token_estimator.sync()
+        except Exception as e:
+            print(f"[TaskManager] 更新Token估算模型失败: {e}")
+
+    def get_log_path(self, task_id):
+        """任务输出日志路径，任务不存在时抛出KeyError"""
+        row = self.db.connection().execute('SELECT log_path FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        if row is None:
+            raise KeyError(task_id)
+        return row[0]
+
+    def renew_lease(self, task_id, owner, lease_seconds=2000):
+        """续期租约（排队的任务真正开始执行时调用），租约已不属于owner时返回False"""
+        with self.db.transaction() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                UPDATE tasks
-                SET status = 'failed', result = COALESCE(result, '') || '[自动恢复] 运行超时，已标记失败', updated_at = ?
-                WHERE status = 'running' AND updated_at < ?
-            ''', (datetime.now().isoformat(), threshold))
-            affected = cursor.rowcount
-            conn.commit()
-            conn.close()
+                UPDATE tasks SET lease_expires = ?
+                WHERE id = ? AND status = 'running' AND lease_owner = ?
+            ''', ((datetime.now() + timedelta(seconds=lease_seconds)).isoformat(), task_id, owner))
+            renewed = cursor.rowcount == 1
+        return renewed
+
+    def release_task(self, task_id, owner):
+        """把已认领但尚未开始执行的任务放回pending"""
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE tasks SET status = 'pending', lease_owner = NULL, lease_expires = NULL, updated_at = ?,
+                    revision = (SELECT value + 1 FROM task_revision WHERE id = 1)
+                WHERE id = ? AND status = 'running' AND lease_owner = ?
+            ''', (datetime.now().isoformat(), task_id, owner))
+            released = cursor.rowcount == 1
+            if released:
+                self._next_revision(cursor)
+        if released:
+            self._notify('updated', task_id, status='pending')
+        return released
+
+    def recover_stuck_tasks(self, max_minutes: int = 10):
+        """将租约已过期（无租约的旧任务按updated_at判断）的running任务自动标记为failed"""
+        try:
+            now = datetime.now().isoformat()
+            threshold = (datetime.now() - timedelta(minutes=max_minutes)).isoformat()
+            with self.db.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_RECOVER_STUCK_TASKS, (now, now, threshold))
+                affected = cursor.rowcount
+                if affected:
+                    self._next_revision(cursor)
             if affected:
                 msg = f"[TaskManager] 自动恢复：标记 {affected} 个卡住的running任务为failed"
                 print(msg)
                 append_log(msg)
+                self._notify('recovered', None, count=affected)
         except Exception as e:
             msg = f"[TaskManager] 自动恢复失败: {e}"
             print(msg)
@@ -488,58 +1125,48 @@ class TaskManager:
     
     def delete_task(self, task_id):
         """删除任务"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-        conn.commit()
-        conn.close()
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+            if cursor.rowcount:
+                # 保留删除记录，增量同步的客户端据此移除该任务
+                revision = self._next_revision(cursor)
+                cursor.execute('''
+                    INSERT INTO task_tombstones (task_id, revision) VALUES (?, ?)
+                    ON CONFLICT(task_id) DO UPDATE SET revision = excluded.revision
+                ''', (task_id, revision))
         print(f"[TaskManager] 任务已删除 ID:{task_id}")
+        self._notify('deleted', task_id)
     
-    def execute_task_with_claude(self, task_id):
-        """使用Claude Code执行任务"""
+    def execute_task_with_claude(self, task_id, lease_owner=None):
+        """使用Claude Code执行任务（lease_owner 为调用方已认领时的租约标识，否则在此认领）"""
         # 获取任务信息
-        conn = sqlite3.connect(self.db_path)
+        conn = self.db.connection()
         cursor = conn.cursor()
         cursor.execute('SELECT description FROM tasks WHERE id = ?', (task_id,))
         result = cursor.fetchone()
-        conn.close()
         
         if not result:
             return {'success': False, 'error': '任务不存在'}
         
         description = result[0]
         
-        # 更新状态为执行中
-        self.update_task_status(task_id, 'running')
+        # 认领任务（pending -> running），未认领成功则不执行
+        if lease_owner is None:
+            lease_owner = self.claim_task(task_id)
+            if lease_owner is None:
+                return {'success': False, 'error': '任务已在执行或不是待执行状态'}
         
         try:
             print(f"[TaskManager] 开始执行任务 {task_id}: {description[:50]}...")
             append_log(f"Task {task_id} start: {description[:50]}...")
 
-            # 在后台线程中执行以实现整体超时控制
-            import threading
-            result_holder = {'value': None}
-
-            def run_exec():
-                try:
-                    result_holder['value'] = self.claude_executor.execute_task(task_id, description)
-                except Exception as e:
-                    result_holder['value'] = {'success': False, 'error': f'执行异常: {e}'}
-
-            t = threading.Thread(target=run_exec)
-            t.daemon = True
-            t.start()
-            t.join(timeout=1900)  # 30分钟+余量，支持复杂项目开发
-
-            if t.is_alive():
-                # 超时处理
-                timeout_msg = '执行超时（超过30分钟）'
-                self.update_task_status(task_id, 'failed', timeout_msg)
-                append_log(f"Task {task_id} timeout")
-                print(f"[TaskManager] 任务 {task_id} 超时: {timeout_msg}")
-                return {'success': False, 'error': timeout_msg}
-
-            execution_result = result_holder['value'] or {'success': False, 'error': '未知错误'}
+            # 直接在调用线程（执行池工作线程）中执行，整体超时由claude子进程的30分钟超时控制
+            execution_result = self.claude_executor.execute_task(
+                task_id, description,
+                on_start=lambda log_path: self.set_log_path(task_id, log_path),
+                on_usage=lambda usage: self.record_usage(task_id, usage)
+            ) or {'success': False, 'error': '未知错误'}
 
             if execution_result.get('success'):
                 self.update_task_status(
@@ -550,6 +1177,8 @@ class TaskManager:
                     execution_result.get('files_created')
                 )
                 print(f"[TaskManager] 任务 {task_id} 执行成功")
+                if execution_result.get('usage'):
+                    self._learn_token_usage()
                 append_log(f"Task {task_id} completed")
                 return execution_result
             else:
@@ -574,6 +1203,152 @@ class TaskManager:
         return self.claude_executor.get_workspace_info()
 
 
+class LiveBroadcaster:
+    """SSE广播器 - 一次刷新，推送给所有订阅者"""
+
+    def __init__(self, token_monitor, buffer_size=200, heartbeat_interval=15):
+        self.token_monitor = token_monitor
+        self.heartbeat_interval = heartbeat_interval
+        self.events = deque(maxlen=buffer_size)  # 最近事件，用于Last-Event-ID续传
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.last_token_timestamp = None
+
+    def publish(self, event_type, data):
+        """发布事件到所有订阅者"""
+        with self.lock:
+            event = (self.next_id, event_type, json.dumps(data, ensure_ascii=False))
+            self.next_id += 1
+            self.events.append(event)
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # 消费过慢的订阅者直接断开，由浏览器自动重连续传
+                self.unsubscribe(subscriber)
+
+    def on_task_event(self, action, task_id, fields):
+        """TaskManager监听器：任务变更时推送task事件"""
+        self.publish('task', dict(fields, action=action, taskId=task_id))
+
+    def subscribe(self, last_event_id=None):
+        """订阅事件流，返回(队列, 需要补发的事件)；无法续传时补发事件为None"""
+        subscriber = queue.Queue(maxsize=100)
+        with self.lock:
+            replay = None
+            if last_event_id is not None and last_event_id < self.next_id:
+                oldest_id = self.events[0][0] if self.events else self.next_id
+                if oldest_id <= last_event_id + 1:
+                    replay = [event for event in self.events if event[0] > last_event_id]
+            self.subscribers.add(subscriber)
+        return subscriber, replay
+
+    def unsubscribe(self, subscriber):
+        """取消订阅"""
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def on_token_snapshot(self, token_data):
+        """TokenMonitor监听器：快照刷新后广播token事件（所有订阅者共享一次刷新）"""
+        timestamp = token_data.get('timestamp')
+        if timestamp and timestamp == self.last_token_timestamp:
+            return
+        self.last_token_timestamp = timestamp
+        self.publish('token', token_data)
+
+    def serve_in_background(self, connection, last_event_id=None):
+        """在独立线程中为一个已脱离线程池的连接推送事件"""
+        thread = threading.Thread(target=self.serve, args=(connection, last_event_id), daemon=True)
+        thread.start()
+
+    def serve(self, connection, last_event_id=None):
+        """向单个连接持续写入SSE事件，空闲时发送心跳"""
+        subscriber, replay = self.subscribe(last_event_id)
+        try:
+            connection.settimeout(self.heartbeat_interval)
+            connection.sendall(b'retry: 5000\n\n')
+
+            if replay is None:
+                # 无法续传：发送当前快照，并提示客户端重新拉取任务列表
+                # 快照不带id；只有resync携带当前位置，作为之后续传的起点，避免重复的事件id
+                with self.lock:
+                    current_id = self.next_id - 1
+                token_data = self.token_monitor.get_real_time_data()
+                connection.sendall(self._format_event(None, 'token', json.dumps(token_data, ensure_ascii=False)))
+                connection.sendall(self._format_event(current_id, 'resync', '{}'))
+            else:
+                for event in replay:
+                    connection.sendall(self._format_event(*event))
+
+            while True:
+                try:
+                    event = subscriber.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    with self.lock:
+                        if subscriber not in self.subscribers:
+                            break
+                    connection.sendall(b': heartbeat\n\n')
+                    continue
+                connection.sendall(self._format_event(*event))
+        except OSError:
+            pass  # 客户端断开
+        finally:
+            self.unsubscribe(subscriber)
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+    @staticmethod
+    def _format_event(event_id, event_type, payload):
+        """格式化SSE事件（event_id 为None时不带id，不改变客户端的Last-Event-ID）"""
+        event_id_line = f"id: {event_id}\n" if event_id is not None else ''
+        return f"{event_id_line}event: {event_type}\ndata: {payload}\n\n".encode('utf-8')
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HTML_PATH = os.path.join(BASE_DIR, 'realtime_interface.html')
+
+# 静态文件（页面、i18n）及其预压缩版本的内存缓存，文件修改后自动重建
+static_assets = StaticAssetCache()
+
+# Token快照、历史统计等按ETag缓存的已编码JSON
+encoded_snapshots = json_codec.EncodedCache()
+
+
+def patch_dashboard_html(content):
+    """替换页面中的API调用为真实端点"""
+    return content.replace(
+        'async function refreshTokenStatus() {',
+        '''async function refreshTokenStatus() {
+            try {
+                const response = await fetch('/api/token-status');
+                const data = await response.json();
+                updateTokenDisplay(data);
+            } catch (error) {
+                console.error('获取Token状态失败:', error);
+            }
+        }
+        
+        async function refreshTokenStatus_old() {'''
+    )
+
+
+def preload_static_assets():
+    """启动时预先读取并压缩页面与i18n文件"""
+    static_assets.get(HTML_PATH, transform=patch_dashboard_html)
+    static_assets.get(os.path.join(BASE_DIR, 'i18n.js'))
+    i18n_dir = os.path.join(BASE_DIR, 'i18n')
+    if os.path.isdir(i18n_dir):
+        for name in sorted(os.listdir(i18n_dir)):
+            if name.endswith('.json'):
+                static_assets.get(os.path.join(i18n_dir, name))
+
+
 class RealtimeHandler(BaseHTTPRequestHandler):
     """HTTP请求处理器"""
     
@@ -597,10 +1372,31 @@ class RealtimeHandler(BaseHTTPRequestHandler):
             self.get_token_status()
         elif path == '/api/tasks':
             self.get_tasks()
+        elif path.startswith('/api/tasks/') and path.endswith('/log'):
+            try:
+                task_id = int(path.split('/')[-2])
+            except ValueError:
+                self.send_error(400, "Invalid task id")
+                return
+            self.get_task_log(task_id)
+        elif path.startswith('/api/tasks/'):
+            try:
+                task_id = int(path.split('/')[-1])
+            except ValueError:
+                self.send_error(400, "Invalid task id")
+                return
+            self.get_task_detail(task_id)
         elif path == '/api/workspace':
             self.get_workspace()
+        elif path == '/api/estimate':
+            self.get_estimate()
+        elif path == '/api/executor':
+            self.send_json_response(dict(task_executor_pool.stats(), cli=task_manager.claude_executor.cli_probe.get(),
+                                         admission=task_scheduler.stats()))
         elif path == '/api/live':
             self.serve_live_updates()
+        elif path == '/api/usage/cross-check':
+            self.send_json_response(token_monitor.cross_check())
         elif path == '/api/history':
             self.get_history()
         elif path.startswith('/api/history/'):
@@ -616,7 +1412,7 @@ class RealtimeHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         """处理POST请求"""
         path = self.path
-        content_length = int(self.headers['Content-Length'])
+        content_length = int(self.headers.get('Content-Length') or 0)  # 无请求体的POST（如刷新执行器）不带该头
         post_data = self.rfile.read(content_length).decode('utf-8')
         
         try:
@@ -632,73 +1428,179 @@ class RealtimeHandler(BaseHTTPRequestHandler):
             self.delete_task(data)
         elif path == '/api/execute-task':
             self.execute_task(data)
+        elif path == '/api/executor/refresh':
+            self.send_json_response({'success': True, 'cli': task_manager.claude_executor.cli_probe.refresh()})
         else:
             self.send_error(404)
     
     def serve_html(self):
-        """提供HTML界面"""
-        html_path = os.path.join(os.path.dirname(__file__), 'realtime_interface.html')
-        
-        if os.path.exists(html_path):
-            with open(html_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 替换API调用为真实端点
-            content = content.replace(
-                'async function refreshTokenStatus() {',
-                '''async function refreshTokenStatus() {
-            try {
-                const response = await fetch('/api/token-status');
-                const data = await response.json();
-                updateTokenDisplay(data);
-            } catch (error) {
-                console.error('获取Token状态失败:', error);
-            }
-        }
-        
-        async function refreshTokenStatus_old() {'''
-            )
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
-        else:
+        """提供HTML界面（内存中预先打补丁并压缩好的页面）"""
+        asset = static_assets.get(HTML_PATH, transform=patch_dashboard_html)
+        if asset is None:
             self.send_error(404, "HTML文件未找到")
+            return
+        self.send_asset(asset, 'text/html')
     
     def serve_static_file(self, filename, content_type):
         """提供静态文件"""
-        file_path = os.path.join(os.path.dirname(__file__), filename)
+        file_path = os.path.join(BASE_DIR, filename)
         
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                self.send_response(200)
-                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
-                self.send_header('Cache-Control', 'no-cache')
-                self.end_headers()
-                self.wfile.write(content.encode('utf-8'))
-            except Exception as e:
-                print(f"[Server] 读取文件失败 {filename}: {e}")
-                self.send_error(500, f"读取文件失败: {str(e)}")
-        else:
+        try:
+            asset = static_assets.get(file_path)
+        except Exception as e:
+            print(f"[Server] 读取文件失败 {filename}: {e}")
+            self.send_error(500, f"读取文件失败: {str(e)}")
+            return
+        if asset is None:
             print(f"[Server] 文件不存在: {file_path}")
             self.send_error(404, f"文件未找到: {filename}")
+            return
+        self.send_asset(asset, content_type)
+
+    def send_asset(self, asset, content_type):
+        """发送缓存的静态文件（条件请求 + 预压缩版本）"""
+        matched = self.etag_matches(asset['etag'])
+        if matched:
+            self.send_not_modified(matched)
+            return
+        self.send_body(asset['body'], f'{content_type}; charset=utf-8', etag=asset['etag'], variants=asset['variants'])
+
+    def send_body(self, body, content_type, status_code=200, etag=None, variants=None, extra_headers=None):
+        """按 Accept-Encoding 压缩并发送响应体"""
+        payload, encoding, compressible = encode_body(body, self.headers.get('Accept-Encoding'), variants)
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        if etag:
+            # 不同编码是不同的表示，强ETag需要区分
+            self.send_header('ETag', self.encoded_etag(etag, encoding))
+            self.send_header('Cache-Control', 'no-cache')
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
     
     def get_token_status(self):
         """获取Token状态"""
         token_data = token_monitor.get_real_time_data()
-        self.send_json_response(token_data)
+        # 同一份快照（时间戳与stale标记不变）内容不变
+        etag = self.make_etag('token', token_data.get('timestamp'), token_data.get('stale', False))
+        self.send_json_response(token_data, etag=etag, cache=True)
     
     def get_tasks(self):
-        """获取任务列表"""
-        print(f"[RealtimeHandler] 调用 get_tasks 方法")
-        tasks = task_manager.get_all_tasks()
-        print(f"[RealtimeHandler] TaskManager 返回 {len(tasks)} 个任务")
-        self.send_json_response({'tasks': tasks})
+        """获取任务列表（?status=&type=&createdFrom=&createdTo=&cursor=&limit=&fields=，或 ?since=<revision> 增量变更）"""
+        query = parse_qs(urlparse(self.path).query)
+
+        def param(name):
+            return query.get(name, [None])[0]
+
+        def int_param(name, default=None):
+            value = param(name)
+            if value is None or value == '':
+                return default
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError(f'无效的{name}: 需要整数') from None
+
+        # 任务表版本号未变时同一查询的结果不变，直接返回304而不执行查询
+        etag = self.make_etag('tasks', task_manager.current_revision(), urlparse(self.path).query)
+        matched = self.etag_matches(etag)
+        if matched:
+            self.send_not_modified(matched)
+            return
+
+        try:
+            fields = tuple(f.strip() for f in param('fields').split(',') if f.strip()) if param('fields') else None
+            since = int_param('since')
+            if since is not None:
+                # 增量同步：只返回变更与删除
+                self.send_json_response(task_manager.list_changes(since, fields), etag=etag)
+                return
+            limit = min(max(int_param('limit', 50), 1), 200)
+            statuses = [s.strip() for s in param('status').split(',') if s.strip()] if param('status') else None
+            page = task_manager.list_tasks(
+                fields=fields,
+                statuses=statuses,
+                task_type=param('type'),
+                created_from=param('createdFrom'),
+                created_to=param('createdTo'),
+                cursor=param('cursor'),
+                limit=limit
+            )
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        self.send_json_response(page, etag=etag)
+
+    def get_task_detail(self, task_id):
+        """获取单个任务详情"""
+        task = task_manager.get_task(task_id)
+        if task is None:
+            self.send_json_response({'error': '任务不存在'}, 404)
+            return
+        self.send_json_response({'task': task}, etag=self.make_etag('task', task_id, task.get('revision')))
     
+    def get_estimate(self):
+        """估算任务Token（?description=&type=&model=），返回点估计与90%预测区间"""
+        query = parse_qs(urlparse(self.path).query)
+        description = query.get('description', [''])[0]
+        if not description.strip():
+            self.send_json_response({'error': '任务描述不能为空'}, 400)
+            return
+        self.send_json_response(task_manager.token_estimator.estimate(
+            description, query.get('type', ['immediate'])[0], query.get('model', [None])[0]
+        ))
+
+    def get_task_log(self, task_id):
+        """
+        任务输出日志（text/plain，支持 Range: bytes=...，执行中的任务可用于增量拉取）
+        X-Log-Generation 在日志轮转后变化，此时之前的字节偏移失效，客户端应从头读取
+        """
+        try:
+            log_path = task_manager.get_log_path(task_id)
+        except KeyError:
+            self.send_json_response({'error': '任务不存在'}, 404)
+            return
+        if not log_path or not os.path.isfile(log_path):
+            self.send_json_response({'error': '该任务没有输出日志'}, 404)
+            return
+
+        size, generation = stat_log(log_path)
+        headers = {'Access-Control-Allow-Origin': '*', 'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache',
+                   'X-Log-Generation': generation,
+                   'Access-Control-Expose-Headers': 'Content-Range, X-Log-Generation'}
+        try:
+            byte_range = parse_byte_range(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if byte_range is None:
+            self.send_body(read_log_range(log_path, 0, size - 1) if size else b'',
+                           'text/plain; charset=utf-8', extra_headers=headers)
+            return
+        # 区间响应不压缩，字节偏移与磁盘上的日志一致
+        start, end = byte_range
+        payload = read_log_range(log_path, start, end)
+        self.send_response(206)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Range', f'bytes {start}-{start + len(payload) - 1}/{size}')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
     def get_workspace(self):
         """获取工作区信息"""
         workspace_info = task_manager.get_workspace_info()
@@ -708,7 +1610,12 @@ class RealtimeHandler(BaseHTTPRequestHandler):
         """获取历史使用数据"""
         try:
             history_data = token_monitor.get_historical_data(days)
-            self.send_json_response(history_data)
+            if history_data.get('error') or not history_data.get('timestamp'):
+                # 出错的结果没有时间戳，不能作为可缓存的表示（否则不同的错误共用同一个ETag）
+                self.send_json_response(history_data)
+                return
+            self.send_json_response(history_data, etag=self.make_etag('history', days, history_data['timestamp']),
+                                    cache=True)
         except Exception as e:
             print(f"[RealtimeHandler] 获取历史数据失败: {e}")
             self.send_json_response({
@@ -800,59 +1707,253 @@ class RealtimeHandler(BaseHTTPRequestHandler):
             self.send_json_response({'error': '任务ID不能为空'}, 400)
             return
         
-        # 在后台线程中执行任务，避免阻塞HTTP响应
-        def execute_in_background():
-            try:
-                result = task_manager.execute_task_with_claude(task_id)
-                print(f"[RealtimeHandler] 任务 {task_id} 执行完成: {result.get('success', False)}")
-            except Exception as e:
-                print(f"[RealtimeHandler] 任务 {task_id} 执行异常: {e}")
+        # 先同步认领，重复点击或调度器已启动的任务直接拒绝
+        lease_owner = task_manager.claim_task(task_id)
+        if lease_owner is None:
+            self.send_json_response({'error': f'任务 {task_id} 已在执行或不是待执行状态'}, 409)
+            return
         
-        execution_thread = threading.Thread(target=execute_in_background)
-        execution_thread.daemon = True
-        execution_thread.start()
+        # 提交到任务执行池，避免阻塞HTTP响应
+        task_executor_pool.submit(task_id, lease_owner)
+        stats = task_executor_pool.stats()
         
         self.send_json_response({
             'success': True, 
-            'message': f'任务 {task_id} 已开始执行，请刷新查看进度'
+            'message': f'任务 {task_id} 已开始执行，请刷新查看进度',
+            'executor': stats
         })
     
     def serve_live_updates(self):
-        """提供实时更新流"""
+        """提供实时更新流 (Server-Sent Events)"""
+        last_event_id = self.headers.get('Last-Event-ID')
+        if last_event_id is None:
+            last_event_id = parse_qs(urlparse(self.path).query).get('lastEventId', [None])[0]
+        try:
+            last_event_id = int(last_event_id) if last_event_id is not None else None
+        except ValueError:
+            last_event_id = None
+
         self.send_response(200)
-        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
         self.send_header('Cache-Control', 'no-cache')
         self.send_header('Connection', 'keep-alive')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        
-        # 发送初始数据
-        token_data = token_monitor.get_real_time_data()
-        self.wfile.write(f"data: {json.dumps(token_data)}\n\n".encode('utf-8'))
-        self.wfile.flush()
+        self.close_connection = True
+
+        # 长连接不占用HTTP线程池，交给广播器的推送线程
+        if hasattr(self.server, 'detach_request'):
+            self.server.detach_request(self.connection)
+            live_broadcaster.serve_in_background(self.connection, last_event_id)
+        else:
+            live_broadcaster.serve(self.connection, last_event_id)
     
-    def send_json_response(self, data, status_code=200):
-        """发送JSON响应"""
-        response = json.dumps(data, ensure_ascii=False, indent=2)
-        
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
+    @staticmethod
+    def make_etag(*parts):
+        """由决定响应内容的各部分生成强ETag"""
+        digest = hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:20]
+        return f'"{digest}"'
+
+    @staticmethod
+    def encoded_etag(etag, encoding):
+        """压缩版本的ETag：不同编码是不同的表示，强ETag需要区分"""
+        return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+    def etag_matches(self, etag):
+        """
+        请求的 If-None-Match 是否包含该ETag或其压缩版本
+        返回匹配到的表示的ETag（304需要带上与200相同的ETag），不匹配时返回None
+        """
+        header = self.headers.get('If-None-Match')
+        if not header or not etag:
+            return None
+        # 压缩版本的ETag带编码后缀（见 send_body），只有当前 Accept-Encoding 仍会选择该编码时才匹配
+        accepted = {etag, self.encoded_etag(etag, negotiate(self.headers.get('Accept-Encoding')))}
+        for candidate in header.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == '*':
+                return etag
+            if candidate in accepted:
+                return candidate
+        return None
+
+    def send_not_modified(self, etag):
+        """304：客户端缓存仍然有效，只发送头部"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(response.encode('utf-8'))
+
+    def send_json_response(self, data, status_code=200, etag=None, cache=False):
+        """
+        发送JSON响应（默认紧凑格式，?pretty=1 时缩进）
+        提供etag时支持条件请求；cache=True 时按etag复用已编码的字节
+        """
+        pretty = json_codec.wants_pretty(parse_qs(urlparse(self.path).query))
+        if etag and pretty:
+            # 缩进版本是另一种表示
+            etag = f'{etag[:-1]}-pretty"'
+        matched = self.etag_matches(etag) if etag and status_code == 200 else None
+        if matched:
+            self.send_not_modified(matched)
+            return
+        if cache and etag and status_code == 200:
+            body = encoded_snapshots.encode(etag, data, pretty)
+        else:
+            body = json_codec.dumps(data, pretty)
+
+        self.send_body(
+            body,
+            'application/json; charset=utf-8',
+            status_code=status_code,
+            etag=etag if status_code == 200 else None,
+            extra_headers={'Access-Control-Allow-Origin': '*'}
+        )
     
     def log_message(self, format, *args):
         """自定义日志"""
         print(f"[{datetime.now().strftime('%H:%M:%S')}] {format % args}")
 
 
+class PooledHTTPServer(HTTPServer):
+    """线程池HTTP服务器 - 每个请求交给固定大小的线程池处理，慢接口不再阻塞快接口"""
+
+    def __init__(self, server_address, handler_class, max_workers=16):
+        super().__init__(server_address, handler_class)
+        self.max_workers = max(1, int(max_workers))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='http-worker')
+        self.detached_requests = set()
+        self.detached_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        """把请求提交到线程池，主线程立即返回继续accept"""
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        """在工作线程中处理请求（与ThreadingMixIn的处理流程一致）"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def detach_request(self, request):
+        """将连接移交给其他线程（如SSE长连接），处理结束后不再关闭它"""
+        with self.detached_lock:
+            self.detached_requests.add(request)
+
+    def shutdown_request(self, request):
+        """关闭连接，已移交的连接由接管方负责关闭"""
+        with self.detached_lock:
+            if request in self.detached_requests:
+                self.detached_requests.discard(request)
+                return
+        super().shutdown_request(request)
+
+    def server_close(self):
+        """关闭监听socket并停止线程池"""
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class TaskExecutorPool:
+    """任务执行池 - 调度执行与手动执行共用，限制同时运行的claude进程数"""
+
+    def __init__(self, task_manager, max_workers=2):
+        self.task_manager = task_manager
+        self.max_workers = max(1, max_workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='task-exec')
+        self.lock = threading.Lock()
+        self.queued = {}   # task_id -> (提交时间, 租约标识)
+        self.running = {}  # task_id -> 开始时间
+        self.completed_count = 0
+
+    def submit(self, task_id, lease_owner):
+        """提交已认领的任务，同一任务已在队列或执行中时返回False"""
+        with self.lock:
+            if task_id in self.queued or task_id in self.running:
+                return False
+            self.queued[task_id] = (datetime.now().isoformat(), lease_owner)
+            depth = len(self.queued)
+        self.pool.submit(self._run, task_id, lease_owner)
+        print(f"[TaskExecutorPool] 任务 {task_id} 已入队 (排队 {depth}, 并发上限 {self.max_workers})")
+        return True
+
+    def _run(self, task_id, lease_owner):
+        with self.lock:
+            self.queued.pop(task_id, None)
+            self.running[task_id] = datetime.now().isoformat()
+        try:
+            # 排队期间租约可能已消耗，开始执行时续期
+            if not self.task_manager.renew_lease(task_id, lease_owner):
+                print(f"[TaskExecutorPool] 任务 {task_id} 租约已失效，放弃执行")
+                return
+            result = self.task_manager.execute_task_with_claude(task_id, lease_owner)
+            status = "✅ 成功" if result.get('success') else "❌ 失败"
+            print(f"[TaskExecutorPool] 任务 {task_id} 执行完成: {status}")
+        except Exception as e:
+            print(f"[TaskExecutorPool] 任务 {task_id} 执行异常: {e}")
+        finally:
+            with self.lock:
+                self.running.pop(task_id, None)
+                self.completed_count += 1
+
+    def pending_task_ids(self):
+        """已提交但尚未结束的任务（排队中, 执行中）"""
+        with self.lock:
+            return list(self.queued), list(self.running)
+
+    def stats(self):
+        """当前并发上限、排队深度与执行中的任务"""
+        with self.lock:
+            return {
+                'maxWorkers': self.max_workers,
+                'queued': len(self.queued),
+                'running': len(self.running),
+                'completed': self.completed_count,
+                'queuedTasks': [{'taskId': k, 'since': v[0]} for k, v in self.queued.items()],
+                'runningTasks': [{'taskId': k, 'since': v} for k, v in self.running.items()]
+            }
+
+    def shutdown(self):
+        """
+        停止执行池，仍在排队的任务放回pending，下次启动后重新调度；
+        正在运行的claude进程被终止（任务记为失败），工作线程随即结束，不会让 Ctrl-C 等待到进程超时
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            queued = list(self.queued.items())
+            self.queued.clear()
+        for task_id, (_, lease_owner) in queued:
+            self.task_manager.release_task(task_id, lease_owner)
+        self.task_manager.claude_executor.stop()
+
+
 class TaskScheduler:
-    """任务调度器 - 自动检查和执行定时任务"""
+    """
+    任务调度器 - 按到期时间维护最小堆，睡眠到下一个到期任务或被新任务唤醒
+    设置了 block_ceiling 时做准入控制：当前5小时块的已用量 + 已提交任务的估算用量 + 本任务估算
+    超过上限的任务不执行，推迟到块重置时间（blockInfo.endTime）重新入堆
+    """
+
+    DEFER_RETRY_SECONDS = 60  # 重置时间未知或已过（快照尚未刷新）时的重试间隔
     
-    def __init__(self, task_manager):
+    def __init__(self, task_manager, executor_pool, token_monitor=None, block_ceiling=0):
         self.task_manager = task_manager
+        self.executor_pool = executor_pool
+        self.token_monitor = token_monitor
+        self.block_ceiling = block_ceiling or 0
+        self.deferred = {}  # task_id -> 推迟到的时间戳
         self.running = False
-        self.check_interval = 30  # 30秒检查一次
+        self.heap = []   # (到期时间戳, 序号, task_id)
+        self.due = {}    # task_id -> 到期时间戳；不在其中的堆元素视为已取消（惰性删除）
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
     
     def start(self):
         """启动调度器"""
@@ -860,17 +1961,19 @@ class TaskScheduler:
             return
         
         self.running = True
+        self.load()
         
         def scheduler_loop():
-            print("⏰ 任务调度器启动，每30秒检查一次待执行任务")
+            print(f"⏰ 任务调度器启动，已载入 {len(self.due)} 个待执行任务")
             
             while self.running:
                 try:
                     self.check_and_execute_tasks()
-                    time.sleep(self.check_interval)
                 except Exception as e:
                     print(f"[TaskScheduler] 调度器错误: {e}")
-                    time.sleep(self.check_interval)
+                timeout = self.seconds_until_next()
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
         
         scheduler_thread = threading.Thread(target=scheduler_loop)
         scheduler_thread.daemon = True
@@ -879,111 +1982,205 @@ class TaskScheduler:
     def stop(self):
         """停止调度器"""
         self.running = False
+        self.wakeup.set()
         print("🛑 任务调度器已停止")
     
-    def check_and_execute_tasks(self):
-        """检查并执行到期的任务"""
-        now = datetime.now()
-        
-        print(f"[TaskScheduler] 🔍 开始检查待执行任务 - {now.strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        conn = sqlite3.connect(self.task_manager.db_path)
+    def load(self):
+        """启动时一次性载入所有pending任务"""
+        conn = self.task_manager.db.connection()
         cursor = conn.cursor()
+        cursor.execute(SQL_PENDING_TASKS)
+        rows = cursor.fetchall()
+        for task_id, task_type, scheduled_time in rows:
+            self.schedule(task_id, task_type, scheduled_time)
+    
+    @staticmethod
+    def parse_scheduled_time(scheduled_time_str):
+        """解析预定时间为本地时间戳 - 处理不同的时间格式"""
+        if 'Z' in scheduled_time_str or '+' in scheduled_time_str:
+            # 带时区的格式
+            scheduled_time = datetime.fromisoformat(scheduled_time_str.replace('Z', '+00:00'))
+            scheduled_time = scheduled_time.replace(tzinfo=None)
+        else:
+            # 本地时间格式（YYYY-MM-DDTHH:MM:SS）
+            scheduled_time = datetime.fromisoformat(scheduled_time_str)
+        return scheduled_time.timestamp()
+    
+    def schedule(self, task_id, task_type, scheduled_time_str):
+        """加入（或重新加入）调度堆：立即任务马上到期，定时任务按预定时间"""
+        if task_id in self.deferred:
+            # 因Token预算推迟的任务保持推迟时间
+            due_at = self.deferred[task_id]
+        elif task_type == 'immediate':
+            due_at = time.time()
+        elif task_type == 'scheduled' and scheduled_time_str:
+            try:
+                due_at = self.parse_scheduled_time(scheduled_time_str)
+            except ValueError as e:
+                print(f"[TaskScheduler] ❌ 任务 {task_id} 调度时间无效 {repr(scheduled_time_str)}: {e}")
+                return
+        else:
+            print(f"[TaskScheduler] ⚠️  任务 {task_id} 未知任务类型或缺少调度时间")
+            return
         
-        # 获取所有待执行的任务 (立即执行 + 定时任务)
-        cursor.execute('''
-            SELECT id, description, type, scheduled_time, created_at 
-            FROM tasks 
-            WHERE status = 'pending'
-        ''')
-        pending_tasks = cursor.fetchall()
-        conn.close()
-        
-        print(f"[TaskScheduler] 📋 找到 {len(pending_tasks)} 个待执行任务")
+        with self.lock:
+            self.due[task_id] = due_at
+            self.seq += 1
+            heapq.heappush(self.heap, (due_at, self.seq, task_id))
+            is_earliest = self.heap[0][2] == task_id
+        if is_earliest:
+            self.wakeup.set()
+    
+    def unschedule(self, task_id):
+        """移出调度（堆中的旧元素在弹出时丢弃）"""
+        with self.lock:
+            self.due.pop(task_id, None)
+            self.deferred.pop(task_id, None)
+
+    def defer(self, task_id, until):
+        """Token预算不足：任务保持pending，到 until 时间戳再尝试"""
+        with self.lock:
+            self.deferred[task_id] = until
+            self.due[task_id] = until
+            self.seq += 1
+            heapq.heappush(self.heap, (until, self.seq, task_id))
+
+    def admission_budget(self):
+        """
+        当前块的已承诺用量：{'committed', 'resetAt'}，未启用准入控制时返回None
+        已承诺 = 块的已用量 + 排队任务的估算 + 执行中任务估算的剩余部分
+        （不用块的预计总用量：它按当前消耗速度外推，已经包含了执行中任务之后的用量，再加剩余估算会重复计算）
+        """
+        if not self.block_ceiling or self.token_monitor is None:
+            return None
+        token_data = self.token_monitor.get_real_time_data()
+        block = token_data.get('blockInfo') or {}
+        if token_data.get('error') and not block.get('isActive'):
+            print(f"[TaskScheduler] ⚠️  无法获取Token块信息，本次不做准入限制: {token_data.get('error')}")
+            return None
+        used, reset_at = 0, None
+        if block.get('isActive'):
+            used = block.get('blockTokens') or 0
+            if block.get('endTime'):
+                try:
+                    reset_at = datetime.fromisoformat(block['endTime'].replace('Z', '+00:00')).timestamp()
+                except ValueError:
+                    reset_at = None
+
+        queued, running = self.executor_pool.pending_task_ids()
+        committed = used
+        if queued or running:
+            conn = self.task_manager.db.connection()
+            placeholders = ', '.join('?' * (len(queued) + len(running)))
+            rows = conn.execute(
+                f'SELECT id, estimated_tokens, actual_tokens FROM tasks WHERE id IN ({placeholders})',
+                queued + running
+            ).fetchall()
+            for task_id, estimated, actual in rows:
+                # 执行中任务已经产生的用量已计入块用量，只加上估算的剩余部分
+                used = (actual or 0) if task_id in running else 0
+                committed += max(0, (estimated or 0) - used)
+        return {'committed': committed, 'resetAt': reset_at}
+
+    def stats(self):
+        """准入控制状态：上限与被推迟的任务"""
+        with self.lock:
+            deferred = [{'taskId': task_id, 'until': datetime.fromtimestamp(until).isoformat()}
+                        for task_id, until in self.deferred.items()]
+        return {'blockTokenCeiling': self.block_ceiling or None, 'deferredTasks': deferred}
+    
+    def on_task_event(self, action, task_id, fields):
+        """TaskManager 监听器：任务增删改时同步调度堆"""
+        if action == 'added':
+            if fields.get('status') == 'pending':
+                self.schedule(task_id, fields.get('type'), fields.get('scheduledTime'))
+        elif action == 'deleted':
+            self.unschedule(task_id)
+        elif action == 'updated':
+            if fields.get('status') != 'pending':
+                self.unschedule(task_id)
+            elif task_id not in self.due:
+                # 任务重新变回pending（例如排队中被释放），按行重新载入
+                conn = self.task_manager.db.connection()
+                row = conn.execute('SELECT type, scheduled_time FROM tasks WHERE id = ?', (task_id,)).fetchone()
+                if row:
+                    self.schedule(task_id, row[0], row[1])
+    
+    def seconds_until_next(self):
+        """距下一个到期任务的秒数，没有任务时返回None（一直等待唤醒）"""
+        with self.lock:
+            while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            if not self.heap:
+                return None
+            return max(0.0, self.heap[0][0] - time.time())
+    
+    def check_and_execute_tasks(self):
+        """弹出所有已到期的任务并提交执行"""
+        now = time.time()
+        due_tasks = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due_at, _, task_id = heapq.heappop(self.heap)
+                if self.due.get(task_id) == due_at:
+                    del self.due[task_id]
+                    due_tasks.append(task_id)
         
+        if not due_tasks:
+            return 0
+
+        budget = self.admission_budget()
+        estimates = {}
+        if budget is not None:
+            conn = self.task_manager.db.connection()
+            rows = conn.execute(
+                f"SELECT id, estimated_tokens FROM tasks WHERE id IN ({', '.join('?' * len(due_tasks))})", due_tasks
+            ).fetchall()
+            estimates = {task_id: estimated or 0 for task_id, estimated in rows}
+
         executed_count = 0
-        
-        for task_id, description, task_type, scheduled_time_str, created_at in pending_tasks:
-            try:
-                print(f"[TaskScheduler] 📝 检查任务 {task_id}:")
-                print(f"   描述: {description[:50]}...")
-                print(f"   类型: {task_type}")
-                print(f"   scheduled_time: {repr(scheduled_time_str)}")
-                print(f"   created_at: {created_at}")
-                
-                should_execute = False
-                
-                if task_type == 'immediate':
-                    # 立即执行任务 - 直接执行
-                    print(f"   ⚡ 立即执行任务，准备执行")
-                    should_execute = True
-                    
-                elif task_type == 'scheduled' and scheduled_time_str:
-                    # 定时任务 - 检查时间
-                    print(f"   🕐 定时任务，解析时间...")
-                    
-                    # 解析预定时间 - 处理不同的时间格式
-                    if 'Z' in scheduled_time_str or '+' in scheduled_time_str:
-                        # 带时区的格式
-                        scheduled_time = datetime.fromisoformat(scheduled_time_str.replace('Z', '+00:00'))
-                        scheduled_time = scheduled_time.replace(tzinfo=None)
-                        print(f"   解析为带时区格式: {scheduled_time}")
-                    else:
-                        # 本地时间格式（YYYY-MM-DDTHH:MM:SS）
-                        scheduled_time = datetime.fromisoformat(scheduled_time_str)
-                        print(f"   解析为本地时间格式: {scheduled_time}")
-                    
-                    print(f"   当前时间: {now}")
-                    time_diff = scheduled_time - now
-                    print(f"   时间差: {time_diff}")
-                    
-                    # 检查是否到期（允许30秒的误差）
-                    if now >= scheduled_time:
-                        print(f"   ✅ 定时任务已到期，准备执行")
-                        should_execute = True
-                    else:
-                        print(f"   ⏳ 定时任务未到期，还需等待 {time_diff}")
-                
-                else:
-                    print(f"   ⚠️  未知任务类型或缺少调度时间")
-                
-                if should_execute:
-                    print(f"🚀 开始执行任务 {task_id}")
-                    
-                    # 在后台线程执行任务
-                    def execute_task():
-                        try:
-                            result = self.task_manager.execute_task_with_claude(task_id)
-                            status = "✅ 成功" if result.get('success') else "❌ 失败"
-                            print(f"[TaskScheduler] 任务 {task_id} 执行完成: {status}")
-                        except Exception as e:
-                            print(f"[TaskScheduler] 任务 {task_id} 执行异常: {e}")
-                    
-                    execution_thread = threading.Thread(target=execute_task)
-                    execution_thread.daemon = True
-                    execution_thread.start()
-                    
-                    executed_count += 1
-                
-                print(f"   ---")
-                    
-            except Exception as e:
-                print(f"[TaskScheduler] ❌ 处理任务 {task_id} 时失败: {e}")
-                print(f"   scheduled_time_str: {repr(scheduled_time_str)}")
-                print(f"   ---")
+        for task_id in due_tasks:
+            with self.lock:
+                self.deferred.pop(task_id, None)
+            estimate = estimates.get(task_id, 0)
+            if budget is not None and estimate > self.block_ceiling:
+                # 估算本身超过上限：按上限计，在没有其他用量的新块开始时执行一次，而不是永远推迟
+                print(f"[TaskScheduler] ⚠️  任务 {task_id} 预计 {estimate:,} tokens 超过块上限 "
+                      f"{self.block_ceiling:,}，按上限计入，等到新块开始时执行")
+                estimate = self.block_ceiling
+            if budget is not None and budget['committed'] + estimate > self.block_ceiling:
+                # 预算不足：执行到一半额度耗尽只会白白浪费，推迟到块重置后再执行
+                reset_at = budget['resetAt']
+                until = reset_at if reset_at and reset_at > now else now + self.DEFER_RETRY_SECONDS
+                self.defer(task_id, until)
+                print(f"[TaskScheduler] ⏸️  任务 {task_id} 预计 {estimate:,} tokens，"
+                      f"当前块已承诺 {budget['committed']:,} / 上限 {self.block_ceiling:,}，"
+                      f"推迟到 {datetime.fromtimestamp(until).strftime('%H:%M:%S')}")
+                continue
+            # 先原子认领，已被其他调用方认领的任务不会重复执行
+            lease_owner = self.task_manager.claim_task(task_id)
+            if lease_owner is None:
+                continue
+            print(f"🚀 开始执行任务 {task_id}")
+            # 提交到任务执行池（与手动执行共用并发上限）
+            self.executor_pool.submit(task_id, lease_owner)
+            executed_count += 1
+            if budget is not None:
+                budget['committed'] += estimate
         
         if executed_count > 0:
-            print(f"[TaskScheduler] 本次检查执行了 {executed_count} 个定时任务")
+            print(f"[TaskScheduler] 本次执行了 {executed_count} 个到期任务")
+        return executed_count
 
 
 def main():
     """主函数"""
-    global token_monitor, task_manager, task_scheduler
+    global token_monitor, task_manager, task_scheduler, task_executor_pool, live_broadcaster
     
     print("🚀 启动 VibeCodeTask 实时监控服务器...")
     
     # 初始化组件
-    token_monitor = TokenMonitor()
+    token_monitor = TokenMonitor(refresh_interval=int(os.environ.get('VIBE_TOKEN_REFRESH_INTERVAL', 30)))
     task_manager = TaskManager()
     # 服务启动时自动恢复卡住的任务
     try:
@@ -992,12 +2189,26 @@ def main():
     except Exception as e:
         print(f"[Main] 恢复卡住任务失败: {e}")
         append_log(f"Recover stuck tasks failed: {e}")
-    task_scheduler = TaskScheduler(task_manager)
+    task_executor_pool = TaskExecutorPool(task_manager, max_workers=int(os.environ.get('VIBE_MAX_CONCURRENT_TASKS', 2)))
+    task_scheduler = TaskScheduler(task_manager, task_executor_pool, token_monitor,
+                                   block_ceiling=int(os.environ.get('VIBE_BLOCK_TOKEN_CEILING', 0)))
+    live_broadcaster = LiveBroadcaster(token_monitor)
+    preload_static_assets()
+    # 启动时探测一次Claude CLI，之后执行任务直接使用缓存结果
+    task_manager.claude_executor.cli_probe.get()
+    task_manager.add_listener(live_broadcaster.on_task_event)
+    task_manager.add_listener(task_scheduler.on_task_event)
+    token_monitor.add_listener(live_broadcaster.on_token_snapshot)
+    token_monitor.start_background_refresh()
     
-    PORT = 8080
-    server = HTTPServer(('localhost', PORT), RealtimeHandler)
+    PORT = int(os.environ.get('VIBE_PORT', 8080))
+    HOST = os.environ.get('VIBE_HOST', 'localhost')
+    workers = int(os.environ.get('VIBE_HTTP_WORKERS', 16))
+    server = PooledHTTPServer((HOST, PORT), RealtimeHandler, max_workers=workers)
     
-    print(f"📱 服务器运行在: http://localhost:{PORT}")
+    print(f"📱 服务器运行在: http://{HOST}:{PORT}")
+    print(f"🧵 HTTP工作线程数: {server.max_workers}")
+    print(f"⚙️  任务最大并发数: {task_executor_pool.max_workers}")
     print(f"💾 任务数据库: {task_manager.db_path}")
     print("🔍 开始实时监控Token使用情况...")
     
@@ -1007,7 +2218,7 @@ def main():
     # 自动打开浏览器
     def open_browser():
         time.sleep(1)
-        webbrowser.open(f'http://localhost:{PORT}')
+        webbrowser.open(f'http://{HOST}:{PORT}')
     
     browser_thread = threading.Thread(target=open_browser)
     browser_thread.daemon = True
@@ -1018,6 +2229,9 @@ def main():
     except KeyboardInterrupt:
         print("\n🛑 服务器已停止")
         task_scheduler.stop()
+    finally:
+        task_executor_pool.shutdown()
+        server.server_close()
 
 
 if __name__ == "__main__":
@@ -16,10 +16,31 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import sqlite3
 
+from http_compression import StaticAssetCache, encode_body
+import json_codec
+from sqlite_pool import tasks_db_path
+from token_estimator import TokenEstimator
+
 # 配置
 PORT = 8080
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'vct.db')
+HTML_PATH = os.path.join(BASE_DIR, 'vibecodetask.html')
+# Token估算模型由 realtime_server 根据已完成任务的实际用量训练，这里只用来估算（与其共用同一个任务库）
+ESTIMATOR_DB_PATH = tasks_db_path()
+
+# 页面及其预压缩版本的内存缓存
+static_assets = StaticAssetCache()
+
+_token_estimator = None
+
+
+def get_token_estimator():
+    """首次估算时才打开估算模型"""
+    global _token_estimator
+    if _token_estimator is None:
+        _token_estimator = TokenEstimator(ESTIMATOR_DB_PATH)
+    return _token_estimator
 
 class VibeCodeTaskHandler(BaseHTTPRequestHandler):
     """HTTP请求处理器"""
@@ -63,16 +84,10 @@ class VibeCodeTaskHandler(BaseHTTPRequestHandler):
     
     def serve_html(self):
         """提供HTML界面"""
-        html_path = os.path.join(BASE_DIR, 'vibecodetask.html')
+        asset = static_assets.get(HTML_PATH)
         
-        if os.path.exists(html_path):
-            with open(html_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+        if asset:
+            self.send_body(asset['body'], 'text/html; charset=utf-8', asset['variants'])
         else:
             self.send_error(404)
     
@@ -90,7 +105,9 @@ class VibeCodeTaskHandler(BaseHTTPRequestHandler):
             'scheduledTime': data.get('scheduledTime'),
             'status': 'pending',
             'createdAt': datetime.now().isoformat(),
-            'estimatedTokens': len(data.get('description', '')) * 3
+            'estimatedTokens': get_token_estimator().estimate(
+                data.get('description', ''), 'immediate' if data.get('type', 'now') == 'now' else data.get('type')
+            )['tokens']
         }
         
         TaskManager.add_task(task)
@@ -129,14 +146,23 @@ class VibeCodeTaskHandler(BaseHTTPRequestHandler):
         self.send_json_response({'success': True, 'message': '设置已保存'})
     
     def send_json_response(self, data):
-        """发送JSON响应"""
-        response = json.dumps(data, ensure_ascii=False, indent=2)
-        
+        """发送JSON响应（默认紧凑格式，?pretty=1 时缩进）"""
+        pretty = json_codec.wants_pretty(parse_qs(urlparse(self.path).query))
+        self.send_body(json_codec.dumps(data, pretty), 'application/json; charset=utf-8')
+    
+    def send_body(self, body, content_type, variants=None):
+        """按 Accept-Encoding 压缩并发送响应体"""
+        payload, encoding, compressible = encode_body(body, self.headers.get('Accept-Encoding'), variants)
         self.send_response(200)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(payload)))
         self.end_headers()
-        self.wfile.write(response.encode('utf-8'))
+        self.wfile.write(payload)
     
     def log_message(self, format, *args):
         """自定义日志格式"""
@@ -573,6 +599,9 @@ def main():
     # 初始化数据库
     DatabaseManager.init_db()
     
+    # 预先读取并压缩页面
+    static_assets.get(HTML_PATH)
+    
     # 创建HTTP服务器
     server = HTTPServer(('localhost', PORT), VibeCodeTaskHandler)
     
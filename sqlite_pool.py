@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+SQLite 连接复用
+每个线程持有一条长连接（WAL 模式、synchronous=NORMAL、忙等待超时、预编译语句缓存），
+同一数据库文件的所有组件通过 get_pool(db_path) 共用同一个连接池。
+tasks_db_path() 是各服务共用的任务库位置（任务、用量汇总与Token估算模型都在其中）。
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+BUSY_TIMEOUT = 10.0         # 秒，写锁被占用时的等待上限
+CACHED_STATEMENTS = 256     # 每条连接缓存的预编译语句数
+
+
+class SQLitePool:
+    """按线程复用的 SQLite 连接池"""
+
+    def __init__(self, db_path, busy_timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS):
+        # 各线程的连接在首次使用时才创建，固定为绝对路径，不受之后工作目录变化影响
+        self.db_path = os.path.abspath(db_path)
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = {}  # 线程ident -> 连接，用于回收已退出线程的连接
+
+    def connection(self):
+        """当前线程的连接（首次调用时创建）"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self.local.conn = conn
+            with self.lock:
+                self._close_dead_threads()
+                self.connections[threading.get_ident()] = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """写事务：正常结束提交，异常时回滚"""
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def _connect(self):
+        # 连接只在创建它的线程内使用；关闭已退出线程的连接需要跨线程调用 close()
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                               cached_statements=self.cached_statements, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        return conn
+
+    def _close_dead_threads(self):
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self.connections if ident not in alive]:
+            self.connections.pop(ident).close()
+
+    def close_all(self):
+        """关闭所有线程的连接（服务停止时调用）"""
+        with self.lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections.clear()
+        self.local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def tasks_db_path():
+    """任务库位置：VIBE_DB_PATH，默认为程序所在目录下的 tasks.db（与启动时的工作目录无关）"""
+    configured = os.environ.get('VIBE_DB_PATH')
+    if configured:
+        return os.path.abspath(os.path.expanduser(configured))
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tasks.db')
+
+
+def get_pool(db_path):
+    """同一数据库文件共用一个连接池"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SQLitePool(db_path)
+        return pool
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+任务输出日志
+Claude CLI 的输出逐行写入每个任务自己的日志文件（超过上限时轮转），
+内存中只保留最后若干行作为摘要；/api/tasks/<id>/log 按 Range 读取日志。
+"""
+
+import os
+import threading
+from collections import deque
+
+LOG_MAX_BYTES = 8 * 1024 * 1024  # 单个日志文件上限，超过后轮转为 .1
+LOG_BACKUP_COUNT = 2             # 保留的历史轮转文件数
+TAIL_LINES = 200                 # 内存中保留的末尾行数
+TAIL_LINE_CHARS = 2000           # 摘要中单行的最大长度
+
+
+class TaskOutputLog:
+    """单个任务的输出日志 - 写入即落盘，内存占用与输出总量无关"""
+
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, tail_lines=TAIL_LINES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.lines = deque(maxlen=tail_lines)
+        self.total_bytes = 0
+        self.total_lines = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+
+    def write_line(self, line):
+        """追加一行输出（行尾换行符可有可无）"""
+        line = line.rstrip('\r\n')
+        data = (line + '\n').encode('utf-8', errors='replace')
+        with self.lock:
+            if self.size and self.size + len(data) > self.max_bytes:
+                self._rotate()
+            self.file.write(data)
+            # 每行刷新，日志接口可以实时读到正在执行的任务输出
+            self.file.flush()
+            self.size += len(data)
+            self.total_bytes += len(data)
+            self.total_lines += 1
+            self.lines.append(line if len(line) <= TAIL_LINE_CHARS else line[:TAIL_LINE_CHARS] + ' …')
+
+    def _rotate(self):
+        self.file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f'{self.path}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{index + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'ab')
+        self.size = 0
+
+    def tail(self):
+        """最后若干行输出"""
+        with self.lock:
+            return '\n'.join(self.lines)
+
+    def summary(self):
+        """任务行中保存的摘要：输出总量 + 末尾若干行"""
+        with self.lock:
+            omitted = self.total_lines - len(self.lines)
+            header = f"[共 {self.total_lines} 行 / {self.total_bytes:,} 字节"
+            header += f"，以下为最后 {len(self.lines)} 行，完整输出见 {self.path}]" if omitted > 0 else "]"
+            return header + '\n' + '\n'.join(self.lines)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def parse_byte_range(header, size):
+    """
+    解析 Range: bytes=start-end / bytes=start- / bytes=-suffix（只支持单个区间）
+    返回 (start, end) 闭区间；header 为空、格式不支持时返回None（按完整内容响应）；区间无法满足时抛出ValueError
+    """
+    if not header:
+        return None
+    unit, _, spec = header.strip().partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = (part.strip() for part in spec.strip().partition('-'))
+    if not dash or not (first or last) or not all(part.isdecimal() for part in (first, last) if part):
+        return None
+    start = int(first) if first else None
+    end = int(last) if last else None
+    if start is None:
+        if end <= 0 or size == 0:
+            raise ValueError('无效的Range')
+        return max(size - end, 0), size - 1
+    if end is None:
+        end = size - 1
+    if start >= size or end < start:
+        raise ValueError('无效的Range')
+    return start, min(end, size - 1)
+
+
+def stat_log(path):
+    """
+    返回 (size, generation)：generation 标识当前日志文件，轮转后新建的文件得到新的值
+    （以文件identity区分；轮转出的 .1 仍占用旧文件，新旧两代不会相同），跟随读取的客户端据此发现偏移已重置
+    """
+    st = os.stat(path)
+    return st.st_size, f'{st.st_dev:x}-{st.st_ino:x}'
+
+
+def read_log_range(path, start, end):
+    """读取日志 [start, end] 字节"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start + 1)
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+测试共用的 TaskManager 工厂
+任务库、任务工作目录与服务日志都放在调用方的临时目录，不写入仓库的 tasks.db / server.log 与 $HOME；
+退出时恢复 realtime_server.SERVER_LOG_PATH，之后的测试不会把日志写到已删除的目录
+"""
+
+import os
+from contextlib import contextmanager
+
+import realtime_server
+from realtime_server import TaskManager
+
+
+@contextmanager
+def temp_task_manager(tmp_dir):
+    """在 tmp_dir 中创建 TaskManager，期间服务日志写入 tmp_dir/server.log"""
+    original_log_path = realtime_server.SERVER_LOG_PATH
+    realtime_server.SERVER_LOG_PATH = os.path.join(tmp_dir, 'server.log')
+    try:
+        yield TaskManager(db_path=os.path.join(tmp_dir, 'tasks.db'), workspace_dir=os.path.join(tmp_dir, 'workspace'))
+    finally:
+        realtime_server.SERVER_LOG_PATH = original_log_path
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+测试调度准入控制 - 5小时块Token上限：低于上限执行、超过上限推迟到块重置、重置时间未知时60秒后重试、
+估算本身超过上限的任务在新块开始时执行；已用量与执行中任务的剩余估算不重复计算
+使用桩 token_monitor 与桩执行池，不启动claude
+"""
+
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from realtime_server import TaskScheduler
+from task_test_support import temp_task_manager
+
+CEILING = 100_000
+
+
+class StubTokenMonitor:
+    """返回固定的Token快照"""
+
+    def __init__(self, block_tokens=0, projected=None, end_in=timedelta(hours=1), active=True):
+        self.block = {'isActive': active, 'blockTokens': block_tokens,
+                      'projection': {'totalTokens': projected if projected is not None else block_tokens}}
+        if end_in is not None:
+            end = datetime.now(timezone.utc) + end_in
+            self.block['endTime'] = end.isoformat().replace('+00:00', 'Z')
+
+    def get_real_time_data(self):
+        return {'blockInfo': self.block if self.block['isActive'] else {'isActive': False}}
+
+
+class StubExecutorPool:
+    """记录提交的任务；queued/running 由测试指定"""
+
+    def __init__(self, queued=(), running=()):
+        self.queued = list(queued)
+        self.running = list(running)
+        self.submitted = []
+
+    def submit(self, task_id, lease_owner):
+        self.submitted.append(task_id)
+        self.queued.append(task_id)
+        return True
+
+    def pending_task_ids(self):
+        return list(self.queued), list(self.running)
+
+
+def _add_task(manager, estimate, status='pending', actual=None):
+    task_id = manager.add_task(f'准入测试 {estimate}')
+    conn = sqlite3.connect(manager.db_path)
+    conn.execute('UPDATE tasks SET estimated_tokens = ?, actual_tokens = ?, status = ? WHERE id = ?',
+                 (estimate, actual, status, task_id))
+    conn.commit()
+    conn.close()
+    return task_id
+
+
+def _make_scheduler(manager, monitor, pool):
+    scheduler = TaskScheduler(manager, pool, monitor, block_ceiling=CEILING)
+    scheduler.load()
+    return scheduler
+
+
+def test_admits_below_ceiling():
+    """已用量 + 估算低于上限：认领并提交，预算随之累加"""
+    print("🧪 测试低于上限时执行")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        first, second = _add_task(manager, 30_000), _add_task(manager, 30_000)
+        third = _add_task(manager, 30_000)
+        pool = StubExecutorPool()
+        scheduler = _make_scheduler(manager, StubTokenMonitor(block_tokens=20_000), pool)
+
+        assert scheduler.check_and_execute_tasks() == 2
+        # 20K + 30K + 30K = 80K，第三个任务会到 110K
+        assert pool.submitted == [first, second]
+        assert manager.get_task(first)['status'] == 'running'
+        assert third in scheduler.deferred and manager.get_task(third)['status'] == 'pending'
+
+
+def test_defers_above_ceiling_until_block_reset():
+    """超过上限：任务保持pending，推迟到块的 endTime 重新入堆，到期后在新块中执行"""
+    print("🧪 测试超过上限时推迟到块重置")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        task_id = _add_task(manager, 50_000)
+        monitor = StubTokenMonitor(block_tokens=60_000, end_in=timedelta(minutes=90))
+        pool = StubExecutorPool()
+        scheduler = _make_scheduler(manager, monitor, pool)
+
+        assert scheduler.check_and_execute_tasks() == 0
+        assert pool.submitted == []
+        assert manager.get_task(task_id)['status'] == 'pending'
+        reset_at = datetime.fromisoformat(monitor.block['endTime'].replace('Z', '+00:00')).timestamp()
+        assert scheduler.deferred[task_id] == reset_at
+        assert scheduler.due[task_id] == reset_at
+        assert abs(scheduler.seconds_until_next() - 90 * 60) < 5
+        assert scheduler.stats()['deferredTasks'][0]['taskId'] == task_id
+
+        # 块重置：新块还没有用量，推迟的任务到期后执行
+        scheduler.token_monitor = StubTokenMonitor(active=False)
+        scheduler.defer(task_id, time.time() - 1)
+        assert scheduler.check_and_execute_tasks() == 1
+        assert pool.submitted == [task_id]
+        assert task_id not in scheduler.deferred
+
+
+def test_retries_after_60s_when_reset_unknown():
+    """块重置时间未知或已过（快照尚未刷新）：60秒后重试"""
+    print("🧪 测试重置时间未知时重试")
+    for end_in in (None, timedelta(minutes=-5)):
+        with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+            task_id = _add_task(manager, 50_000)
+            scheduler = _make_scheduler(manager, StubTokenMonitor(block_tokens=90_000, end_in=end_in), StubExecutorPool())
+            before = time.time()
+            assert scheduler.check_and_execute_tasks() == 0
+            retry_in = scheduler.deferred[task_id] - before
+            print(f"   endTime {end_in}: {retry_in:.1f}s 后重试")
+            assert TaskScheduler.DEFER_RETRY_SECONDS - 1 < retry_in < TaskScheduler.DEFER_RETRY_SECONDS + 5
+
+
+def test_oversized_estimate_runs_in_fresh_block():
+    """估算本身超过上限的任务按上限计：块中已有用量时推迟，新块（无用量）开始时执行一次"""
+    print("🧪 测试估算超过上限的任务")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        task_id = _add_task(manager, 5 * CEILING)
+        pool = StubExecutorPool()
+        scheduler = _make_scheduler(manager, StubTokenMonitor(block_tokens=1_000), pool)
+        assert scheduler.check_and_execute_tasks() == 0
+        assert task_id in scheduler.deferred
+
+        scheduler.token_monitor = StubTokenMonitor(active=False)
+        scheduler.defer(task_id, time.time() - 1)
+        assert scheduler.check_and_execute_tasks() == 1
+        assert pool.submitted == [task_id]
+
+
+def test_budget_does_not_double_count_running_tasks():
+    """已承诺 = 块已用量 + 排队任务估算 + 执行中任务的剩余估算（不使用已外推执行中用量的预计总量）"""
+    print("🧪 测试已承诺用量")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        running = _add_task(manager, 50_000, status='running', actual=30_000)
+        overrun = _add_task(manager, 10_000, status='running', actual=25_000)
+        queued = _add_task(manager, 15_000, status='running')
+        pool = StubExecutorPool(queued=[queued], running=[running, overrun])
+        monitor = StubTokenMonitor(block_tokens=40_000, projected=400_000)
+        scheduler = TaskScheduler(manager, pool, monitor, block_ceiling=CEILING)
+
+        budget = scheduler.admission_budget()
+        print(f"   已承诺: {budget['committed']:,}")
+        assert budget['committed'] == 40_000 + 15_000 + (50_000 - 30_000) + 0
+        assert TaskScheduler(manager, pool, monitor, block_ceiling=0).admission_budget() is None
+
+
+if __name__ == "__main__":
+    test_admits_below_ceiling()
+    test_defers_above_ceiling_until_block_reset()
+    test_retries_after_60s_when_reset_unknown()
+    test_oversized_estimate_runs_in_fresh_block()
+    test_budget_does_not_double_count_running_tasks()
+    print("✅ 全部通过")
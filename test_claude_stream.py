@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+测试 Claude CLI stream-json 输出解析 - 按消息id去重、工具调用计数、result事件覆盖、非JSON行，
+以及 result 事件报告失败时任务按失败记录（使用假的 claude 脚本）
+"""
+
+import json
+import os
+import stat
+import sys
+import tempfile
+
+from claude_executor import ClaudeExecutor
+from claude_stream import StreamJsonUsage
+
+
+def _assistant(message_id, input_tokens, output_tokens, content=()):
+    return json.dumps({'type': 'assistant', 'session_id': 's1', 'message': {
+        'id': message_id, 'model': 'claude-sonnet-4', 'content': list(content),
+        'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                  'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 10}
+    }})
+
+
+def _result(subtype='success', is_error=False, text='完成'):
+    return json.dumps({'type': 'result', 'subtype': subtype, 'is_error': is_error, 'result': text,
+                       'num_turns': 3, 'total_cost_usd': 0.05,
+                       'usage': {'input_tokens': 500, 'output_tokens': 60,
+                                 'cache_creation_input_tokens': 7, 'cache_read_input_tokens': 100}})
+
+
+def test_assistant_usage_deduped_by_message_id():
+    """同一消息的多个内容块携带相同usage，只计一次；工具调用按内容块计数"""
+    print("🧪 测试按消息id去重")
+    tracker = StreamJsonUsage()
+    assert tracker.feed(json.dumps({'type': 'system', 'subtype': 'init', 'model': 'claude-opus-4'})) is False
+    assert tracker.feed(_assistant('msg_1', 100, 5, [{'type': 'text', 'text': '开始'}])) is True
+    assert tracker.feed(_assistant('msg_1', 100, 5, [{'type': 'tool_use', 'name': 'Write'}])) is True
+    assert tracker.feed(_assistant('msg_1', 100, 5)) is False  # 完全重复：没有变化
+    assert tracker.feed(_assistant('msg_2', 200, 20, [{'type': 'tool_use', 'name': 'Bash'},
+                                                      {'type': 'tool_use', 'name': 'Read'}])) is True
+
+    usage = tracker.usage()
+    print(f"   用量: {usage}")
+    assert usage['inputTokens'] == 300
+    assert usage['outputTokens'] == 25
+    assert usage['cacheReadTokens'] == 20
+    assert usage['totalTokens'] == 345
+    assert usage['toolCalls'] == 3
+    assert usage['turns'] == 2
+    assert usage['costUsd'] is None
+    assert usage['model'] == 'claude-sonnet-4'
+    assert tracker.has_usage and tracker.session_id == 's1'
+
+
+def test_result_event_overrides_message_totals():
+    """result 事件的总用量、费用与轮数为准"""
+    print("🧪 测试result事件覆盖")
+    tracker = StreamJsonUsage()
+    tracker.feed(_assistant('msg_1', 100, 5))
+    tracker.feed(_result())
+    usage = tracker.usage()
+    assert (usage['inputTokens'], usage['outputTokens'], usage['cacheCreationTokens'], usage['cacheReadTokens']) == \
+        (500, 60, 7, 100)
+    assert usage['totalTokens'] == 667
+    assert usage['costUsd'] == 0.05
+    assert usage['turns'] == 3
+    assert tracker.result_text == '完成'
+    assert tracker.is_error is False
+    assert tracker.error_message() is None
+
+
+def test_error_result():
+    """is_error 或非 success 的 subtype 视为失败"""
+    print("🧪 测试失败的result事件")
+    tracker = StreamJsonUsage()
+    tracker.feed(_result(subtype='error_max_turns', text=''))
+    assert tracker.is_error is True
+    assert tracker.error_message() == 'Claude执行出错（error_max_turns）'
+
+    tracker = StreamJsonUsage()
+    tracker.feed(_result(subtype='success', is_error=True, text='API Error: overloaded'))
+    assert tracker.error_message() == 'Claude执行出错（success）: API Error: overloaded'
+
+
+def test_malformed_and_non_json_lines_ignored():
+    """非JSON行（stderr）、损坏的JSON、非对象JSON与未知事件都被忽略"""
+    print("🧪 测试非JSON行")
+    tracker = StreamJsonUsage()
+    for line in ('', 'Warning: something on stderr', '{"type": "assistant", "message": ', '[1, 2]', '{}',
+                 json.dumps({'type': 'user', 'message': {'content': []}}),
+                 json.dumps({'type': 'assistant', 'message': 'not a dict'})):
+        assert tracker.feed(line) is False, line
+    assert not tracker.has_usage
+    assert tracker.usage()['totalTokens'] == 0
+    assert tracker.events == 3  # 解析成功的JSON对象
+
+
+FAKE_CLAUDE = f'''#!{sys.executable}
+import json, sys
+if '--version' in sys.argv:
+    print('0.0.0 (fake)')
+    sys.exit(0)
+if '--help' in sys.argv:
+    print('  -p, --print  --dangerously-skip-permissions  --output-format <format> (text, json, stream-json)  --verbose')
+    sys.exit(0)
+open('index.html', 'w').write('<h1>partial</h1>')
+print({_assistant('msg_1', 100, 5)!r}, flush=True)
+print({_result(subtype='error_max_turns', text='')!r}, flush=True)
+'''
+
+
+def test_error_result_fails_task():
+    """stream-json 模式下 result 报告失败：任务失败（不用内置生成器兜底），已消耗的用量仍然上报"""
+    print("🧪 测试执行失败的任务")
+    original_path = os.environ.get('PATH', '')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_dir = os.path.join(tmp_dir, 'bin')
+        os.makedirs(bin_dir)
+        path = os.path.join(bin_dir, 'claude')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(FAKE_CLAUDE)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+        os.environ['PATH'] = bin_dir + os.pathsep + original_path
+        try:
+            executor = ClaudeExecutor(workspace_dir=os.path.join(tmp_dir, 'workspace'), output_format='auto')
+            reported = []
+            result = executor.execute_task(1, '失败的任务', on_usage=reported.append)
+        finally:
+            os.environ['PATH'] = original_path
+
+    print(f"   结果: {result.get('error')}")
+    assert result['success'] is False
+    assert result['error'] == 'Claude执行出错（error_max_turns）'
+    assert result['usage']['totalTokens'] == 667
+    assert reported and reported[-1]['totalTokens'] == 667
+
+
+if __name__ == "__main__":
+    test_assistant_usage_deduped_by_message_id()
+    test_result_event_overrides_message_totals()
+    test_error_result()
+    test_malformed_and_non_json_lines_ignored()
+    test_error_result_fails_task()
+    print("✅ 全部通过")
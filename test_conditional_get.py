@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+测试条件请求 - 压缩响应的ETag带编码后缀，304返回与200相同的ETag；
+Accept-Encoding 不再选择该编码时，带编码后缀的ETag不匹配；出错的历史数据不带ETag、不缓存
+直接调用 RealtimeHandler 的响应方法，不启动服务器
+"""
+
+import io
+
+import realtime_server
+from realtime_server import RealtimeHandler
+
+ETAG = RealtimeHandler.make_etag('test', 1)
+DATA = {'items': [{'id': i, 'description': f'任务 {i}'} for i in range(200)]}  # 超过压缩阈值
+
+
+class RecordingHandler(RealtimeHandler):
+    """记录状态码与头部，不经过socket"""
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.path = '/api/test'
+        self.wfile = io.BytesIO()
+        self.status = None
+        self.sent_headers = {}
+
+    def send_response(self, code, message=None):
+        self.status = code
+
+    def send_header(self, keyword, value):
+        self.sent_headers[keyword] = value
+
+    def end_headers(self):
+        pass
+
+
+def _request(accept_encoding=None, if_none_match=None):
+    headers = {}
+    if accept_encoding:
+        headers['Accept-Encoding'] = accept_encoding
+    if if_none_match:
+        headers['If-None-Match'] = if_none_match
+    handler = RecordingHandler(headers)
+    handler.send_json_response(DATA, etag=ETAG)
+    return handler.status, handler.sent_headers
+
+
+def test_not_modified_keeps_encoded_etag():
+    """gzip响应的ETag带 -gzip 后缀，用它发起的条件请求得到带同一ETag的304"""
+    print("🧪 测试304返回压缩版本的ETag")
+    status, headers = _request('gzip')
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    gzip_etag = headers['ETag']
+    assert gzip_etag == RealtimeHandler.encoded_etag(ETAG, 'gzip')
+
+    status, headers = _request('gzip, deflate', gzip_etag)
+    print(f"   200: {gzip_etag}, 304: {headers.get('ETag')}")
+    assert status == 304
+    assert headers['ETag'] == gzip_etag
+
+    # 弱比较与多个候选
+    status, headers = _request('gzip', f'"other", W/{gzip_etag}')
+    assert status == 304 and headers['ETag'] == gzip_etag
+
+
+def test_identity_etag():
+    """不压缩时ETag不带后缀，304同样返回原始ETag"""
+    print("🧪 测试未压缩的ETag")
+    status, headers = _request()
+    assert status == 200 and 'Content-Encoding' not in headers and headers['ETag'] == ETAG
+    status, headers = _request(None, ETAG)
+    assert status == 304 and headers['ETag'] == ETAG
+
+
+def test_encoded_etag_requires_same_encoding():
+    """Accept-Encoding 不再接受gzip时，-gzip 的ETag不匹配，返回完整的200"""
+    print("🧪 测试编码变化后不匹配")
+    gzip_etag = RealtimeHandler.encoded_etag(ETAG, 'gzip')
+    for accept_encoding in (None, 'identity', 'gzip;q=0'):
+        status, headers = _request(accept_encoding, gzip_etag)
+        assert status == 200, accept_encoding
+        assert headers['ETag'] == ETAG
+
+
+class StubTokenMonitor:
+    """依次返回指定的历史数据"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def get_historical_data(self, days):
+        return self.responses.pop(0)
+
+
+def test_history_errors_are_not_cached():
+    """历史数据出错（无时间戳）时不发送ETag，后续不同的错误不会复用第一次的响应"""
+    print("🧪 测试出错的历史数据不缓存")
+    original = getattr(realtime_server, 'token_monitor', None)
+    realtime_server.token_monitor = StubTokenMonitor([
+        {'error': '获取历史数据异常: 第一次', 'daily': [], 'totals': {}},
+        {'error': '获取历史数据异常: 第二次', 'daily': [], 'totals': {}},
+        {'error': None, 'daily': [], 'totals': {}, 'timestamp': 't1'},
+    ])
+    try:
+        bodies = []
+        for _ in range(3):
+            handler = RecordingHandler({'If-None-Match': '*'})
+            handler.get_history(7)
+            bodies.append((handler.status, handler.sent_headers.get('ETag'), handler.wfile.getvalue()))
+    finally:
+        realtime_server.token_monitor = original
+
+    assert [status for status, _, _ in bodies] == [200, 200, 304]
+    assert bodies[0][1] is None and bodies[1][1] is None
+    assert '第一次'.encode('utf-8') in bodies[0][2] and '第二次'.encode('utf-8') in bodies[1][2]
+    assert bodies[2][1] == RealtimeHandler.make_etag('history', 7, 't1')
+
+
+if __name__ == "__main__":
+    test_not_modified_keeps_encoded_etag()
+    test_identity_etag()
+    test_encoded_etag_requires_same_encoding()
+    test_history_errors_are_not_cached()
+    print("✅ 全部通过")
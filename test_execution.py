@@ -4,14 +4,15 @@
 """
 
 from claude_executor import ClaudeExecutor
+import tempfile
 import time
 
 def test_claude_execution():
     """测试Claude执行"""
     print("🧪 开始测试Claude Code执行...")
     
-    # 创建执行器
-    executor = ClaudeExecutor()
+    # 创建执行器（工作目录放在临时目录，不写入 $HOME）
+    executor = ClaudeExecutor(workspace_dir=tempfile.mkdtemp(prefix='vibecodetask-test-'))
     
     # 测试任务
     test_description = "创建一个简单的HTML页面，包含标题'Hello VibeCodeTask'和一个按钮，点击按钮显示当前时间"
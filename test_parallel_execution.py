@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+测试并行执行 - 16个任务同时执行，进程工作目录不变，每个任务的文件、日志互不串扰
+使用假的 claude 脚本（放在 PATH 最前面），不需要安装 Claude CLI
+"""
+
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+from realtime_server import TaskExecutorPool
+from task_test_support import temp_task_manager
+
+PARALLEL_TASKS = 16
+
+FAKE_CLAUDE = f'''#!{sys.executable}
+import os, sys, time
+if '--version' in sys.argv:
+    print('0.0.0 (fake)')
+    sys.exit(0)
+if '--help' in sys.argv:
+    print('Usage: claude [options] [prompt]')
+    print('  -p, --print                      Print response and exit')
+    print('  --dangerously-skip-permissions   Bypass all permission checks')
+    sys.exit(0)
+prompt = sys.argv[-1]
+marker = prompt.strip().splitlines()[0]
+if marker.startswith('慢任务'):
+    print(f'{{marker}} 开始', flush=True)
+    time.sleep(120)
+for i in range(200):
+    print(f'{{marker}} 输出 {{i}}', flush=True)
+    if i % 50 == 0:
+        time.sleep(0.05)
+print(f'{{marker}} stderr', file=sys.stderr)
+with open('index.html', 'w', encoding='utf-8') as f:
+    f.write(f'<h1>{{marker}}</h1><p>{{os.getcwd()}}</p>')
+'''
+
+
+def _install_fake_claude(bin_dir):
+    path = os.path.join(bin_dir, 'claude')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(FAKE_CLAUDE)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def test_parallel_tasks_do_not_share_working_directory():
+    """16个任务并行执行：工作目录始终不变，生成文件与输出日志都落在各自任务下"""
+    print("🧪 测试16个任务并行执行")
+    original_cwd = os.getcwd()
+    original_path = os.environ.get('PATH', '')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_dir = os.path.join(tmp_dir, 'bin')
+        os.makedirs(bin_dir)
+        _install_fake_claude(bin_dir)
+        os.environ['PATH'] = bin_dir + os.pathsep + original_path
+        try:
+            with temp_task_manager(tmp_dir) as manager:
+                pool = TaskExecutorPool(manager, max_workers=PARALLEL_TASKS)
+                task_ids = [manager.add_task(f'并行任务-{i}') for i in range(PARALLEL_TASKS)]
+
+                # 执行期间持续采样进程工作目录
+                seen_cwds = set()
+                sampling = threading.Event()
+
+                def sample_cwd():
+                    while not sampling.is_set():
+                        seen_cwds.add(os.getcwd())
+                        time.sleep(0.001)
+
+                sampler = threading.Thread(target=sample_cwd)
+                sampler.start()
+                try:
+                    for task_id in task_ids:
+                        pool.submit(task_id, manager.claim_task(task_id))
+                    deadline = time.time() + 120
+                    while time.time() < deadline:
+                        stats = pool.stats()
+                        if stats['queued'] == 0 and stats['running'] == 0 and stats['completed'] == PARALLEL_TASKS:
+                            break
+                        time.sleep(0.05)
+                finally:
+                    sampling.set()
+                    sampler.join()
+                    pool.shutdown()
+
+                print(f"   采样到的工作目录: {seen_cwds}")
+                assert seen_cwds == {original_cwd}
+                assert os.getcwd() == original_cwd
+
+                for i, task_id in enumerate(task_ids):
+                    task = manager.get_task(task_id)
+                    marker = f'并行任务-{i}'
+                    assert task['status'] == 'completed', (task_id, task['status'], task['result'])
+
+                    task_dir = task['taskDirectory']
+                    assert os.path.dirname(task_dir) == os.path.join(tmp_dir, 'workspace')
+                    # 数据库与服务日志不会落进任务目录
+                    assert sorted(os.listdir(task_dir)) == ['EXECUTION_REPORT.md', 'index.html']
+                    with open(os.path.join(task_dir, 'index.html'), encoding='utf-8') as f:
+                        page = f.read()
+                    assert f'<h1>{marker}</h1>' in page
+                    assert os.path.realpath(task_dir) in page
+
+                    with open(task['logPath'], encoding='utf-8') as f:
+                        log_lines = f.read().splitlines()
+                    assert len(log_lines) == 201
+                    assert all(line.startswith(marker + ' ') for line in log_lines)
+        finally:
+            os.environ['PATH'] = original_path
+            os.chdir(original_cwd)
+    print(f"   {PARALLEL_TASKS} 个任务全部完成，文件与日志互不串扰")
+
+
+def test_shutdown_terminates_running_claude():
+    """停止执行池时终止正在运行的claude进程：运行中的任务记为失败，排队的任务放回pending"""
+    print("🧪 测试停止执行池")
+    original_path = os.environ.get('PATH', '')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_dir = os.path.join(tmp_dir, 'bin')
+        os.makedirs(bin_dir)
+        _install_fake_claude(bin_dir)
+        os.environ['PATH'] = bin_dir + os.pathsep + original_path
+        try:
+            with temp_task_manager(tmp_dir) as manager:
+                pool = TaskExecutorPool(manager, max_workers=1)
+                running_id = manager.add_task('慢任务-运行')
+                queued_id = manager.add_task('慢任务-排队')
+                pool.submit(running_id, manager.claim_task(running_id))
+                pool.submit(queued_id, manager.claim_task(queued_id))
+
+                deadline = time.time() + 30
+                while time.time() < deadline and not manager.claude_executor.processes:
+                    time.sleep(0.05)
+                assert manager.claude_executor.processes
+
+                started = time.time()
+                pool.shutdown()
+                while time.time() - started < 30 and pool.stats()['running']:
+                    time.sleep(0.05)
+                elapsed = time.time() - started
+                print(f"   停止耗时 {elapsed:.2f}s")
+                assert elapsed < 10
+                assert pool.stats()['running'] == 0
+                assert manager.get_task(running_id)['status'] == 'failed'
+                assert manager.get_task(queued_id)['status'] == 'pending'
+        finally:
+            os.environ['PATH'] = original_path
+
+
+if __name__ == "__main__":
+    test_parallel_tasks_do_not_share_working_directory()
+    test_shutdown_terminates_running_claude()
+    print("✅ 全部通过")
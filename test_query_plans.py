@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+测试tasks表热点查询的执行计划 - 10万条历史任务下都应走索引，不做全表扫描/临时排序
+"""
+
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+from realtime_server import TaskManager, SQL_PENDING_TASKS, SQL_RECOVER_STUCK_TASKS, SQL_DELETED_SINCE
+from task_test_support import temp_task_manager
+
+HISTORICAL_TASKS = 100_000
+
+
+def _plan(conn, sql, params=None):
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params or (None,) * sql.count('?')).fetchall()
+    return [row[3] for row in rows]
+
+
+def _fill_db(manager):
+    conn = sqlite3.connect(manager.db_path)
+    base = datetime(2024, 1, 1)
+    statuses = ('completed', 'completed', 'completed', 'failed')
+    conn.executemany('''
+        INSERT INTO tasks (description, type, status, scheduled_time, created_at, updated_at, files_created)
+        VALUES (?, 'immediate', ?, NULL, ?, ?, '[]')
+    ''', (
+        (f'历史任务 {i}', statuses[i % len(statuses)],
+         (base + timedelta(minutes=i)).isoformat(), (base + timedelta(minutes=i, seconds=30)).isoformat())
+        for i in range(HISTORICAL_TASKS)
+    ))
+    conn.executemany('''
+        INSERT INTO tasks (description, type, status, scheduled_time, created_at, updated_at, files_created)
+        VALUES (?, 'scheduled', ?, ?, ?, ?, '[]')
+    ''', [(f'活跃任务 {i}', 'pending' if i % 2 else 'running', datetime.now().isoformat(),
+           datetime.now().isoformat(), datetime.now().isoformat()) for i in range(20)])
+    conn.commit()
+    conn.execute('ANALYZE')
+    return conn
+
+
+def test_hot_queries_use_indexes():
+    """列表排序、调度载入、卡住任务恢复都走索引"""
+    print("🧪 测试热点查询执行计划")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        conn = _fill_db(manager)
+        expected = {
+            'pending': (SQL_PENDING_TASKS, 'idx_tasks_status_scheduled'),
+            'recover': (SQL_RECOVER_STUCK_TASKS, 'idx_tasks_status_'),
+            'changes': (TaskManager.build_changes_query(), 'idx_tasks_revision'),
+            'deleted': (SQL_DELETED_SINCE, 'idx_task_tombstones_revision'),
+        }
+        for name, (sql, index) in expected.items():
+            plan = _plan(conn, sql)
+            print(f"   {name}: {plan}")
+            assert any(index in step for step in plan), plan
+            assert not any(step == 'SCAN tasks' for step in plan), plan
+            assert not any('TEMP B-TREE' in step for step in plan), plan
+        conn.close()
+
+
+def test_paginated_list_uses_indexes():
+    """/api/tasks 游标分页（有无状态过滤）按索引顺序读取，不做临时排序"""
+    print("🧪 测试分页列表执行计划")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        conn = _fill_db(manager)
+        cursor = TaskManager.encode_cursor(datetime(2024, 3, 1).isoformat(), 5000)
+        cases = {
+            'first page': (TaskManager.build_list_query(), 'idx_tasks_created_at'),
+            'next page': (TaskManager.build_list_query(cursor=cursor), 'idx_tasks_created_at'),
+            'status page': (TaskManager.build_list_query(statuses=['failed'], cursor=cursor), 'idx_tasks_status_created'),
+        }
+        for name, ((sql, params), index) in cases.items():
+            plan = _plan(conn, sql, params)
+            print(f"   {name}: {plan}")
+            assert any(index in step for step in plan), plan
+            assert not any('TEMP B-TREE' in step for step in plan), plan
+        conn.close()
+
+
+def test_indexes_created_on_existing_database():
+    """已有的旧库在初始化时补建索引"""
+    print("🧪 测试旧库迁移")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'tasks.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            CREATE TABLE tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, description TEXT NOT NULL, type TEXT DEFAULT 'immediate',
+                status TEXT DEFAULT 'pending', scheduled_time TEXT, created_at TEXT, updated_at TEXT,
+                estimated_tokens INTEGER, actual_tokens INTEGER, result TEXT, task_directory TEXT, files_created TEXT
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+        with temp_task_manager(tmp_dir):
+            pass
+        conn = sqlite3.connect(db_path)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'tasks'")}
+        conn.close()
+        assert {'idx_tasks_status_scheduled', 'idx_tasks_created_at', 'idx_tasks_status_updated',
+                'idx_tasks_status_created', 'idx_tasks_revision'} <= indexes
+
+
+if __name__ == "__main__":
+    test_hot_queries_use_indexes()
+    test_paginated_list_uses_indexes()
+    test_indexes_created_on_existing_database()
+    print("✅ 全部通过")
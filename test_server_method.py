@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 """
-直接测试服务器中的 get_all_tasks 方法
+直接测试服务器中的 list_tasks 方法
 """
 
 import sys
 import os
+import tempfile
 sys.path.insert(0, os.path.dirname(__file__))
 
 # 导入服务器模块
@@ -14,12 +15,13 @@ try:
     print("🧪 直接测试服务器中的 TaskManager")
     print("=" * 50)
     
-    # 创建任务管理器实例
-    task_manager = TaskManager()
+    # 创建任务管理器实例（读取服务的任务库，工作目录放在临时目录）
+    workspace = tempfile.TemporaryDirectory()
+    task_manager = TaskManager(workspace_dir=workspace.name)
     
-    # 调用 get_all_tasks 方法
-    print("📋 调用 get_all_tasks 方法...")
-    tasks = task_manager.get_all_tasks()
+    # 调用 list_tasks 方法（第一页）
+    print("📋 调用 list_tasks 方法...")
+    tasks = task_manager.list_tasks()['tasks']
     
     print(f"✅ 返回 {len(tasks)} 个任务")
     
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+测试任务原子认领 - 并发调用方同一个pending任务只能被执行一次
+"""
+
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from task_test_support import temp_task_manager
+
+
+def _fake_execute(manager):
+    """替换执行器，记录实际执行的任务"""
+    executions = []
+    lock = threading.Lock()
+
+    def fake_execute(task_id, description, on_start=None, on_usage=None):
+        with lock:
+            executions.append(task_id)
+        return {'success': True, 'report': 'ok', 'task_dir': None, 'files_created': []}
+
+    manager.claude_executor.execute_task = fake_execute
+    return executions
+
+
+def test_concurrent_claims_single_winner():
+    """32个线程同时认领同一任务，只有一个成功"""
+    print("🧪 测试并发认领")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        task_id = manager.add_task('并发认领测试')
+
+        barrier = threading.Barrier(32)
+        owners = []
+
+        def claim():
+            barrier.wait()
+            owners.append(manager.claim_task(task_id))
+
+        threads = [threading.Thread(target=claim) for _ in range(32)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        winners = [owner for owner in owners if owner]
+        print(f"   认领成功: {len(winners)} / {len(owners)}")
+        assert len(winners) == 1
+
+        conn = sqlite3.connect(manager.db_path)
+        row = conn.execute('SELECT status, lease_owner, lease_expires FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        conn.close()
+        assert row[0] == 'running'
+        assert row[1] == winners[0]
+        assert row[2] is not None
+
+
+def test_concurrent_execution_runs_once():
+    """调度器与手动执行同时触发同一任务，只执行一次并释放租约"""
+    print("🧪 测试并发执行")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        executions = _fake_execute(manager)
+        task_id = manager.add_task('并发执行测试')
+
+        barrier = threading.Barrier(16)
+        results = []
+
+        def execute():
+            barrier.wait()
+            results.append(manager.execute_task_with_claude(task_id))
+
+        threads = [threading.Thread(target=execute) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        print(f"   实际执行次数: {len(executions)}")
+        assert executions == [task_id]
+        assert sum(1 for r in results if r.get('success')) == 1
+
+        conn = sqlite3.connect(manager.db_path)
+        row = conn.execute('SELECT status, lease_owner, lease_expires FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        conn.close()
+        assert row == ('completed', None, None)
+
+
+def test_recover_expired_lease():
+    """租约过期的running任务被恢复为failed，未过期的保持不变"""
+    print("🧪 测试租约过期恢复")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        expired_id = manager.add_task('租约已过期')
+        active_id = manager.add_task('租约有效')
+        manager.claim_task(expired_id, lease_seconds=60)
+        manager.claim_task(active_id, lease_seconds=60)
+
+        conn = sqlite3.connect(manager.db_path)
+        conn.execute('UPDATE tasks SET lease_expires = ? WHERE id = ?',
+                     ((datetime.now() - timedelta(seconds=1)).isoformat(), expired_id))
+        conn.commit()
+        conn.close()
+
+        manager.recover_stuck_tasks()
+
+        conn = sqlite3.connect(manager.db_path)
+        statuses = dict(conn.execute('SELECT id, status FROM tasks').fetchall())
+        conn.close()
+        assert statuses[expired_id] == 'failed'
+        assert statuses[active_id] == 'running'
+        # 已失败的任务不能再被认领
+        assert manager.claim_task(expired_id) is None
+
+
+if __name__ == "__main__":
+    test_concurrent_claims_single_winner()
+    test_concurrent_execution_runs_once()
+    test_recover_expired_lease()
+    print("✅ 全部通过")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试任务列表 - 字段投影总是包含id、游标分页、since 增量变更与删除；测试期间服务日志写入临时目录
+"""
+
+import os
+import tempfile
+
+import realtime_server
+from realtime_server import TaskManager
+from task_test_support import temp_task_manager
+
+
+def test_projection_always_includes_id():
+    """fields= 不含id时结果中仍然带id，未知字段报错"""
+    print("🧪 测试字段投影")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        task_id = manager.add_task('投影测试')
+        page = manager.list_tasks(fields=('status', 'description'))
+        print(f"   {page['tasks']}")
+        assert page['tasks'] == [{'id': task_id, 'status': 'pending', 'description': '投影测试'}]
+
+        changes = manager.list_changes(0, fields=('status',))
+        assert changes['tasks'] == [{'id': task_id, 'status': 'pending'}]
+
+        assert TaskManager.project_fields(('description', 'id')) == ('description', 'id')
+        try:
+            manager.list_tasks(fields=('status', 'secret'))
+        except ValueError as e:
+            assert 'secret' in str(e)
+        else:
+            raise AssertionError('未知字段应报错')
+
+
+def test_cursor_pagination_and_changes():
+    """游标分页按创建时间倒序且不重复；since 只返回之后的变更与删除"""
+    print("🧪 测试分页与增量变更")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        ids = [manager.add_task(f'分页任务 {i}') for i in range(5)]
+
+        seen, cursor = [], None
+        while True:
+            page = manager.list_tasks(fields=('description',), cursor=cursor, limit=2)
+            seen.extend(task['id'] for task in page['tasks'])
+            cursor = page['nextCursor']
+            if not cursor:
+                break
+        assert seen == ids[::-1]
+        assert page['counts'] == {'pending': 5, 'total': 5}
+
+        revision = page['revision']
+        manager.update_task_status(ids[0], 'running')
+        manager.delete_task(ids[1])
+        changes = manager.list_changes(revision, fields=('status',))
+        assert changes['tasks'] == [{'id': ids[0], 'status': 'running'}]
+        assert changes['deleted'] == [ids[1]]
+        assert changes['revision'] > revision and changes['reset'] is False
+
+
+def test_server_log_stays_in_temp_dir():
+    """temp_task_manager 期间服务日志写入临时目录，退出后恢复原路径"""
+    print("🧪 测试服务日志路径恢复")
+    original = realtime_server.SERVER_LOG_PATH
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with temp_task_manager(tmp_dir) as manager:
+            manager.update_task_status(manager.add_task('日志测试'), 'running')
+        assert realtime_server.SERVER_LOG_PATH == original
+        with open(os.path.join(tmp_dir, 'server.log'), encoding='utf-8') as f:
+            assert 'status -> running' in f.read()
+
+
+if __name__ == "__main__":
+    test_projection_always_includes_id()
+    test_cursor_pagination_and_changes()
+    test_server_log_stays_in_temp_dir()
+    print("✅ 全部通过")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试任务输出日志 - Range 解析、按区间读取、轮转与轮转代数标识
+"""
+
+import os
+import tempfile
+
+from task_log import TaskOutputLog, parse_byte_range, read_log_range, stat_log
+
+
+def _raises_value_error(header, size):
+    try:
+        parse_byte_range(header, size)
+    except ValueError:
+        return True
+    return False
+
+
+def test_parse_byte_range():
+    """start-end / start- / -N，多区间与格式错误按完整内容响应，无法满足的区间抛出ValueError"""
+    print("🧪 测试Range解析")
+    size = 100
+    assert parse_byte_range('bytes=0-9', size) == (0, 9)
+    assert parse_byte_range('bytes=10-', size) == (10, 99)
+    assert parse_byte_range('bytes=-10', size) == (90, 99)
+    assert parse_byte_range(' Bytes = 5 - 6 ', size) == (5, 6)
+    # 超出末尾的结束位置截断到文件末尾，后缀长度超过文件大小时返回整个文件
+    assert parse_byte_range('bytes=50-500', size) == (50, 99)
+    assert parse_byte_range('bytes=-500', size) == (0, 99)
+
+    # 不支持或格式错误：忽略Range
+    for header in (None, '', 'bytes=0-9,20-29', 'items=0-9', 'bytes=a-b', 'bytes=-', 'bytes=5', 'bytes=--5', 'bytes'):
+        assert parse_byte_range(header, size) is None, header
+
+    # 无法满足：416
+    for header, header_size in (('bytes=100-', size), ('bytes=200-300', size), ('bytes=9-0', size),
+                                ('bytes=-0', size), ('bytes=0-', 0), ('bytes=-5', 0)):
+        assert _raises_value_error(header, header_size), (header, header_size)
+
+
+def test_read_log_range():
+    """按闭区间读取字节，结束位置超出文件时读到末尾"""
+    print("🧪 测试按区间读取日志")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'task.log')
+        with open(path, 'wb') as f:
+            f.write('第一行\nline 2\n'.encode('utf-8'))
+        size, _ = stat_log(path)
+        assert read_log_range(path, 0, size - 1) == '第一行\nline 2\n'.encode('utf-8')
+        assert read_log_range(path, *parse_byte_range('bytes=-7', size)) == b'line 2\n'
+        assert read_log_range(path, 10, size + 100) == b'line 2\n'
+
+
+def test_rotation_changes_generation():
+    """超过上限时轮转为 .1/.2，日志从0开始并得到新的轮转代数；摘要保留最后若干行"""
+    print("🧪 测试日志轮转")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'logs', 'task.log')
+        with TaskOutputLog(path, max_bytes=100, backup_count=2, tail_lines=3) as output_log:
+            generations = []
+            for i in range(30):
+                output_log.write_line(f'line {i:02d} ' + 'x' * 20)
+                size, generation = stat_log(path)
+                if not generations or generations[-1][1] != generation:
+                    generations.append((i, generation, size))
+            assert output_log.total_lines == 30
+            assert output_log.tail() == '\n'.join(f'line {i:02d} ' + 'x' * 20 for i in range(27, 30))
+            assert output_log.summary().startswith('[共 30 行')
+
+        print(f"   轮转次数: {len(generations) - 1}")
+        assert len(generations) > 3
+        # 每次轮转后文件从头开始，只包含新的一行
+        assert all(size == 29 for _, _, size in generations[1:])
+        assert sorted(os.listdir(os.path.dirname(path))) == ['task.log', 'task.log.1', 'task.log.2']
+        with open(path, encoding='utf-8') as f:
+            assert f.read().splitlines()[-1].startswith('line 29')
+
+
+if __name__ == "__main__":
+    test_parse_byte_range()
+    test_read_log_range()
+    test_rotation_changes_generation()
+    print("✅ 全部通过")
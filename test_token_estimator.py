@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试Token估算 - 矩阵求逆、无样本时的先验、增量学习后估算收敛且区间收窄
+"""
+
+import math
+import os
+import sqlite3
+import tempfile
+
+import simple_server
+from realtime_server import TaskManager
+from sqlite_pool import tasks_db_path
+from task_test_support import temp_task_manager
+from token_estimator import FEATURE_NAMES, PRIOR_LOG_SIGMA, PRIOR_TOKENS, TokenEstimator, _invert, extract_features
+
+DESCRIPTION = '创建一个带排行榜的贪吃蛇游戏网页'
+
+
+def _add_completed(db_path, rows):
+    """写入已完成并记录了实际用量的任务 [(description, actual_tokens[, status])]"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany('''
+        INSERT INTO tasks (description, type, status, model, actual_tokens, created_at, updated_at)
+        VALUES (?, 'immediate', ?, 'claude-sonnet-4', ?, datetime('now'), datetime('now'))
+    ''', [(row[0], row[2] if len(row) > 2 else 'completed', row[1]) for row in rows])
+    conn.commit()
+    conn.close()
+
+
+def test_invert():
+    """Gauss-Jordan 求逆（含需要换行选主元的矩阵）"""
+    print("🧪 测试矩阵求逆")
+    matrix = [[0.0, 2.0, 1.0], [1.0, 1.0, 0.0], [2.0, 0.0, 3.0]]
+    inverse = _invert(matrix)
+    for i in range(3):
+        for j in range(3):
+            value = sum(matrix[i][k] * inverse[k][j] for k in range(3))
+            assert abs(value - (1.0 if i == j else 0.0)) < 1e-9, (i, j, value)
+
+
+def test_prior_without_samples():
+    """没有样本时：估算为先验值，区间由先验标准差决定且有上限"""
+    print("🧪 测试先验估算")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        estimator = manager.token_estimator
+        assert estimator.samples == 0
+        assert abs(estimator.sigma2 - PRIOR_LOG_SIGMA ** 2) < 1e-9
+        assert abs(estimator.weights[0] - math.log(PRIOR_TOKENS)) < 1e-9
+        assert all(abs(w) < 1e-9 for w in estimator.weights[1:])
+
+        for description in (DESCRIPTION, 'Build a REST API server with flask and tests', '修复bug'):
+            estimate = estimator.estimate(description, 'immediate')
+            print(f"   {description[:20]}: {estimate['low']:,} - {estimate['tokens']:,} - {estimate['high']:,}")
+            assert estimate['tokens'] == PRIOR_TOKENS
+            assert estimate['low'] < PRIOR_TOKENS < estimate['high']
+            assert estimate['high'] / estimate['low'] < 200
+            assert estimate['samples'] == 0 and estimate['confidence'] == 0.9
+
+
+def test_sync_converges_and_interval_narrows():
+    """增量学习：只累加新完成的任务，估算向实际用量收敛，区间随样本增加而收窄"""
+    print("🧪 测试增量学习")
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_task_manager(tmp_dir) as manager:
+        estimator = manager.token_estimator
+        actual = 120_000
+
+        widths = [math.log(estimator.estimate(DESCRIPTION)['high'] / estimator.estimate(DESCRIPTION)['low'])]
+        errors = [abs(math.log(estimator.estimate(DESCRIPTION)['tokens'] / actual))]
+        learned = 0
+        for batch in (3, 5, 10, 30):
+            # 实际用量在真实值附近小幅波动；失败的任务不参与学习
+            _add_completed(manager.db_path, [(DESCRIPTION, int(actual * (1.1 if i % 2 else 0.9))) for i in range(batch)]
+                           + [(DESCRIPTION, 5_000_000, 'failed')])
+            assert estimator.sync() == batch
+            assert estimator.sync() == 0
+            learned += batch
+            estimate = estimator.estimate(DESCRIPTION)
+            widths.append(math.log(estimate['high'] / estimate['low']))
+            errors.append(abs(math.log(estimate['tokens'] / actual)))
+            print(f"   {learned} 个样本: {estimate['low']:,} - {estimate['tokens']:,} - {estimate['high']:,}")
+            assert estimate['samples'] == learned
+            assert estimate['model'] == 'claude-sonnet-4'
+            assert estimate['low'] <= actual <= estimate['high']
+
+        assert all(later < earlier for earlier, later in zip(widths, widths[1:])), widths
+        assert all(later < earlier for earlier, later in zip(errors, errors[1:])), errors
+        assert errors[-1] < math.log(1.15)  # 48个样本后误差在15%以内（岭正则会保留少量向先验的收缩）
+        assert widths[-1] < widths[0] / 3
+
+        # 其他实例（如 simple_server）读取同一个库时看到学习后的模型
+        shared = TokenEstimator(manager.db_path).estimate(DESCRIPTION)
+        assert shared == estimator.estimate(DESCRIPTION)
+
+
+def test_features_follow_names():
+    """特征向量与 FEATURE_NAMES 对齐"""
+    print("🧪 测试特征提取")
+    features = dict(zip(FEATURE_NAMES, extract_features(DESCRIPTION, 'scheduled', 'claude-opus-4')))
+    assert len(features) == len(FEATURE_NAMES)
+    assert features['bias'] == 1.0
+    assert features['kw_game'] == 1.0 and features['kw_web'] == 1.0 and features['kw_api'] == 0.0
+    assert features['type_scheduled'] == 1.0 and features['type_immediate'] == 0.0
+    assert features['template_snake'] == 1.0
+    assert features['model_opus'] == 1.0 and features['model_sonnet'] == 0.0
+
+
+def test_servers_share_database():
+    """两个服务使用同一个任务库：默认在程序目录下，VIBE_DB_PATH 可以指定"""
+    print("🧪 测试共用任务库")
+    assert simple_server.ESTIMATOR_DB_PATH == tasks_db_path()
+    assert os.path.dirname(tasks_db_path()) == os.path.dirname(os.path.abspath(simple_server.__file__))
+    original = os.environ.get('VIBE_DB_PATH')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ['VIBE_DB_PATH'] = os.path.join(tmp_dir, 'shared.db')
+        try:
+            manager = TaskManager(workspace_dir=os.path.join(tmp_dir, 'workspace'))
+            assert manager.db_path == os.path.join(tmp_dir, 'shared.db')
+            assert TokenEstimator(tasks_db_path()).db is manager.token_estimator.db
+        finally:
+            if original is None:
+                os.environ.pop('VIBE_DB_PATH', None)
+            else:
+                os.environ['VIBE_DB_PATH'] = original
+
+
+if __name__ == "__main__":
+    test_invert()
+    test_prior_without_samples()
+    test_sync_converges_and_interval_narrows()
+    test_features_follow_names()
+    test_servers_share_database()
+    print("✅ 全部通过")
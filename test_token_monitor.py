@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+测试Token快照刷新 - 缓存过期后后台刷新；刷新失败时返回旧快照，每个缓存周期最多重试一次
+使用桩数据来源，不调用ccusage
+"""
+
+import os
+import tempfile
+import time
+
+from realtime_server import TokenMonitor
+
+
+class CountingMonitor(TokenMonitor):
+    """记录获取次数，按 responses 依次返回结果"""
+
+    def __init__(self, db_path, responses):
+        super().__init__(usage_backend='ccusage', db_path=db_path)
+        self.responses = list(responses)
+        self.fetches = 0
+
+    def _fetch_real_time_data(self):
+        self.fetches += 1
+        return dict(self.responses.pop(0) if len(self.responses) > 1 else self.responses[0])
+
+
+def _wait_for_refresh(monitor):
+    """等待后台刷新线程释放锁"""
+    deadline = time.time() + 5
+    while monitor.refresh_lock.locked() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_failed_refresh_backs_off():
+    """快照过期且刷新失败：后续请求拿到旧快照，直到下一个缓存周期才再次刷新"""
+    print("🧪 测试刷新失败后的退避")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        monitor = CountingMonitor(os.path.join(tmp_dir, 'tasks.db'), [
+            {'status': 'ok', 'timestamp': 't1'},
+            {'status': 'unknown', 'error': 'ccusage 超时'},
+        ])
+        assert monitor.get_real_time_data()['timestamp'] == 't1'
+        assert monitor.fetches == 1
+
+        # 快照过期：触发一次后台刷新（失败）
+        monitor.last_update = monitor.last_attempt = time.time() - monitor.cache_duration - 1
+        for _ in range(5):
+            data = monitor.get_real_time_data()
+            assert data['timestamp'] == 't1' and data['stale'] is True
+            _wait_for_refresh(monitor)
+        print(f"   获取次数: {monitor.fetches}")
+        assert monitor.fetches == 2
+        assert monitor.last_error_data['error'] == 'ccusage 超时'
+
+        # 下一个缓存周期再重试
+        monitor.last_attempt -= monitor.cache_duration
+        monitor.get_real_time_data()
+        _wait_for_refresh(monitor)
+        assert monitor.fetches == 3
+
+
+def test_successful_refresh_replaces_snapshot():
+    """过期后后台刷新成功，之后返回新的快照"""
+    print("🧪 测试后台刷新成功")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        monitor = CountingMonitor(os.path.join(tmp_dir, 'tasks.db'), [
+            {'status': 'ok', 'timestamp': 't1'},
+            {'status': 'ok', 'timestamp': 't2'},
+        ])
+        monitor.get_real_time_data()
+        monitor.last_update = monitor.last_attempt = time.time() - monitor.cache_duration - 1
+        monitor.get_real_time_data()
+        _wait_for_refresh(monitor)
+        data = monitor.get_real_time_data()
+        assert data['timestamp'] == 't2' and data['stale'] is False
+        assert monitor.fetches == 2
+
+
+if __name__ == "__main__":
+    test_failed_refresh_backs_off()
+    test_successful_refresh_replaces_snapshot()
+    print("✅ 全部通过")
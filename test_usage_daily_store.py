@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试每日用量汇总表的同步 - 首次回溯、已结束日期只写一次、今天按 today_max_age 刷新（包括今天没有用量的情况）
+"""
+
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+from realtime_server import UsageDailyStore
+
+
+def _day(date, tokens):
+    return {'date': date.strftime('%Y-%m-%d'), 'inputTokens': tokens, 'totalTokens': tokens, 'totalCost': 0.1,
+            'modelsUsed': ['claude-sonnet-4'], 'modelBreakdowns': []}
+
+
+def test_sync_honors_today_max_age_without_usage():
+    """今天没有用量时也记录同步时间，today_max_age 内不重复获取"""
+    print("🧪 测试今天没有用量时的刷新间隔")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = UsageDailyStore(os.path.join(tmp_dir, 'tasks.db'), backfill_days=30, today_max_age=300)
+        today = datetime.now().date()
+        calls = []
+
+        def fetch_daily(start):
+            calls.append(start)
+            return [_day(today - timedelta(days=3), 100)]
+
+        for _ in range(3):
+            store.sync(fetch_daily)
+        print(f"   获取: {calls}")
+        assert calls == [(today - timedelta(days=30)).strftime('%Y%m%d')]
+        assert [day['date'] for day in store.history((today - timedelta(days=7)).strftime('%Y%m%d'))['daily']] == \
+            [(today - timedelta(days=3)).isoformat()]
+
+        # 超过 today_max_age 后只重新获取今天
+        conn = sqlite3.connect(store.db_path)
+        conn.execute('UPDATE usage_daily_sync SET synced_at = ?', ((datetime.now() - timedelta(seconds=301)).isoformat(),))
+        conn.commit()
+        conn.close()
+        store.sync(fetch_daily)
+        assert calls[1:] == [today.strftime('%Y%m%d')]
+
+
+def test_closed_days_are_not_overwritten():
+    """已结束的日期写入后不再被覆盖，今天的数据可以刷新"""
+    print("🧪 测试已结束日期不再覆盖")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = UsageDailyStore(os.path.join(tmp_dir, 'tasks.db'), backfill_days=30, today_max_age=0)
+        today = datetime.now().date()
+        yesterday = today - timedelta(days=1)
+        store.record_days([_day(yesterday, 100), _day(today, 10)])
+        store.record_days([_day(yesterday, 999), _day(today, 20)])
+        daily = store.history(yesterday.strftime('%Y%m%d'))['daily']
+        assert [(day['date'], day['totalTokens']) for day in daily] == [(yesterday.isoformat(), 100),
+                                                                       (today.isoformat(), 20)]
+
+
+if __name__ == "__main__":
+    test_sync_honors_today_max_age_without_usage()
+    test_closed_days_are_not_overwritten()
+    print("✅ 全部通过")
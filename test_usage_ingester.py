@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+测试使用日志增量采集 - 不完整的末行、重启后去重、截断重读、5小时Block汇总与每日报告
+使用临时目录中的JSONL日志，不读取真实的 ~/.claude
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from usage_ingester import UsageIngester
+
+
+def _record(timestamp, input_tokens, output_tokens, message_id=None, request_id=None, model='claude-sonnet-4'):
+    message = {'model': model, 'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                                         'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}}
+    record = {'timestamp': timestamp, 'message': message, 'costUSD': 0.01}
+    if message_id:
+        message['id'] = message_id
+    if request_id:
+        record['requestId'] = request_id
+    return json.dumps(record)
+
+
+def _write(path, lines, mode='a', newline=True):
+    with open(path, mode, encoding='utf-8') as f:
+        f.write('\n'.join(lines) + ('\n' if newline else ''))
+
+
+def _setup(tmp_dir):
+    log_dir = os.path.join(tmp_dir, 'projects')
+    os.makedirs(os.path.join(log_dir, 'demo'))
+    return os.path.join(tmp_dir, 'tasks.db'), log_dir, os.path.join(log_dir, 'demo', 'session.jsonl')
+
+
+def _local_date(timestamp):
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).astimezone().strftime('%Y-%m-%d')
+
+
+def test_partial_trailing_line_waits_for_newline():
+    """写了一半的末行不计入，补全后下次刷新再计入"""
+    print("🧪 测试不完整的末行")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path, log_dir, log_file = _setup(tmp_dir)
+        complete = _record('2025-01-01T10:00:00Z', 100, 10, 'msg_1', 'req_1')
+        partial = _record('2025-01-01T10:05:00Z', 200, 20, 'msg_2', 'req_2')
+        _write(log_file, [complete, partial[:40]], newline=False)
+
+        ingester = UsageIngester(db_path, log_dirs=[log_dir])
+        assert ingester.refresh() == 1
+        assert ingester.offsets[log_file] == len(complete) + 1
+
+        _write(log_file, [partial[40:]])
+        assert ingester.refresh() == 1
+        totals = ingester.daily_report()['totals']
+        print(f"   合计: {totals}")
+        assert totals['inputTokens'] == 300
+        assert totals['outputTokens'] == 30
+
+
+def test_dedupe_across_restart_and_truncation():
+    """重启后从SQLite恢复；文件被截断/轮转后从头重读，已计入的记录（包括没有id的）不重复计数"""
+    print("🧪 测试重启与截断后的去重")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path, log_dir, log_file = _setup(tmp_dir)
+        lines = [
+            _record('2025-01-01T10:00:00Z', 100, 10, 'msg_1', 'req_1'),
+            _record('2025-01-01T10:01:00Z', 100, 10, 'msg_1', 'req_1'),  # 同一消息重复写出
+            _record('2025-01-01T10:02:00Z', 50, 5),                       # 没有 message.id/requestId
+        ]
+        _write(log_file, lines)
+        assert UsageIngester(db_path, log_dirs=[log_dir]).refresh() == 2
+
+        # 重启：偏移与汇总从SQLite恢复，没有新内容
+        restarted = UsageIngester(db_path, log_dirs=[log_dir])
+        assert restarted.refresh() == 0
+        assert restarted.daily_report()['totals']['inputTokens'] == 150
+
+        # 轮转：文件被替换为更短的内容，从偏移0重读
+        _write(log_file, lines[2:], mode='w')
+        assert restarted.refresh() == 0
+        # 追加新的无id记录（不同内容）仍正常计入
+        _write(log_file, [_record('2025-01-01T10:03:00Z', 7, 1)])
+        assert restarted.refresh() == 1
+
+        totals = UsageIngester(db_path, log_dirs=[log_dir]).daily_report()['totals']
+        print(f"   合计: {totals}")
+        assert totals['inputTokens'] == 157
+        assert totals['outputTokens'] == 16
+
+
+def test_block_rollup_and_daily_report():
+    """按5小时Block汇总（整点开始，超过5小时开新Block），每日报告按模型拆分"""
+    print("🧪 测试Block汇总与每日报告")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path, log_dir, log_file = _setup(tmp_dir)
+        timestamps = ['2025-01-01T10:15:00Z', '2025-01-01T11:30:00Z', '2025-01-01T16:20:00Z', '2025-01-02T12:00:00Z']
+        _write(log_file, [
+            _record(timestamps[0], 1000, 100, 'msg_1', 'req_1'),
+            _record(timestamps[1], 2000, 200, 'msg_2', 'req_2', model='claude-opus-4'),
+            _record(timestamps[2], 4000, 400, 'msg_3', 'req_3'),
+        ])
+        ingester = UsageIngester(db_path, log_dirs=[log_dir])
+        ingester.refresh()
+
+        starts = [block['start'].isoformat() for block in ingester.blocks]
+        print(f"   Block: {starts}")
+        assert starts == ['2025-01-01T10:00:00+00:00', '2025-01-01T16:00:00+00:00']
+
+        report = ingester.active_block_report(now=datetime(2025, 1, 1, 16, 40, tzinfo=timezone.utc))
+        block = report['blocks'][0]
+        assert block['startTime'] == '2025-01-01T16:00:00Z'
+        assert block['endTime'] == '2025-01-01T21:00:00Z'
+        assert block['entries'] == 1
+        assert block['totalTokens'] == 4400
+        assert block['projection']['remainingMinutes'] == 260
+        assert ingester.active_block_report(now=datetime(2025, 1, 1, 21, 0, tzinfo=timezone.utc)) == {'blocks': []}
+
+        # 重启后Block汇总从SQLite恢复
+        restarted = UsageIngester(db_path, log_dirs=[log_dir])
+        assert [block['start'].isoformat() for block in restarted.blocks] == starts
+        assert sum(c[-1] for b in restarted.blocks for c in b['models'].values()) == 3
+
+        _write(log_file, [_record(timestamps[3], 10, 1, 'msg_4', 'req_4')])
+        restarted.refresh()
+        expected = {}
+        for timestamp, tokens in zip(timestamps, (1100, 2200, 4400, 11)):
+            expected[_local_date(timestamp)] = expected.get(_local_date(timestamp), 0) + tokens
+
+        report = restarted.daily_report()
+        print(f"   每日: {[(d['date'], d['totalTokens']) for d in report['daily']]}")
+        assert {day['date']: day['totalTokens'] for day in report['daily']} == expected
+        assert report['totals']['totalTokens'] == 7711
+        opus_day = next(day for day in report['daily'] if 'claude-opus-4' in day['modelsUsed'])
+        breakdown = {b['modelName']: b['inputTokens'] for b in opus_day['modelBreakdowns']}
+        assert breakdown['claude-opus-4'] == 2000
+
+        last_date = _local_date(timestamps[3])
+        since = restarted.daily_report(since=last_date.replace('-', ''))
+        assert [day['date'] for day in since['daily']] == [last_date]
+
+
+if __name__ == "__main__":
+    test_partial_trailing_line_waits_for_newline()
+    test_dedupe_across_restart_and_truncation()
+    test_block_rollup_and_daily_report()
+    print("✅ 全部通过")
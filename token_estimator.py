@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+任务Token估算
+从 tasks 表中已完成、记录了实际用量的任务学习：特征为描述长度、关键词、任务类型、内置模板与模型，
+在 log(Token) 空间做岭回归。只保存正规方程的累计量（XᵀX、Xᵀy、yᵀy、样本数），
+新任务完成后增量累加，不需要重新扫描历史；估算同时给出90%预测区间。
+"""
+
+import json
+import math
+import threading
+from datetime import datetime
+
+from claude_executor import detect_template
+from sqlite_pool import get_pool
+
+FEATURE_VERSION = 1       # 特征定义变化时递增，已保存的模型随之重建
+PRIOR_TOKENS = 50_000     # 没有样本时的估算值（一次智能体代码生成的典型量级，含缓存Token）
+PRIOR_LOG_SIGMA = 0.7     # 先验在log空间的标准差（约±2倍为一个标准差），样本少时区间较宽
+PRIOR_STRENGTH = 2.0      # 先验相当于的样本数
+RIDGE = 4.0               # 非截距权重的L2正则（权重先验标准差约0.5）
+LENGTH_RIDGE = 16.0       # 长度特征的L2正则（弹性先验标准差约0.25），很短/很长的描述在冷启动时区间不会过宽
+LOG_CHARS_CENTER = math.log1p(100)  # 长度特征以典型描述长度为中心，冷启动时不放大区间
+LOG_WORDS_CENTER = math.log1p(15)
+Z_90 = 1.6449             # 90% 双侧区间
+
+KEYWORDS = (
+    ('game', ('game', '游戏')),
+    ('web', ('html', 'web', 'css', 'javascript', 'react', 'vue', '网页', '页面', '前端')),
+    ('api', ('api', 'server', 'backend', 'flask', 'fastapi', '后端', '服务', '接口')),
+    ('test', ('test', '测试')),
+    ('fix', ('fix', 'bug', 'debug', 'error', '修复', '报错')),
+    ('refactor', ('refactor', 'optimize', '重构', '优化')),
+    ('docs', ('readme', 'doc', '文档', '说明')),
+    ('data', ('data', 'sql', 'database', 'csv', '数据')),
+    ('script', ('script', 'cli', '脚本', '命令行')),
+    ('app', ('app', 'system', 'complete', 'full', '系统', '应用', '完整')),
+)
+TASK_TYPES = ('immediate', 'scheduled', 'smart')
+TEMPLATES = ('snake', 'flappy', 'web', 'general')
+MODEL_FAMILIES = ('opus', 'sonnet', 'haiku')
+
+FEATURE_NAMES = (
+    ('bias', 'log_chars', 'log_words')
+    + tuple(f'kw_{name}' for name, _ in KEYWORDS)
+    + tuple(f'type_{name}' for name in TASK_TYPES)
+    + tuple(f'template_{name}' for name in TEMPLATES)
+    + tuple(f'model_{name}' for name in MODEL_FAMILIES)
+)
+
+SQL_UNLEARNED_TASKS = '''
+    SELECT t.id, t.description, t.type, t.model, t.actual_tokens
+    FROM tasks t LEFT JOIN token_estimator_samples s ON s.task_id = t.id
+    WHERE t.status = 'completed' AND t.actual_tokens > 0 AND s.task_id IS NULL
+    ORDER BY t.id
+'''
+
+
+def extract_features(description, task_type=None, model=None):
+    """任务 -> 特征向量（顺序与 FEATURE_NAMES 一致）"""
+    description = description or ''
+    text = description.lower()
+    features = [1.0, math.log1p(len(description)) - LOG_CHARS_CENTER,
+                math.log1p(len(description.split())) - LOG_WORDS_CENTER]
+    features += [1.0 if any(word in text for word in words) else 0.0 for _, words in KEYWORDS]
+    features += [1.0 if task_type == name else 0.0 for name in TASK_TYPES]
+    template = detect_template(description)
+    features += [1.0 if template == name else 0.0 for name in TEMPLATES]
+    model = (model or '').lower()
+    features += [1.0 if family in model else 0.0 for family in MODEL_FAMILIES]
+    return features
+
+
+def _invert(matrix):
+    """Gauss-Jordan 求逆（矩阵经岭正则后正定，维度只有二十几）"""
+    size = len(matrix)
+    augmented = [list(row) + [1.0 if i == j else 0.0 for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(augmented[r][col]))
+        augmented[col], augmented[pivot] = augmented[pivot], augmented[col]
+        scale = augmented[col][col]
+        augmented[col] = [value / scale for value in augmented[col]]
+        for row in range(size):
+            if row != col and augmented[row][col]:
+                factor = augmented[row][col]
+                augmented[row] = [a - factor * b for a, b in zip(augmented[row], augmented[col])]
+    return [row[size:] for row in augmented]
+
+
+class TokenEstimator:
+    """增量岭回归Token估算器 - 模型存放在SQLite中，多个进程/组件共享"""
+
+    def __init__(self, db_path):
+        self.db = get_pool(db_path)
+        self.lock = threading.Lock()
+        self.size = len(FEATURE_NAMES)
+        self.init_database()
+        self._load()
+
+    def init_database(self):
+        with self.db.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS token_estimator_model (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    xtx TEXT NOT NULL,
+                    xty TEXT NOT NULL,
+                    yty REAL NOT NULL,
+                    last_model TEXT,
+                    updated_at TEXT
+                )
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS token_estimator_samples (task_id INTEGER PRIMARY KEY)')
+            row = conn.execute('SELECT version FROM token_estimator_model WHERE id = 1').fetchone()
+            if row is None or row[0] != FEATURE_VERSION:
+                # 特征定义变化：清空累计量，下次 sync() 用全部历史任务重建
+                conn.execute('DELETE FROM token_estimator_samples')
+                conn.execute('''
+                    INSERT OR REPLACE INTO token_estimator_model (id, version, samples, xtx, xty, yty, last_model, updated_at)
+                    VALUES (1, ?, 0, ?, ?, 0, NULL, ?)
+                ''', (FEATURE_VERSION, json.dumps([[0.0] * self.size for _ in range(self.size)]),
+                      json.dumps([0.0] * self.size), datetime.now().isoformat()))
+
+    def _load(self):
+        row = self.db.connection().execute(
+            'SELECT samples, xtx, xty, yty, last_model FROM token_estimator_model WHERE id = 1'
+        ).fetchone()
+        self.samples, xtx, xty, self.yty, self.last_model = row[0], json.loads(row[1]), json.loads(row[2]), row[3], row[4]
+        self._solve(xtx, xty)
+
+    def _solve(self, xtx, xty):
+        """求解 (XᵀX + Λ)w = Xᵀy + Λw₀，w₀ 只有截距为 log(PRIOR_TOKENS)"""
+        prior = [math.log(PRIOR_TOKENS)] + [0.0] * (self.size - 1)
+        penalty = [PRIOR_STRENGTH, LENGTH_RIDGE, LENGTH_RIDGE] + [RIDGE] * (self.size - 3)
+        a = [[xtx[i][j] + (penalty[i] if i == j else 0.0) for j in range(self.size)] for i in range(self.size)]
+        b = [xty[i] + penalty[i] * prior[i] for i in range(self.size)]
+        self.a_inv = _invert(a)
+        self.weights = [sum(self.a_inv[i][j] * b[j] for j in range(self.size)) for i in range(self.size)]
+        # 残差平方和 = yᵀy - 2wᵀXᵀy + wᵀXᵀXw，与先验方差按样本数加权
+        sse = self.yty - 2 * sum(w * v for w, v in zip(self.weights, xty))
+        sse += sum(self.weights[i] * xtx[i][j] * self.weights[j] for i in range(self.size) for j in range(self.size))
+        self.sigma2 = (max(sse, 0.0) + PRIOR_STRENGTH * PRIOR_LOG_SIGMA ** 2) / (self.samples + PRIOR_STRENGTH)
+
+    def _reload_if_changed(self):
+        # 其他进程/实例学习了新样本时重新载入
+        row = self.db.connection().execute('SELECT samples FROM token_estimator_model WHERE id = 1').fetchone()
+        if row and row[0] != self.samples:
+            self._load()
+
+    def estimate(self, description, task_type=None, model=None):
+        """
+        估算任务Token：返回 {'tokens', 'low', 'high', 'confidence', 'samples', 'model'}
+        tokens 为log空间预测值（中位数），[low, high] 为90%预测区间；model 缺省时用最近一次执行的模型
+        """
+        with self.lock:
+            self._reload_if_changed()
+            model = model or self.last_model
+            x = extract_features(description, task_type, model)
+            mean = sum(w * v for w, v in zip(self.weights, x))
+            leverage = sum(x[i] * self.a_inv[i][j] * x[j] for i in range(self.size) for j in range(self.size))
+            spread = Z_90 * math.sqrt(self.sigma2 * (1.0 + leverage))
+            return {
+                'tokens': int(round(math.exp(mean))),
+                'low': int(round(math.exp(mean - spread))),
+                'high': int(round(math.exp(mean + spread))),
+                'confidence': 0.9,
+                'samples': self.samples,
+                'model': model
+            }
+
+    def sync(self):
+        """把尚未学习的已完成任务累加进模型，返回新学习的样本数"""
+        with self.lock, self.db.transaction() as conn:
+            rows = conn.execute(SQL_UNLEARNED_TASKS).fetchall()
+            if not rows:
+                return 0
+            stored = conn.execute(
+                'SELECT samples, xtx, xty, yty, last_model FROM token_estimator_model WHERE id = 1'
+            ).fetchone()
+            samples, xtx, xty, yty, last_model = stored[0], json.loads(stored[1]), json.loads(stored[2]), stored[3], stored[4]
+            for task_id, description, task_type, model, actual_tokens in rows:
+                x = extract_features(description, task_type, model)
+                y = math.log(actual_tokens)
+                for i in range(self.size):
+                    if x[i]:
+                        xty[i] += x[i] * y
+                        row = xtx[i]
+                        for j in range(self.size):
+                            row[j] += x[i] * x[j]
+                yty += y * y
+                samples += 1
+                last_model = model or last_model
+            conn.execute('''
+                UPDATE token_estimator_model SET samples = ?, xtx = ?, xty = ?, yty = ?, last_model = ?, updated_at = ?
+                WHERE id = 1
+            ''', (samples, json.dumps(xtx), json.dumps(xty), yty, last_model, datetime.now().isoformat()))
+            conn.executemany('INSERT OR IGNORE INTO token_estimator_samples (task_id) VALUES (?)', [(r[0],) for r in rows])
+            self.samples, self.yty, self.last_model = samples, yty, last_model
+            self._solve(xtx, xty)
+        print(f"[TokenEstimator] 学习了 {len(rows)} 个任务，累计样本 {samples}")
+        return len(rows)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Claude 使用日志增量采集器
+直接读取 Claude Code 的本地 JSONL 使用日志，按文件偏移增量解析，
+在内存中汇总 每日 / 5小时Block / 模型 三种维度，并持久化到 SQLite，
+替代每次都全量重扫历史的 ccusage 子进程。
+"""
+
+import os
+import glob
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlite_pool import get_pool, tasks_db_path
+
+BLOCK_DURATION = timedelta(hours=5)
+SEEN_QUERY_BATCH = 500  # 每次到 usage_seen 查询的去重键数（低于SQLite参数上限）
+
+# 每百万Token价格 (输入, 输出, 缓存写入, 缓存读取)，按模型名子串匹配，先匹配更具体的
+MODEL_PRICING = [
+    ('opus-4-5', (5.0, 25.0, 6.25, 0.50)),
+    ('opus', (15.0, 75.0, 18.75, 1.50)),
+    ('sonnet', (3.0, 15.0, 3.75, 0.30)),
+    ('haiku-4-5', (1.0, 5.0, 1.25, 0.10)),
+    ('3-5-haiku', (0.80, 4.0, 1.0, 0.08)),
+    ('haiku', (0.25, 1.25, 0.30, 0.03)),
+]
+
+# 汇总计数字段顺序
+INPUT, OUTPUT, CACHE_CREATION, CACHE_READ, COST, ENTRIES = range(6)
+
+
+def default_log_dirs():
+    """Claude Code 日志目录（支持 CLAUDE_CONFIG_DIR，逗号分隔多个）"""
+    configured = os.environ.get('CLAUDE_CONFIG_DIR')
+    if configured:
+        bases = [p.strip() for p in configured.split(',') if p.strip()]
+    else:
+        bases = [os.path.expanduser('~/.config/claude'), os.path.expanduser('~/.claude')]
+    return [os.path.join(base, 'projects') for base in bases if os.path.isdir(os.path.join(base, 'projects'))]
+
+
+def calculate_cost(model, input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens):
+    """按模型价格计算费用（美元）"""
+    model = (model or '').lower()
+    for key, prices in MODEL_PRICING:
+        if key in model:
+            return (input_tokens * prices[0] + output_tokens * prices[1] +
+                    cache_creation_tokens * prices[2] + cache_read_tokens * prices[3]) / 1_000_000
+    return 0.0
+
+
+def _new_counts():
+    return [0, 0, 0, 0, 0.0, 0]
+
+
+def _total_tokens(counts):
+    return counts[INPUT] + counts[OUTPUT] + counts[CACHE_CREATION] + counts[CACHE_READ]
+
+
+class UsageIngester:
+    """增量读取Claude JSONL日志并维护使用量汇总"""
+
+    def __init__(self, db_path=None, log_dirs=None):
+        self.db_path = os.path.abspath(db_path or tasks_db_path())
+        self.db = get_pool(self.db_path)
+        self.log_dirs = log_dirs if log_dirs is not None else default_log_dirs()
+        self.lock = threading.Lock()
+        self.offsets = {}   # path -> 已处理字节偏移
+        self.daily = {}     # 'YYYY-MM-DD' -> {model: counts}
+        self.blocks = []    # [{'start', 'first', 'last', 'models': {model: counts}}]，按start排序
+        self.init_database()
+        self.load()
+
+    @property
+    def available(self):
+        """是否找到了可读取的日志目录"""
+        return bool(self.log_dirs)
+
+    def init_database(self):
+        """初始化持久化表"""
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS usage_files (
+                    path TEXT PRIMARY KEY,
+                    offset INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS usage_seen (
+                    key TEXT PRIMARY KEY
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS usage_rollups (
+                    kind TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    input_tokens INTEGER,
+                    output_tokens INTEGER,
+                    cache_creation_tokens INTEGER,
+                    cache_read_tokens INTEGER,
+                    cost REAL,
+                    entries INTEGER,
+                    first_at TEXT,
+                    last_at TEXT,
+                    PRIMARY KEY (kind, bucket, model)
+                )
+            ''')
+
+    def load(self):
+        """从SQLite恢复偏移与汇总（去重键留在 usage_seen 表中按主键查询，不载入内存）"""
+        conn = self.db.connection()
+        cursor = conn.cursor()
+        self.offsets = dict(cursor.execute('SELECT path, offset FROM usage_files'))
+
+        blocks = {}
+        for row in cursor.execute('SELECT * FROM usage_rollups'):
+            kind, bucket, model = row[0], row[1], row[2]
+            counts = [row[3], row[4], row[5], row[6], row[7], row[8]]
+            if kind == 'daily':
+                self.daily.setdefault(bucket, {})[model] = counts
+            else:
+                block = blocks.setdefault(bucket, {
+                    'start': datetime.fromisoformat(bucket),
+                    'first': datetime.fromisoformat(row[9]),
+                    'last': datetime.fromisoformat(row[10]),
+                    'models': {}
+                })
+                block['first'] = min(block['first'], datetime.fromisoformat(row[9]))
+                block['last'] = max(block['last'], datetime.fromisoformat(row[10]))
+                block['models'][model] = counts
+        self.blocks = sorted(blocks.values(), key=lambda b: b['start'])
+
+    def refresh(self):
+        """读取所有日志文件的新增内容，返回新增记录数"""
+        with self.lock:
+            new_entries = []
+            new_offsets = {}
+            for path in self._list_files():
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                offset = self.offsets.get(path, 0)
+                if size < offset:
+                    offset = 0  # 文件被截断或替换，从头读取（去重键防止重复计数）
+                if size == offset:
+                    continue
+                consumed = self._read_file(path, offset, new_entries)
+                if consumed:
+                    new_offsets[path] = offset + consumed
+
+            new_entries.sort(key=lambda e: e['timestamp'])
+            unseen = self._unseen_keys({entry['key'] for entry in new_entries})
+            new_keys = []
+            dirty_daily = set()
+            dirty_blocks = set()
+            applied = 0
+            for entry in new_entries:
+                key = entry['key']
+                if key not in unseen:
+                    continue
+                unseen.discard(key)  # 同一批次内重复的记录只计一次
+                new_keys.append(key)
+                dirty_daily.add(self._apply_daily(entry))
+                dirty_blocks.add(self._apply_block(entry))
+                applied += 1
+
+            if new_offsets:
+                self.offsets.update(new_offsets)
+                self._persist(new_offsets, new_keys, dirty_daily, dirty_blocks)
+            if applied:
+                print(f"[UsageIngester] 新增 {applied} 条使用记录")
+            return applied
+
+    def _unseen_keys(self, keys):
+        """返回尚未记录在 usage_seen 中的去重键（按主键索引分批查询）"""
+        keys = list(keys)
+        seen = set()
+        conn = self.db.connection()
+        for i in range(0, len(keys), SEEN_QUERY_BATCH):
+            batch = keys[i:i + SEEN_QUERY_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            seen.update(row[0] for row in conn.execute(
+                f'SELECT key FROM usage_seen WHERE key IN ({placeholders})', batch))
+        return set(keys) - seen
+
+    def _list_files(self):
+        files = []
+        for log_dir in self.log_dirs:
+            files.extend(glob.glob(os.path.join(log_dir, '**', '*.jsonl'), recursive=True))
+        return files
+
+    def _read_file(self, path, offset, entries):
+        """从offset读取完整行并解析，返回消费的字节数（不完整的末行留待下次）"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except OSError as e:
+            print(f"[UsageIngester] 读取文件失败 {path}: {e}")
+            return 0
+
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            return 0
+        for line in chunk[:end].split(b'\n'):
+            if b'"usage"' not in line:
+                continue
+            entry = self._parse_line(line)
+            if entry:
+                if entry['key'] is None:
+                    # 没有 message.id/requestId：以整行内容的摘要为键（含时间戳），截断或轮转后重读同一行不会重复计数
+                    entry['key'] = 'line:' + hashlib.sha1(line.strip()).hexdigest()
+                entries.append(entry)
+        return end + 1
+
+    def _parse_line(self, line):
+        """解析一行日志，返回使用记录或None"""
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        message = record.get('message')
+        if not isinstance(message, dict):
+            return None
+        usage = message.get('usage')
+        timestamp = record.get('timestamp')
+        if not isinstance(usage, dict) or not timestamp or 'input_tokens' not in usage:
+            return None
+        model = message.get('model') or 'unknown'
+        if model == '<synthetic>':
+            return None
+
+        try:
+            ts = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+
+        counts = [
+            int(usage.get('input_tokens') or 0),
+            int(usage.get('output_tokens') or 0),
+            int(usage.get('cache_creation_input_tokens') or 0),
+            int(usage.get('cache_read_input_tokens') or 0),
+        ]
+        cost = record.get('costUSD')
+        if cost is None:
+            cost = calculate_cost(model, *counts)
+
+        message_id = message.get('id')
+        request_id = record.get('requestId')
+        return {
+            'key': f"{message_id}:{request_id}" if message_id and request_id else None,
+            'timestamp': ts.astimezone(timezone.utc),
+            'model': model,
+            'counts': counts + [float(cost), 1]
+        }
+
+    @staticmethod
+    def _add_counts(target, counts):
+        for i, value in enumerate(counts):
+            target[i] += value
+
+    def _apply_daily(self, entry):
+        date = entry['timestamp'].astimezone().strftime('%Y-%m-%d')  # 按本地日期汇总
+        models = self.daily.setdefault(date, {})
+        self._add_counts(models.setdefault(entry['model'], _new_counts()), entry['counts'])
+        return date
+
+    def _apply_block(self, entry):
+        """按ccusage规则归入5小时Block：整点开始，超过5小时或空闲超过5小时开新Block"""
+        ts = entry['timestamp']
+        block = None
+        for candidate in reversed(self.blocks):
+            if candidate['start'] <= ts:
+                if ts - candidate['start'] < BLOCK_DURATION and ts - candidate['last'] < BLOCK_DURATION:
+                    block = candidate
+                break
+
+        if block is None:
+            start = ts.replace(minute=0, second=0, microsecond=0)
+            block = {'start': start, 'first': ts, 'last': ts, 'models': {}}
+            self.blocks.append(block)
+            self.blocks.sort(key=lambda b: b['start'])
+
+        block['first'] = min(block['first'], ts)
+        block['last'] = max(block['last'], ts)
+        self._add_counts(block['models'].setdefault(entry['model'], _new_counts()), entry['counts'])
+        return block['start']
+
+    def _persist(self, new_offsets, new_keys, dirty_daily, dirty_blocks):
+        """把本次变更写入SQLite"""
+        rows = []
+        for date in dirty_daily:
+            for model, c in self.daily[date].items():
+                rows.append(('daily', date, model, *c, None, None))
+        for block in self.blocks:
+            if block['start'] in dirty_blocks:
+                for model, c in block['models'].items():
+                    rows.append(('block', block['start'].isoformat(), model, *c,
+                                 block['first'].isoformat(), block['last'].isoformat()))
+
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('INSERT OR REPLACE INTO usage_files (path, offset) VALUES (?, ?)',
+                               list(new_offsets.items()))
+            cursor.executemany('INSERT OR IGNORE INTO usage_seen (key) VALUES (?)', [(k,) for k in new_keys])
+            cursor.executemany('INSERT OR REPLACE INTO usage_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    @staticmethod
+    def _format_counts(counts):
+        return {
+            'inputTokens': counts[INPUT],
+            'outputTokens': counts[OUTPUT],
+            'cacheCreationTokens': counts[CACHE_CREATION],
+            'cacheReadTokens': counts[CACHE_READ],
+            'totalTokens': _total_tokens(counts),
+            'totalCost': counts[COST]
+        }
+
+    def daily_report(self, since=None):
+        """返回与 `ccusage daily --json` 结构一致的每日报告，since 为 YYYYMMDD 或 YYYY-MM-DD"""
+        since_date = None
+        if since:
+            since = since.replace('-', '')
+            since_date = f"{since[:4]}-{since[4:6]}-{since[6:8]}"
+
+        with self.lock:
+            daily = []
+            totals = _new_counts()
+            for date in sorted(self.daily):
+                if since_date and date < since_date:
+                    continue
+                day_counts = _new_counts()
+                breakdowns = []
+                for model, counts in sorted(self.daily[date].items()):
+                    self._add_counts(day_counts, counts)
+                    breakdown = self._format_counts(counts)
+                    breakdowns.append({
+                        'modelName': model,
+                        'inputTokens': breakdown['inputTokens'],
+                        'outputTokens': breakdown['outputTokens'],
+                        'cacheCreationTokens': breakdown['cacheCreationTokens'],
+                        'cacheReadTokens': breakdown['cacheReadTokens'],
+                        'cost': breakdown['totalCost']
+                    })
+                self._add_counts(totals, day_counts)
+                day = {'date': date}
+                day.update(self._format_counts(day_counts))
+                day['modelsUsed'] = [b['modelName'] for b in breakdowns]
+                day['modelBreakdowns'] = breakdowns
+                daily.append(day)
+
+        return {'daily': daily, 'totals': self._format_counts(totals)}
+
+    def active_block_report(self, now=None):
+        """返回与 `ccusage blocks --json --active` 结构一致的活跃Block报告"""
+        now = now or datetime.now(timezone.utc)
+        with self.lock:
+            if not self.blocks:
+                return {'blocks': []}
+            block = self.blocks[-1]
+            end = block['start'] + BLOCK_DURATION
+            if not (now < end and now - block['last'] < BLOCK_DURATION):
+                return {'blocks': []}
+
+            counts = _new_counts()
+            for model_counts in block['models'].values():
+                self._add_counts(counts, model_counts)
+            models = sorted(block['models'])
+            first, last = block['first'], block['last']
+
+        total_tokens = _total_tokens(counts)
+        duration_minutes = max((last - first).total_seconds() / 60, 1)
+        tokens_per_minute = total_tokens / duration_minutes
+        cost_per_hour = counts[COST] / duration_minutes * 60
+        remaining_minutes = max(0, round((end - now).total_seconds() / 60))
+
+        return {'blocks': [{
+            'id': block['start'].isoformat(),
+            'startTime': block['start'].isoformat().replace('+00:00', 'Z'),
+            'endTime': end.isoformat().replace('+00:00', 'Z'),
+            'actualEndTime': last.isoformat().replace('+00:00', 'Z'),
+            'isActive': True,
+            'entries': counts[ENTRIES],
+            'tokenCounts': {
+                'inputTokens': counts[INPUT],
+                'outputTokens': counts[OUTPUT],
+                'cacheCreationInputTokens': counts[CACHE_CREATION],
+                'cacheReadInputTokens': counts[CACHE_READ]
+            },
+            'totalTokens': total_tokens,
+            'costUSD': counts[COST],
+            'models': models,
+            'burnRate': {
+                'tokensPerMinute': tokens_per_minute,
+                'costPerHour': cost_per_hour
+            },
+            'projection': {
+                'totalTokens': round(total_tokens + tokens_per_minute * remaining_minutes),
+                'totalCost': round(counts[COST] + cost_per_hour / 60 * remaining_minutes, 2),
+                'remainingMinutes': remaining_minutes
+            }
+        }]}
+
+
+if __name__ == "__main__":
+    ingester = UsageIngester()
+    print(f"日志目录: {ingester.log_dirs}")
+    ingester.refresh()
+    today = datetime.now().strftime('%Y%m%d')
+    print(json.dumps(ingester.daily_report(today), indent=2, ensure_ascii=False))
+    print(json.dumps(ingester.active_block_report(), indent=2, ensure_ascii=False))
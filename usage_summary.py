@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+历史用量概览计算
+把每日数据按列装入 array 缓冲区，一次遍历得到合计、均值、极值、
+前缀和（滚动平均与周环比由前缀和直接得出）以及按模型的拆分，
+分位数在同一列上排序一次取得。
+"""
+
+from array import array
+
+TOKEN_FIELDS = ('inputTokens', 'outputTokens', 'cacheCreationTokens', 'cacheReadTokens', 'totalTokens')
+PERCENTILES = (50, 90, 95)
+ROLLING_WINDOW = 7
+
+
+def _percentile(sorted_values, pct):
+    """线性插值分位数（sorted_values 已升序）"""
+    if not sorted_values:
+        return 0
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def _change_percent(current, previous):
+    if not previous:
+        return None
+    return round((current - previous) / previous * 100, 1)
+
+
+def summarize_daily(daily):
+    """
+    计算每日数据（ccusage daily 格式，按日期升序）的合计与概览
+    返回 (totals, summary)
+    """
+    count = len(daily)
+    tokens = array('q', bytes(8 * count))
+    costs = array('d', bytes(8 * count))
+    # 前缀和多一位，window_sum(i, j) = prefix[j] - prefix[i]
+    token_prefix = array('q', bytes(8 * (count + 1)))
+    cost_prefix = array('d', bytes(8 * (count + 1)))
+
+    totals = dict.fromkeys(TOKEN_FIELDS, 0)
+    totals['totalCost'] = 0.0
+    models = {}
+    max_index = min_index = 0
+
+    for i, day in enumerate(daily):
+        day_tokens = day.get('totalTokens', 0)
+        day_cost = day.get('totalCost', 0.0)
+        tokens[i] = day_tokens
+        costs[i] = day_cost
+        token_prefix[i + 1] = token_prefix[i] + day_tokens
+        cost_prefix[i + 1] = cost_prefix[i] + day_cost
+
+        for field in TOKEN_FIELDS:
+            totals[field] += day.get(field, 0)
+        totals['totalCost'] += day_cost
+
+        if day_tokens > tokens[max_index]:
+            max_index = i
+        if day_tokens < tokens[min_index]:
+            min_index = i
+
+        for breakdown in day.get('modelBreakdowns') or ():
+            model = models.get(breakdown.get('modelName'))
+            if model is None:
+                model = models[breakdown.get('modelName')] = {'tokens': 0, 'cost': 0.0, 'days': 0}
+            model['tokens'] += (breakdown.get('inputTokens', 0) + breakdown.get('outputTokens', 0)
+                                + breakdown.get('cacheCreationTokens', 0) + breakdown.get('cacheReadTokens', 0))
+            model['cost'] += breakdown.get('cost', 0.0)
+            model['days'] += 1
+
+    if not count:
+        return totals, {}
+
+    def window_average(prefix, start, end):
+        start = max(start, 0)
+        return (prefix[end] - prefix[start]) / (end - start) if end > start else 0
+
+    # 最近7天 vs 前面7天（不足14天时与最近7天比较，即视为持平）
+    recent_avg = window_average(token_prefix, count - ROLLING_WINDOW, count)
+    previous_avg = window_average(token_prefix, count - 2 * ROLLING_WINDOW, count - ROLLING_WINDOW) \
+        if count >= 2 * ROLLING_WINDOW else recent_avg
+    trend = 'increasing' if recent_avg > previous_avg * 1.1 else ('decreasing' if recent_avg < previous_avg * 0.9 else 'stable')
+
+    # 周环比：最近7天合计 vs 前一个7天合计
+    week_tokens = token_prefix[count] - token_prefix[max(count - ROLLING_WINDOW, 0)]
+    week_cost = cost_prefix[count] - cost_prefix[max(count - ROLLING_WINDOW, 0)]
+    if count >= 2 * ROLLING_WINDOW:
+        prev_week_tokens = token_prefix[count - ROLLING_WINDOW] - token_prefix[count - 2 * ROLLING_WINDOW]
+        prev_week_cost = cost_prefix[count - ROLLING_WINDOW] - cost_prefix[count - 2 * ROLLING_WINDOW]
+    else:
+        prev_week_tokens, prev_week_cost = 0, 0.0
+
+    sorted_tokens = sorted(tokens)
+    sorted_costs = sorted(costs)
+    total_tokens = token_prefix[count]
+    total_cost = cost_prefix[count]
+
+    summary = {
+        'totalDays': count,
+        'averageTokensPerDay': round(total_tokens / count),
+        'averageCostPerDay': round(total_cost / count, 2),
+        'maxUsageDay': {'date': daily[max_index]['date'], 'tokens': tokens[max_index], 'cost': costs[max_index]},
+        'minUsageDay': {'date': daily[min_index]['date'], 'tokens': tokens[min_index], 'cost': costs[min_index]},
+        'recentTrend': trend,
+        'recentAverage': round(recent_avg),
+        'previousAverage': round(previous_avg),
+        'rollingAverage': [
+            {'date': daily[i]['date'],
+             'tokens': round(window_average(token_prefix, i + 1 - ROLLING_WINDOW, i + 1)),
+             'cost': round(window_average(cost_prefix, i + 1 - ROLLING_WINDOW, i + 1), 4)}
+            for i in range(count)
+        ],
+        'percentiles': {
+            f'p{pct}': {'tokens': round(_percentile(sorted_tokens, pct)),
+                        'cost': round(_percentile(sorted_costs, pct), 4)}
+            for pct in PERCENTILES
+        },
+        'weekOverWeek': {
+            'tokens': week_tokens,
+            'previousTokens': prev_week_tokens,
+            'tokensChange': _change_percent(week_tokens, prev_week_tokens),
+            'cost': round(week_cost, 4),
+            'previousCost': round(prev_week_cost, 4),
+            'costChange': _change_percent(week_cost, prev_week_cost)
+        },
+        'models': {
+            name: {
+                'tokens': model['tokens'],
+                'cost': round(model['cost'], 4),
+                'days': model['days'],
+                'tokenShare': round(model['tokens'] / total_tokens * 100, 1) if total_tokens else 0,
+                'costShare': round(model['cost'] / total_cost * 100, 1) if total_cost else 0
+            }
+            for name, model in sorted(models.items(), key=lambda item: item[1]['cost'], reverse=True)
+        },
+        # 每百万Token成本
+        'costPerMillionTokens': round(total_cost / total_tokens * 1_000_000, 4) if total_tokens else 0
+    }
+    return totals, summary